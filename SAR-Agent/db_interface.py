@@ -1,55 +1,122 @@
 import snowflake.connector
 import json
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from trace_writer import get_trace_writer, close_trace_writer
 
-def read_snowflake_query(query: str, database_id: str, explaination: str,instance_id: str,):
-    with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-        f.write(f'Query: {query}\n')
-    with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-        f.write(f'Explaination of the query: {explaination}\n')
-    with open('./snowflake_credential.json', 'r') as f:
-        credential = json.load(f)
+QUERY_CACHE_SIZE = 4096
+
+_credential = None
+_pool = {}
+_pool_lock = threading.Lock()
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+def get_snowflake_credential():
+    global _credential
+    if _credential is None:
+        with open('./snowflake_credential.json', 'r') as f:
+            _credential = json.load(f)
+    return _credential
+
+def _connect(engine: str, database_id: str):
+    if engine == 'snowflake':
+        return snowflake.connector.connect(database=database_id, **get_snowflake_credential())
+    # read-only, so cached results cannot go stale because of the agent's own queries
+    return sqlite3.connect(f'file:./bird/dev_databases/{database_id}/{database_id}.sqlite?mode=ro',
+                           uri=True, check_same_thread=False)
+
+def _is_closed(engine: str, conn) -> bool:
+    return engine == 'snowflake' and conn.is_closed()
+
+@contextmanager
+def pooled_connection(engine: str, database_id: str):
+    """Borrow an idle connection to database_id, opening one if none is free.
+    Connections go back to the pool for the rest of the run instead of being closed. A connection
+    whose query raised is closed and dropped instead: an expired or broken session does not always
+    report itself as closed, and re-pooling it would fail every later query."""
+    key = (engine, database_id)
+    with _pool_lock:
+        idle = _pool.setdefault(key, [])
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _connect(engine, database_id)
     try:
-        conn = snowflake.connector.connect(
-            database=database_id,
-            **credential
-        )
+        yield conn
+    except BaseException:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        raise
+    if not _is_closed(engine, conn):
+        with _pool_lock:
+            _pool[key].append(conn)
+
+def close_connections():
+    with _pool_lock:
+        for conns in _pool.values():
+            for conn in conns:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        _pool.clear()
+
+# string literals (including Snowflake $$ strings) and quoted identifiers are matched whole, so their whitespace is kept
+_SQL_TOKEN_PATTERN = re.compile(r"\$\$.*?\$\$|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|\s+", re.DOTALL)
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace runs outside quoted literals and identifiers, and drop trailing semicolons."""
+    query = _SQL_TOKEN_PATTERN.sub(lambda match: ' ' if match.group(0).isspace() else match.group(0), query)
+    return query.strip().rstrip(';').strip()
+
+def run_query(engine: str, database_id: str, query: str):
+    """Execute query on a pooled connection, memoizing successful results by (database_id, normalized query)."""
+    key = (engine, database_id, normalize_query(query))
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            return _query_cache[key]
+    with pooled_connection(engine, database_id) as conn:
         cursor = conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-            f.write(f'Result: {result}\n')
-        return result
-    except Exception as e:
-        with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-            f.write(f'Error: {e}\n')
-        return e
+        try:
+            cursor.execute(query)
+            result = cursor.fetchall()
+        finally:
+            cursor.close()
+    with _query_cache_lock:
+        _query_cache[key] = result
+        if len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return result
 
-def read_sqlite_query(query: str, explaination: str, database_id: str, instance_id: str):
-    with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-        f.write(f'Query: {query}\n')
-    with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-        f.write(f'Explaination of the query: {explaination}\n')
+def _traced_query(engine: str, query: str, explaination: str, database_id: str, instance_id: str):
+    writer = get_trace_writer(instance_id)
+    start = time.perf_counter()
     try:
-        conn = sqlite3.connect(f'./bird/dev_databases/{database_id}/{database_id}.sqlite')
-        cursor = conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-            f.write(f'Result: {result}\n')
+        result = run_query(engine, database_id, query)
     except Exception as e:
-        with open(f'./analyze_result/{instance_id}/query_result.txt', 'a') as f:
-            f.write(f'Error: {e}\n')
+        writer.log('query', query=query, explanation=explaination, elapsed_s=time.perf_counter() - start, error=str(e))
         return e
+    writer.log('query', query=query, explanation=explaination, elapsed_s=time.perf_counter() - start, result=result)
     return result
 
+def read_snowflake_query(query: str, database_id: str, explaination: str,instance_id: str,):
+    return _traced_query('snowflake', query, explaination, database_id, instance_id)
+
+def read_sqlite_query(query: str, explaination: str, database_id: str, instance_id: str):
+    return _traced_query('sqlite', query, explaination, database_id, instance_id)
+
 def terminate(analyze_result: str, instance_id: str):
     with open(f'./analyze_result/{instance_id}/final_analyze_result.txt', 'w') as f:
         f.write(analyze_result)
+    get_trace_writer(instance_id).log('terminate', analyze_result=analyze_result)
+    close_trace_writer(instance_id)
     return "Terminate"
 
 def get_function_call():
@@ -149,7 +216,8 @@ def post_process(message: str, instance_id: str, database_id: str = None):
         if function_name == "terminate":
             result = function_list[function_name](arguments["analyze_result"], instance_id)
         else:
-            result = function_list[function_name](arguments["query"], arguments["explaination"], database_id, instance_id)
+            result = function_list[function_name](query=arguments["query"], explaination=arguments["explaination"],
+                                                  database_id=database_id, instance_id=instance_id)
 
         # Print the result
         return result
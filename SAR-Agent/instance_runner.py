@@ -0,0 +1,100 @@
+"""
+Concurrent Instance Runner
+
+This module runs SARAgent conversations for many instances on a thread pool.
+All conversations share one request/token rate limiter and one cost budget.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter on requests and tokens per minute, shared by all threads.
+    Token usage is only known after a response arrives, so a request is admitted while
+    the tokens recorded in the last window are below the limit.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 window: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self.requests = deque()
+        self.tokens = deque()
+        self.token_total = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self.requests and now - self.requests[0] >= self.window:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] >= self.window:
+            self.token_total -= self.tokens.popleft()[1]
+
+    def acquire(self):
+        """Block until one more request fits in the current window."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._expire(now)
+                wait = 0.0
+                if self.requests_per_minute and len(self.requests) >= self.requests_per_minute:
+                    wait = max(wait, self.requests[0] + self.window - now)
+                if self.tokens_per_minute and self.token_total >= self.tokens_per_minute:
+                    wait = max(wait, self.tokens[0][0] + self.window - now)
+                if wait <= 0:
+                    self.requests.append(now)
+                    return
+            time.sleep(wait)
+
+    def record(self, tokens: int):
+        """Record the tokens consumed by a finished request."""
+        with self.lock:
+            self.tokens.append((time.monotonic(), tokens))
+            self.token_total += tokens
+
+
+class CostBudget:
+    """Total cost shared by all conversations; the run stops once it reaches max_cost."""
+
+    def __init__(self, max_cost: Optional[float] = None):
+        self.max_cost = max_cost
+        self.total_cost = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, cost: float):
+        with self.lock:
+            self.total_cost += cost
+
+    def exhausted(self) -> bool:
+        return self.max_cost is not None and self.total_cost >= self.max_cost
+
+    def check(self):
+        if self.exhausted():
+            raise BudgetExceeded(f"Cost budget of ${self.max_cost} reached (spent ${self.total_cost:.4f})")
+
+
+def run_instances(data_list: List[Dict[str, Any]], process_instance: Callable[[Dict[str, Any]], Any],
+                  num_workers: int = 1):
+    """
+    Run process_instance over data_list with num_workers concurrent conversations.
+    An exception in one instance is logged and does not stop the others.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(process_instance, data): data for data in data_list}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Instance {futures[future]} failed: {e}")
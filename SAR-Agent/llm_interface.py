@@ -6,11 +6,29 @@ This module provides a unified interface for making calls to different LLM provi
 """
 
 import os
+import time
 from typing import Dict, Any, Optional, List
 import openai
 import anthropic
 from openai import OpenAI
 from pydantic import BaseModel
+from instance_runner import RateLimiter, CostBudget
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in text with a local tokenizer.
+    Falls back to four characters per token when tiktoken is unavailable.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
 
 
 class LLMInterface:
@@ -20,13 +38,23 @@ class LLMInterface:
     input/output handling and cost tracking.
     """
     
-    def __init__(self, model: str, system_prompt: str, api_key: Optional[str] = None, functions: Optional[List[Dict[str, Any]]] = None):
+    def __init__(self, model: str, system_prompt: str, api_key: Optional[str] = None, functions: Optional[List[Dict[str, Any]]] = None,
+                 rate_limiter: Optional[RateLimiter] = None, budget: Optional[CostBudget] = None,
+                 context_budget: Optional[int] = None, keep_recent: int = 6, compacted_message_tokens: int = 256,
+                 client: Optional[Any] = None):
         """
         Initialize the LLM interface.
         
         Args:
             model (str): Model identifier (e.g., 'gpt-4' or 'claude-3-sonnet-20240229')
             api_key (Optional[str]): API key for the service. If None, will try to get from environment
+            rate_limiter (Optional[RateLimiter]): Limiter shared with other concurrent conversations
+            budget (Optional[CostBudget]): Cost budget shared with other concurrent conversations
+            context_budget (Optional[int]): Estimated history size in tokens above which old tool results are compacted.
+                If None, the history is never compacted
+            keep_recent (int): Number of most recent messages that are always sent verbatim
+            compacted_message_tokens (int): Tokens kept from each compacted message
+            client (Optional[Any]): Pre-built API client, e.g. a stub in tests. If given, no API key is needed
         """
         self.model = model
         self.is_claude = 'claude' in model.lower()
@@ -37,11 +65,13 @@ class LLMInterface:
         else:
             self.api_key = os.getenv("ANTHROPIC_API_KEY" if self.is_claude else "OPENAI_API_KEY")
             
-        if not self.api_key:
+        if not self.api_key and client is None:
             raise ValueError(f"No API key provided for {'Anthropic' if self.is_claude else 'OpenAI'}")
             
         # Initialize client
-        if self.is_claude:
+        if client is not None:
+            self.client = client
+        elif self.is_claude:
             self.client = anthropic.Anthropic(api_key=self.api_key)
         else:
             self.client = OpenAI(api_key=self.api_key)
@@ -78,6 +108,20 @@ class LLMInterface:
         self.total_cost = 0.0
         self.messages = [{"role": "system", "content": system_prompt}] 
         self.functions = functions
+        self.rate_limiter = rate_limiter
+        self.budget = budget
+        self.context_budget = context_budget
+        self.keep_recent = keep_recent
+        self.compacted_message_tokens = compacted_message_tokens
+        self.message_tokens = [estimate_tokens(system_prompt)]
+        self.compacted = [False]
+        self.removed_tokens = 0
+        self.tokens_saved = 0
+        self.cost_saved = 0.0
+        self.num_calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.latencies = []
 
     
     def calculate_cost(self, input_tokens: int, output_tokens: int, cache_tokens: int = 0) -> float:
@@ -87,7 +131,7 @@ class LLMInterface:
         Args:
             input_tokens (int): Number of input tokens
             output_tokens (int): Number of output tokens
-            cache_tokens (int): Number of cached tokens (default: 0)
+            cache_tokens (int): Number of cached tokens, not included in input_tokens (default: 0)
             
         Returns:
             float: Total cost in USD
@@ -101,6 +145,38 @@ class LLMInterface:
         
         return input_cost + output_cost + cache_cost
 
+    def _append(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content})
+        self.message_tokens.append(estimate_tokens(content))
+        self.compacted.append(False)
+
+    def compact(self):
+        """
+        Truncate old tool results in place until the history fits in context_budget.
+        The system prompt, the first instruction and the keep_recent latest messages are
+        never touched. Compacting down to three quarters of the budget means the history
+        is rewritten rarely, so the sent prefix stays stable between compactions.
+        """
+        if self.context_budget is None or sum(self.message_tokens) <= self.context_budget:
+            return
+        target = self.context_budget * 3 // 4
+        total = sum(self.message_tokens)
+        for i in range(2, len(self.messages) - self.keep_recent):
+            if total <= target:
+                break
+            message = self.messages[i]
+            if message["role"] != "user" or self.compacted[i] or self.message_tokens[i] <= self.compacted_message_tokens:
+                continue
+            content = message["content"]
+            kept = content[:self.compacted_message_tokens * 4]
+            omitted = self.message_tokens[i] - estimate_tokens(kept)
+            message["content"] = f"{kept}\n... [{omitted} tokens of earlier output omitted]"
+            new_tokens = estimate_tokens(message["content"])
+            self.removed_tokens += self.message_tokens[i] - new_tokens
+            total -= self.message_tokens[i] - new_tokens
+            self.message_tokens[i] = new_tokens
+            self.compacted[i] = True
+
     def call(self, 
             message: str,
             max_tokens: int = 1000000,
@@ -117,7 +193,14 @@ class LLMInterface:
             
         Returns:
             LLMResponse: Standardized response object
+        
+        Raises:
+            BudgetExceeded: If the shared cost budget has been spent
         """
+        if self.budget:
+            self.budget.check()
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
         try:
             if self.is_claude:
                 # Make API call
@@ -137,8 +220,10 @@ class LLMInterface:
             else:
                 # Format messages for OpenAI
                 messages = [{"role": "user", "content": message}]
-                self.messages.append({"role": "user", "content": message})
+                self._append("user", message)
+                self.compact()
                 # Make API call
+                start = time.perf_counter()
                 if self.functions:
                     response = self.client.chat.completions.create(
                         model=self.model,
@@ -151,17 +236,30 @@ class LLMInterface:
                         model=self.model,
                         messages=self.messages,
                     )
+                self.latencies.append(time.perf_counter() - start)
                 # Extract response data
                 content = response.choices[0].message
-                self.messages.append({"role": "assistant", "content": str(content)})
+                self._append("assistant", str(content))
                     
                 input_tokens = response.usage.prompt_tokens
                 output_tokens = response.usage.completion_tokens
-                cached_tokens = getattr(response.usage, 'cached_tokens', 0)
+                # cached tokens are reported inside prompt_tokens, so bill them once at the cache price
+                prompt_details = getattr(response.usage, 'prompt_tokens_details', None)
+                cached_tokens = getattr(prompt_details, 'cached_tokens', 0) or 0
+                self.num_calls += 1
+                self.prompt_tokens += input_tokens
+                self.cached_tokens += cached_tokens
             
                 # Calculate and update cost
-                cost = self.calculate_cost(input_tokens, output_tokens, cached_tokens)
+                cost = self.calculate_cost(input_tokens - cached_tokens, output_tokens, cached_tokens)
                 self.total_cost += cost
+                # every token compacted away so far is a token not resent on this call
+                self.tokens_saved += self.removed_tokens
+                self.cost_saved += self.calculate_cost(self.removed_tokens, 0)
+                if self.rate_limiter:
+                    self.rate_limiter.record(input_tokens + output_tokens)
+                if self.budget:
+                    self.budget.add(cost)
             return content
             
         except Exception as e:
@@ -174,4 +272,21 @@ class LLMInterface:
         Returns:
             float: Total cost in USD
         """
-        return self.total_cost 
\ No newline at end of file
+        return self.total_cost 
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get prompt-cache and latency metrics for the calls made through this interface.
+        
+        Returns:
+            Dict[str, Any]: Number of calls, prompt and cached tokens, cache hit ratio and latencies in seconds
+        """
+        return {
+            "calls": self.num_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "total_latency": sum(self.latencies),
+            "mean_latency": sum(self.latencies) / len(self.latencies) if self.latencies else 0.0,
+            "max_latency": max(self.latencies, default=0.0),
+        }
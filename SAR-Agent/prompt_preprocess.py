@@ -1,25 +1,112 @@
+import os
 import json
+import hashlib
 import pandas as pd
+from functools import lru_cache
 
-def get_prompt(data: dict, single: bool = False):
-    prompt_file = "./prompts/prompt_user_sf.txt"
+# Prompt bundles: schema, external knowledge and gold SQL texts compiled once by
+# build_prompt_bundles(), stored deduplicated by content hash, and indexed by source
+# path together with the source file's size and mtime.
+BUNDLE_DIR = './prompt_bundles'
+
+_bundle_index = None
+_bundle_texts = {}
+_fallback_texts = {}
+
+@lru_cache(maxsize=None)
+def _read_template(prompt_file: str):
     with open(prompt_file, "r") as f:
-        prompt = f.read()
+        return f.read()
+
+def _read_text(path: str):
+    with open(path, 'r') as f:
+        return f.read()
+
+def _read_schema(path: str):
+    with open(path, 'r') as f:
+        full_schema = json.load(f)
+    return '\n'.join([f"{k}: {v}" for k, v in full_schema.items()])
+
+def _file_signature(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _load_bundle_index():
+    global _bundle_index
+    if _bundle_index is None:
+        index_file = os.path.join(BUNDLE_DIR, 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                _bundle_index = json.load(f)
+        else:
+            _bundle_index = {}
+    return _bundle_index
+
+def _load_text(path: str, loader):
+    """Return loader(path), served from the prompt bundle when it is up to date with the source file."""
+    signature = _file_signature(path)
+    entry = _load_bundle_index().get(path)
+    if entry and entry['signature'] == signature:
+        digest = entry['hash']
+        if digest not in _bundle_texts:
+            _bundle_texts[digest] = _read_text(os.path.join(BUNDLE_DIR, 'texts', f'{digest}.txt'))
+        return _bundle_texts[digest]
+    cached = _fallback_texts.get(path)
+    if cached is None or cached[0] != signature:
+        cached = _fallback_texts[path] = (signature, loader(path))
+    return cached[1]
+
+def _bundle_sources():
+    sources = []
+    if os.path.isdir('./bird/dev_databases'):
+        for db_name in sorted(os.listdir('./bird/dev_databases')):
+            sources.append((f'./bird/dev_databases/{db_name}/full_schema.json', _read_schema))
+    for file_name in ['./spider2/spider2-snow.jsonl', './spider2/spider2-snow-0713.jsonl']:
+        if not os.path.exists(file_name):
+            continue
+        with open(file_name, 'r') as f:
+            for line in f:
+                data = json.loads(line)
+                instance_id = data['instance_id']
+                sources.append((f'./spider2/gold_schema/{instance_id}/full_schema.json', _read_schema))
+                sources.append((f'./spider2/sql/{instance_id}.sql', _read_text))
+                if data['external_knowledge'] is not None:
+                    sources.append((f'./spider2/gold_schema/{instance_id}/{data["external_knowledge"]}', _read_text))
+    return sources
+
+def build_prompt_bundles():
+    """One-time pass compiling every schema, external knowledge and gold SQL text used by the prompts."""
+    global _bundle_index
+    os.makedirs(os.path.join(BUNDLE_DIR, 'texts'), exist_ok=True)
+    index = {}
+    for path, loader in _bundle_sources():
+        if path in index or not os.path.exists(path):
+            continue
+        text = loader(path)
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        text_file = os.path.join(BUNDLE_DIR, 'texts', f'{digest}.txt')
+        if not os.path.exists(text_file):
+            with open(text_file, 'w') as f:
+                f.write(text)
+        index[path] = {'signature': _file_signature(path), 'hash': digest}
+    with open(os.path.join(BUNDLE_DIR, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    _bundle_index = index
+    return index
+
+def get_prompt(data: dict, single: bool = False):
+    prompt = _read_template("./prompts/prompt_user_sf.txt")
     question = data['instruction']
     instance_id = data['instance_id']
 
-    with open(f'./spider2/gold_schema/{instance_id}/full_schema.json', 'r') as f:
-        full_schema = json.load(f)
-    schema = '\n'.join([f"{k}: {v}" for k, v in full_schema.items()])
+    schema = _load_text(f'./spider2/gold_schema/{instance_id}/full_schema.json', _read_schema)
     external_knowledge_file = data['external_knowledge']
     if data['external_knowledge'] is None:
         external_knowledge = ''
     else:
-        with open(f'./spider2/gold_schema/{instance_id}/{external_knowledge_file}', 'r') as f:
-            external_knowledge = f.read()
-    
-    with open(f'./spider2/sql/{instance_id}.sql', 'r') as f:
-        sql_query = f.read()
+        external_knowledge = _load_text(f'./spider2/gold_schema/{instance_id}/{external_knowledge_file}', _read_text)
+
+    sql_query = _load_text(f'./spider2/sql/{instance_id}.sql', _read_text)
 
 
     input_prompt = prompt.format(question=question, schema=schema, external_knowledge=external_knowledge, gold_query=sql_query)
@@ -27,17 +114,18 @@ def get_prompt(data: dict, single: bool = False):
 
 
 def get_prompt_bird(data: dict, single: bool = False):
-    prompt_file = "./prompts/prompt_user_bird.txt"
-    with open(prompt_file, "r") as f:
-        prompt = f.read()
+    prompt = _read_template("./prompts/prompt_user_bird.txt")
     question = data['question']
     db_name = data['db_id']
-    
+
     question = data['question']
     gold_query = data['SQL']
     external_knowledge = data['evidence']
-    with open(f'./bird/dev_databases/{db_name}/full_schema.json', 'r') as f:
-        full_schema = json.load(f)
-    schema = '\n'.join([f"{k}: {v}" for k, v in full_schema.items()])
+    schema = _load_text(f'./bird/dev_databases/{db_name}/full_schema.json', _read_schema)
     input_prompt = prompt.format(question=question, schema=schema, external_knowledge=external_knowledge, gold_query=gold_query)
     return input_prompt
+
+
+if __name__ == "__main__":
+    index = build_prompt_bundles()
+    print(f"Bundled {len(index)} files into {len(set(entry['hash'] for entry in index.values()))} texts under {BUNDLE_DIR}")
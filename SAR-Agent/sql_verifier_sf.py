@@ -13,9 +13,14 @@ from openai import OpenAI
 from datetime import datetime
 import pandas as pd
 from llm_interface import LLMInterface
+from instance_runner import RateLimiter, CostBudget, BudgetExceeded, run_instances
 import random
+import shutil
+import time
+import threading
 from prompt_preprocess import get_prompt, get_prompt_bird
-from db_interface import get_function_call,get_function_call_bird,post_process
+from db_interface import get_function_call,get_function_call_bird,post_process,close_connections
+from trace_writer import get_trace_writer, close_trace_writer
 import argparse
 
 # Configure logging
@@ -37,9 +42,11 @@ class SARAgent:
     subqueries and generating them step by step.
     """
     
-    def __init__(self, model: str, api_key: str, prompt: str, functions: List[Dict[str, Any]]):
+    def __init__(self, model: str, api_key: str, prompt: str, functions: List[Dict[str, Any]],
+                 rate_limiter: Optional[RateLimiter] = None, budget: Optional[CostBudget] = None,
+                 context_budget: Optional[int] = None):
         self.api_key = api_key
-        self.llm = LLMInterface(model, prompt, api_key, functions)
+        self.llm = LLMInterface(model, prompt, api_key, functions, rate_limiter, budget, context_budget)
 
 
     def generate_query(self, messages) -> Tuple[bool, str]:
@@ -51,6 +58,10 @@ class SARAgent:
         """Get the total cost of all API calls made through this interface."""
         return self.llm.get_total_cost()
 
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get prompt-cache hit ratio and latency metrics of this agent's LLM calls."""
+        return self.llm.get_metrics()
+
 def get_data_list(old_sf: bool = False):
     data_list = []
     processed_data_list = []
@@ -69,48 +80,80 @@ def get_data_list(old_sf: bool = False):
         processed_data_list.append(question_list[instance_id])
     return processed_data_list
 
+results_lock = threading.Lock()
+
+def process_instance(data: Dict[str, Any], model: str, api_key: str,
+                     rate_limiter: Optional[RateLimiter] = None, budget: Optional[CostBudget] = None,
+                     context_budget: Optional[int] = None):
+    instance_id = data['instance_id']
+    if budget and budget.exhausted():
+        return
+    if os.path.exists(f'./analyze_result/{instance_id}'):
+        return
+    os.makedirs(f'./analyze_result/{instance_id}', exist_ok=True)
+
+    input_prompt = get_prompt(data)
+    logger.info(f"Generating query for {instance_id}")
+    logger.info(f"Prompt: {input_prompt}")
+    functions = get_function_call()
+    agent = SARAgent(model, api_key, input_prompt, functions, rate_limiter, budget, context_budget)
+    user_input = 'Please judge the correctness and ambiguity of the query'
+    trace = get_trace_writer(instance_id)
+    try:
+        for i in range(30):
+            logger.info(f"[{instance_id}] Step {i}")
+            start = time.perf_counter()
+            message = agent.generate_query(user_input)
+            trace.log('llm', step=i, elapsed_s=time.perf_counter() - start, cost=agent.get_total_cost())
+            result = post_process(message, instance_id, data['db_id'])
+            logger.info(f"[{instance_id}] Message: {message}")
+            logger.info(f"[{instance_id}] Result: {result}")
+            if result == 'Terminate':
+                break
+            else:
+                user_input = 'Query running result: ' + str(result)
+    except BudgetExceeded as e:
+        # drop the partial trace so a resumed run redoes this instance
+        logger.warning(f"[{instance_id}] {e}")
+        close_trace_writer(instance_id)
+        shutil.rmtree(f'./analyze_result/{instance_id}', ignore_errors=True)
+        return
+    finally:
+        close_trace_writer(instance_id)
+
+    with results_lock:
+        with open(f'./analyze_result/results.jsonl', 'a') as f:
+            f.write(json.dumps({'instance_id': instance_id, 'cost': agent.get_total_cost(), 'step': i+1,
+                                'tokens_saved': agent.llm.tokens_saved, 'cost_saved': agent.llm.cost_saved,
+                                'metrics': agent.get_metrics()}))
+            f.write('\n')
+
 def main():
     # Example usage
     model = 'o3'
     api_key = os.getenv("ANTHROPIC_API_KEY" if 'claude' in model.lower() else "OPENAI_API_KEY")
     
-    # Initialize agent
     parser = argparse.ArgumentParser()
     parser.add_argument('--old_sf', action='store_true', help='Use old spider2-snow.jsonl')
+    parser.add_argument('--num_workers', type=int, default=1, help='Number of concurrent agent conversations')
+    parser.add_argument('--rpm', type=int, default=None, help='Global limit on LLM requests per minute')
+    parser.add_argument('--tpm', type=int, default=None, help='Global limit on LLM tokens per minute')
+    parser.add_argument('--budget', type=float, default=None, help='Stop the run once this many USD have been spent')
+    parser.add_argument('--context_budget', type=int, default=None,
+                        help='Compact old query results once the conversation exceeds this many tokens')
     args = parser.parse_args()
     old_sf = args.old_sf
+    rate_limiter = RateLimiter(args.rpm, args.tpm)
+    budget = CostBudget(args.budget)
+
     gold_data_list = get_data_list(old_sf)
-    gold_data_list.sort(key=lambda x: x['instance_id'])
-    count = 0
-    
-    for data in gold_data_list:
-        logger.info(f"Processing {count} th instance")
-        count += 1
-        if os.path.exists(f'./analyze_result/{data["instance_id"]}'):
-            continue
-        
-        instance_id = data['instance_id']
-        os.makedirs(f'./analyze_result/{instance_id}', exist_ok=True)
-
-        input_prompt = get_prompt(data)
-        logger.info(f"Generating query for {instance_id}")
-        logger.info(f"Prompt: {input_prompt}")
-        functions = get_function_call()
-        agent = SARAgent(model, api_key, input_prompt, functions)
-        user_input = 'Please judge the correctness and ambiguity of the query'
-        for i in range(30):
-            logger.info(f"Step {i}")
-            message = agent.generate_query(user_input)
-            result = post_process(message, instance_id, data['db_id'])
-            logger.info(f"Message: {message}")
-            logger.info(f"Result: {result}")
-            if result == 'Terminate':
-                break
-            else:
-                user_input = 'Query running result: ' + str(result)
-        with open(f'./analyze_result/results.jsonl', 'a') as f:
-            f.write(json.dumps({'instance_id': instance_id, 'cost': agent.get_total_cost(), 'step': i+1}))
-            f.write('\n')
+    # instances on the same database share their prompt prefix, so run them back to back for prompt caching
+    gold_data_list.sort(key=lambda x: (x['db_id'], x['instance_id']))
+    run_instances(gold_data_list, lambda data: process_instance(data, model, api_key, rate_limiter, budget, args.context_budget),
+                  num_workers=args.num_workers)
+    logger.info(f"Total cost: {budget.total_cost}")
+
+    close_connections()
 
 
 
@@ -0,0 +1,69 @@
+"""
+Tests of LLMInterface cost and metrics accounting against a stub OpenAI client.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from llm_interface import LLMInterface
+
+
+class StubCompletions:
+    def __init__(self, usages):
+        self.usages = list(usages)
+        self.requests = []
+
+    def create(self, **kwargs):
+        # the interface keeps appending to the same message list, so record what was sent
+        self.requests.append(dict(kwargs, messages=list(kwargs["messages"])))
+        usage = self.usages.pop(0)
+        message = SimpleNamespace(content="SELECT 1", function_call=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def make_interface(usages):
+    completions = StubCompletions(usages)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return LLMInterface("o4-mini", "system prompt", client=client), completions
+
+
+def make_usage(prompt_tokens, completion_tokens, cached_tokens=None):
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if cached_tokens is not None:
+        usage.prompt_tokens_details = SimpleNamespace(cached_tokens=cached_tokens)
+    return usage
+
+
+def test_cached_tokens_are_billed_once_at_the_cache_price():
+    llm, _ = make_interface([make_usage(10000, 500, cached_tokens=8000)])
+    llm.call("question")
+
+    expected = llm.calculate_cost(10000 - 8000, 500, 8000)
+    assert llm.get_total_cost() == pytest.approx(expected)
+    # 2k uncached input, 500 output and 8k cached tokens at the o4-mini prices
+    assert expected == pytest.approx(2 * 1.1 / 1000 + 0.5 * 4.4 / 1000 + 8 * 0.275 / 1000)
+
+
+def test_missing_prompt_token_details_count_as_uncached():
+    llm, _ = make_interface([make_usage(1000, 100)])
+    llm.call("question")
+
+    assert llm.get_total_cost() == pytest.approx(llm.calculate_cost(1000, 100, 0))
+    assert llm.get_metrics()["cached_tokens"] == 0
+
+
+def test_metrics_accumulate_over_calls():
+    llm, completions = make_interface([make_usage(1000, 100, cached_tokens=0), make_usage(1200, 100, cached_tokens=1024)])
+    llm.call("first question")
+    llm.call("second question")
+
+    metrics = llm.get_metrics()
+    assert metrics["calls"] == 2
+    assert metrics["prompt_tokens"] == 2200
+    assert metrics["cached_tokens"] == 1024
+    assert metrics["cache_hit_ratio"] == pytest.approx(1024 / 2200)
+    assert len(llm.latencies) == 2
+    assert metrics["max_latency"] >= metrics["mean_latency"] >= 0
+    # the second request resends the first exchange as its prefix
+    assert completions.requests[1]["messages"][:2] == completions.requests[0]["messages"]
@@ -0,0 +1,97 @@
+"""
+Trace Writer
+
+This module writes the per-instance audit trail of a SARAgent run as JSONL.
+Records are queued by the agent thread and formatted and written by a background
+thread, so the cost of logging does not grow with result sizes or step counts.
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from typing import Any, Dict
+
+PREVIEW_CHARS = 2000
+SPILL_ROWS = 10000
+
+_writers: Dict[str, "TraceWriter"] = {}
+_writers_lock = threading.Lock()
+
+
+class TraceWriter:
+    """
+    Buffered JSONL writer for analyze_result/<instance_id>/trace.jsonl.
+    Query results longer than preview_chars are truncated in the trace and their first
+    spill_rows rows are written to a side file under results/.
+    """
+
+    def __init__(self, instance_dir: str, preview_chars: int = PREVIEW_CHARS, spill_rows: int = SPILL_ROWS):
+        self.instance_dir = instance_dir
+        self.preview_chars = preview_chars
+        self.spill_rows = spill_rows
+        self.step = None
+        self.seq = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, event: str, **fields: Any):
+        """Queue a record; step is remembered from the last record that set it."""
+        self.step = fields.pop('step', self.step)
+        self.seq += 1
+        self.queue.put({'seq': self.seq, 'step': self.step, 'event': event, 'time': time.time(), **fields})
+
+    def close(self):
+        """Write all queued records and wait for the background thread to finish."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _format(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if 'result' not in record:
+            return record
+        result = record['result']
+        if isinstance(result, list):
+            record['rows'] = len(result)
+            result = result[:self.spill_rows]
+        text = str(result)
+        if len(text) > self.preview_chars or record.get('rows', 0) > self.spill_rows:
+            spill_file = os.path.join('results', f"{record['seq']}.txt")
+            os.makedirs(os.path.join(self.instance_dir, 'results'), exist_ok=True)
+            with open(os.path.join(self.instance_dir, spill_file), 'w') as f:
+                if isinstance(result, list):
+                    for row in result:
+                        f.write(f'{row}\n')
+                else:
+                    f.write(text)
+            record['result'] = text[:self.preview_chars]
+            record['truncated'] = True
+            record['result_file'] = spill_file
+        else:
+            record['result'] = text
+        return record
+
+    def _run(self):
+        with open(os.path.join(self.instance_dir, 'trace.jsonl'), 'a') as f:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                f.write(json.dumps(self._format(record), default=str))
+                f.write('\n')
+
+
+def get_trace_writer(instance_id: str) -> TraceWriter:
+    with _writers_lock:
+        writer = _writers.get(instance_id)
+        if writer is None:
+            writer = _writers[instance_id] = TraceWriter(f'./analyze_result/{instance_id}')
+        return writer
+
+
+def close_trace_writer(instance_id: str):
+    with _writers_lock:
+        writer = _writers.pop(instance_id, None)
+    if writer is not None:
+        writer.close()
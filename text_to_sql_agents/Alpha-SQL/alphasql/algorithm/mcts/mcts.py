@@ -1,11 +1,18 @@
 from alphasql.algorithm.mcts.mcts_node import *
 from alphasql.algorithm.mcts.mcts_action import *
 from alphasql.algorithm.mcts.reward import *
+from alphasql.algorithm.mcts.mcts_checkpoint import MCTSTreeCheckpoint, get_tree_checkpoint_path
 from alphasql.runner.task import Task
+from alphasql.llm_call.openai_llm import get_llm_call_count
+import hashlib
+import json
 import math
 import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import pickle
 
 class MCTSSolver:
@@ -17,7 +24,13 @@ class MCTSSolver:
                  exploration_constant: float,
                  save_root_dir: str,
                  llm_kwargs: Dict[str, Any],
-                 reward_model: RewardModel):
+                 reward_model: RewardModel,
+                 n_parallel_rollouts: int = 1,
+                 virtual_loss: float = 1.0,
+                 deterministic_rollouts: bool = False,
+                 random_seed: Optional[int] = None,
+                 use_transposition_table: bool = False,
+                 save_pickled_paths: bool = False):
         self.llm_kwargs = llm_kwargs
         self.reward_model = reward_model
         self.task = task
@@ -26,24 +39,130 @@ class MCTSSolver:
         self.max_depth = max_depth
         self.exploration_constant = exploration_constant
         self.save_root_dir = save_root_dir
+        self.n_parallel_rollouts = max(1, n_parallel_rollouts)
+        self.virtual_loss = virtual_loss
+        self.deterministic_rollouts = deterministic_rollouts
+        self.random_seed = random_seed
+        # state shared by parallel rollouts, keyed by id(): nodes are not hashable by their reasoning state, and this bookkeeping is per node object
+        self.tree_condition = threading.Condition()
+        self.virtual_visits: Dict[int, int] = defaultdict(int)
+        self.expanding_node_ids = set()
+        # equivalent reasoning states share one node, so the search tree becomes a DAG and
+        # rollouts backpropagate along the path they took instead of the parent links
+        self.use_transposition_table = use_transposition_table
+        self.transposition_table: Dict[str, MCTSNode] = {}
+        self.n_merged_nodes = 0
+        self.expansion_llm_calls: Dict[int, int] = {}
+        self.expanded_via: Dict[int, Optional[int]] = {}
+        self.transposed_edges = set()
+        self.llm_calls_avoided = 0
+        self.save_pickled_paths = save_pickled_paths
+        self.checkpoint: Optional[MCTSTreeCheckpoint] = None
     
-    def select(self, node: MCTSNode) -> MCTSNode:
+    def get_visit_stats(self, node: MCTSNode) -> Tuple[float, float]:
+        # rollouts in flight count as visits with reward -virtual_loss, steering concurrent selections apart
+        virtual_visits = self.virtual_visits.get(id(node), 0)
+        return node.N + virtual_visits, node.Q - self.virtual_loss * virtual_visits
+    
+    def get_state_key(self, node: MCTSNode) -> str:
+        # the accumulated reasoning state: what the remaining actions can do and everything they condition on
+        selected_schema = None
+        if node.selected_schema_dict is not None:
+            selected_schema = sorted((table_name.lower(), column_name.lower()) for table_name, table_schema in node.selected_schema_dict.items() for column_name in table_schema.columns)
+        valid_actions = sorted(action.__class__.__name__ for action in get_valid_action_space_for_node(node))
+        text_fields = [node.rephrased_question, node.identified_column_values, node.identified_column_functions, node.sql_query, node.revised_sql_query]
+        state = [node.node_type == MCTSNodeType.END, valid_actions, selected_schema] + [field.strip() if isinstance(field, str) else field for field in text_fields]
+        return hashlib.sha256(json.dumps(state).encode("utf-8")).hexdigest()
+    
+    def visit_child(self, parent_node: MCTSNode, child_node: MCTSNode):
+        # a shared node reached from a parent other than the one it was expanded from saves its expansion;
+        # counted once per edge, so deeper re-expansions the duplicate subtree would have needed are not included
+        if child_node.children and self.expanded_via.get(id(child_node)) != id(parent_node) and (id(parent_node), id(child_node)) not in self.transposed_edges:
+            self.transposed_edges.add((id(parent_node), id(child_node)))
+            self.llm_calls_avoided += self.expansion_llm_calls.get(id(child_node), 0)
+    
+    def select_path(self, node: MCTSNode) -> List[MCTSNode]:
+        path = [node]
         current = node
         while current.children and not current.is_terminal():
-            if not all(child.N > 0 for child in current.children):
-                return next(child for child in current.children if child.N == 0)
+            children_stats = [self.get_visit_stats(child) for child in current.children]
+            if not all(child_N > 0 for child_N, _ in children_stats):
+                child = next(child for child, (child_N, _) in zip(current.children, children_stats) if child_N == 0)
+            else:
+                current_N, _ = self.get_visit_stats(current)
+                child = max(zip(current.children, children_stats), key=lambda item: (item[1][1] / item[1][0]) + self.exploration_constant * math.sqrt(math.log(current_N) / item[1][0]))[0]
+            # unvisited children shared through the transposition table may already be expanded
+            self.visit_child(current, child)
+            path.append(child)
+            current = child
+        return path
+    
+    def select(self, node: MCTSNode) -> MCTSNode:
+        return self.select_path(node)[-1]
+    
+    def create_children(self, node: MCTSNode) -> List[MCTSNode]:
+        llm_calls = get_llm_call_count()
+        if self.deterministic_rollouts and self.use_transposition_table:
+            # a shared node may be expanded by any of the rollouts reaching it, so its samples are seeded by its state
+            previous_rng = get_rng()
+            set_rollout_rng(random.Random(f"{self.random_seed}-{self.task.question_id}-{self.get_state_key(node)}"))
+        children = []
+        try:
+            valid_action_space = get_valid_action_space_for_node(node)
+            for action in valid_action_space:
+                action_nodes = action.create_children_nodes(node, self.llm_kwargs)
+                children.extend(action_nodes)
             
-            current = max(current.children, key=lambda child: (child.Q / child.N) + self.exploration_constant * math.sqrt(math.log(current.N) / child.N))
-        return current
+            get_rng().shuffle(children)
+        finally:
+            if self.deterministic_rollouts and self.use_transposition_table:
+                set_rollout_rng(previous_rng if previous_rng is not random else None)
+        self.expansion_llm_calls[id(node)] = get_llm_call_count() - llm_calls
+        return children
+    
+    def attach_children(self, node: MCTSNode, children: List[MCTSNode], parent_node: Optional[MCTSNode] = None, register: bool = True) -> List[Tuple[str, MCTSNode]]:
+        # replaces children equivalent to known states by the known nodes; returns the new states
+        self.expanded_via[id(node)] = id(parent_node) if parent_node is not None else None
+        if not self.use_transposition_table:
+            node.children = children
+            self.record_children(node)
+            return []
+        attached_children = []
+        attached_ids = set()
+        new_states = []
+        for child in children:
+            if child.is_terminal():
+                # end nodes cost no LLM call and each one is a reasoning path for the selection stage
+                attached_children.append(child)
+                continue
+            state_key = self.get_state_key(child)
+            known_child = self.transposition_table.get(state_key) or next((new_child for new_key, new_child in new_states if new_key == state_key), None)
+            if known_child is not None:
+                self.n_merged_nodes += 1
+                if id(known_child) not in attached_ids:
+                    attached_ids.add(id(known_child))
+                    attached_children.append(known_child)
+                continue
+            attached_children.append(child)
+            attached_ids.add(id(child))
+            new_states.append((state_key, child))
+        node.children = attached_children
+        self.record_children(node)
+        if register:
+            self.register_states(new_states)
+        return new_states
+    
+    def record_children(self, node: MCTSNode):
+        if self.checkpoint is not None:
+            self.checkpoint.record_children(node)
     
-    def expand(self, node: MCTSNode) -> List[MCTSNode]:
+    def register_states(self, states: List[Tuple[str, MCTSNode]]):
+        for state_key, node in states:
+            self.transposition_table.setdefault(state_key, node)
+    
+    def expand(self, node: MCTSNode, parent_node: Optional[MCTSNode] = None) -> List[MCTSNode]:
         assert node.children == [], f"Children nodes of node {node.node_type} before expansion is not empty"
-        valid_action_space = get_valid_action_space_for_node(node)
-        for action in valid_action_space:
-            action_nodes = action.create_children_nodes(node, self.llm_kwargs)
-            node.children.extend(action_nodes)
-        
-        random.shuffle(node.children)
+        self.attach_children(node, self.create_children(node), parent_node)
         
         # three special actions: EndAction, SQLGenerationAction, SQLRevisionAction
         # they only generate one child node each time
@@ -54,33 +173,150 @@ class MCTSSolver:
         #     n_special_actions * 1, \
         #     f"Number of children nodes is not expected, expected: {n_not_special_actions * self.llm_kwargs.get('n', 1) + n_special_actions * 1}, actual: {len(node.children)}"
 
-    def simulate(self, node: MCTSNode) -> MCTSNode:
-        assert node.children == [], f"Node before simulation have non-empty children"
+    def simulate(self, node: MCTSNode, path: Optional[List[MCTSNode]] = None) -> MCTSNode:
+        assert node.children == [] or self.use_transposition_table, f"Node before simulation have non-empty children"
+        path = path if path is not None else [node]
         current = node
         while not current.is_terminal():
-            self.expand(current)
-            current = random.choice(current.children)
+            # nodes shared through the transposition table may already be expanded
+            if not current.children:
+                self.expand(current, path[-2] if len(path) > 1 else None)
+            next_node = get_rng().choice(current.children)
+            self.visit_child(current, next_node)
+            path.append(next_node)
+            current = next_node
         return current
 
-    def backpropagate(self, node: MCTSNode):
+    def backpropagate(self, node: MCTSNode, path: Optional[List[MCTSNode]] = None):
         print("Backpropagate, Final SQL Query: ", node.final_sql_query)
         current = node
         if current.N == 0:
             reward = self.reward_model.get_reward(current)
         else:
             reward = current.Q / current.N
-        while current is not None:
-            current.N += 1
-            current.Q += reward
-            current = current.parent_node
+        if path is None:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = current.parent_node
+        for path_node in path:
+            path_node.N += 1
+            path_node.Q += reward
+        if self.checkpoint is not None:
+            self.checkpoint.record_rollout(path, reward)
+    
+    def add_virtual_visits(self, path: List[MCTSNode], count: int):
+        for path_node in path:
+            self.virtual_visits[id(path_node)] += count
+            if self.virtual_visits[id(path_node)] == 0:
+                del self.virtual_visits[id(path_node)]
+    
+    def reserve_leaf(self, root_node: MCTSNode) -> Optional[List[MCTSNode]]:
+        # must be called holding tree_condition; returns None if the selected leaf is being expanded by another rollout
+        path = self.select_path(root_node)
+        leaf_node = path[-1]
+        if id(leaf_node) in self.expanding_node_ids:
+            return None
+        if not leaf_node.is_terminal():
+            self.expanding_node_ids.add(id(leaf_node))
+        self.add_virtual_visits(path, 1)
+        return path
+    
+    def run_rollout(self, path: List[MCTSNode], rng: Optional[random.Random] = None) -> Tuple[List[MCTSNode], List[Tuple[str, MCTSNode]]]:
+        # expands and simulates from a reserved leaf without holding the lock during LLM calls;
+        # returns the rollout path and, when registration is deferred, the new states it created
+        set_rollout_rng(rng)
+        reserved_node = path[-1] if not path[-1].is_terminal() else None
+        new_states = []
+        try:
+            current = path[-1]
+            while not current.is_terminal():
+                children = self.create_children(current)
+                with self.tree_condition:
+                    new_states.extend(self.attach_children(current, children, path[-2] if len(path) > 1 else None, register=not self.deterministic_rollouts))
+                    self.expanding_node_ids.discard(id(current))
+                    reserved_node = None
+                    self.tree_condition.notify_all()
+                    # descend through shared nodes expanded by other rollouts, waiting for those being expanded
+                    while True:
+                        next_node = get_rng().choice(current.children)
+                        self.visit_child(current, next_node)
+                        path.append(next_node)
+                        self.virtual_visits[id(next_node)] += 1
+                        while id(next_node) in self.expanding_node_ids:
+                            self.tree_condition.wait()
+                        if next_node.is_terminal() or not next_node.children:
+                            break
+                        current = next_node
+                    if not next_node.is_terminal():
+                        self.expanding_node_ids.add(id(next_node))
+                        reserved_node = next_node
+                current = next_node
+            return path, new_states
+        except BaseException:
+            with self.tree_condition:
+                if reserved_node is not None:
+                    self.expanding_node_ids.discard(id(reserved_node))
+                self.add_virtual_visits(path, -1)
+                self.tree_condition.notify_all()
+            raise
+        finally:
+            set_rollout_rng(None)
+    
+    def finish_rollout(self, path: List[MCTSNode]):
+        with self.tree_condition:
+            self.add_virtual_visits(path, -1)
+            self.backpropagate(path[-1], path)
+            self.tree_condition.notify_all()
     
-    def find_all_end_nodes(self, node: MCTSNode) -> List[MCTSNode]:
+    def parallel_rollout(self, root_node: MCTSNode, rollout_step: int):
+        print(f"Question ID: {self.task.question_id}, Rollout step {rollout_step + 1} / {self.max_rollout_steps}")
+        with self.tree_condition:
+            path = self.reserve_leaf(root_node)
+            while path is None:
+                self.tree_condition.wait()
+                path = self.reserve_leaf(root_node)
+        path, _ = self.run_rollout(path)
+        self.finish_rollout(path)
+    
+    def solve_parallel(self, root_node: MCTSNode, first_rollout_step: int = 0):
+        with ThreadPoolExecutor(max_workers=self.n_parallel_rollouts) as executor:
+            list(executor.map(lambda rollout_step: self.parallel_rollout(root_node, rollout_step), range(first_rollout_step, self.max_rollout_steps)))
+    
+    def solve_deterministic(self, root_node: MCTSNode, first_rollout_step: int = 0):
+        # rollouts run in waves: leaves are reserved, rollouts backpropagated and new transposition states
+        # registered in rollout order, and each rollout draws from its own seeded generator, so the tree
+        # only depends on the LLM responses
+        rollout_step = first_rollout_step
+        with ThreadPoolExecutor(max_workers=self.n_parallel_rollouts) as executor:
+            while rollout_step < self.max_rollout_steps:
+                paths = []
+                with self.tree_condition:
+                    while len(paths) < self.n_parallel_rollouts and rollout_step + len(paths) < self.max_rollout_steps:
+                        path = self.reserve_leaf(root_node)
+                        if path is None:
+                            break
+                        paths.append(path)
+                print(f"Question ID: {self.task.question_id}, Rollout steps {rollout_step + 1}-{rollout_step + len(paths)} / {self.max_rollout_steps}")
+                rngs = [random.Random(f"{self.random_seed}-{self.task.question_id}-{rollout_step + i}") for i in range(len(paths))]
+                results = list(executor.map(self.run_rollout, paths, rngs))
+                for path, new_states in results:
+                    self.register_states(new_states)
+                    self.finish_rollout(path)
+                rollout_step += len(paths)
+    
+    def find_all_end_nodes(self, node: MCTSNode, visited_node_ids: Optional[set] = None) -> List[MCTSNode]:
+        # nodes shared through the transposition table are reachable from several parents
+        visited_node_ids = set() if visited_node_ids is None else visited_node_ids
+        if id(node) in visited_node_ids:
+            return []
+        visited_node_ids.add(id(node))
         if node.node_type == MCTSNodeType.END:
             return [node]
         else:
             end_nodes = []
             for child in node.children:
-                end_nodes.extend(self.find_all_end_nodes(child))
+                end_nodes.extend(self.find_all_end_nodes(child, visited_node_ids))
             return end_nodes
     
     def find_all_valid_reasoning_paths(self, node: MCTSNode) -> List[List[MCTSNode]]:
@@ -98,34 +334,64 @@ class MCTSSolver:
             add_value_examples=True,
             add_expanded_column_name=True
         ) for table_name in self.task.table_schema_dict])
-        root_node = MCTSNode(MCTSNodeType.ROOT,
-                             parent_node=None,
-                             parent_action=None,
-                             depth=0,
-                             db_id=self.task.db_id,
-                             db_root_dir=self.db_root_dir,
-                             original_question=self.task.question,
-                             hint=self.task.evidence,
-                            #  schema_context=self.task.schema_context,
-                             schema_context=schema_context,
-                             table_schema_dict=self.task.table_schema_dict)
-        root_node.path_nodes = [root_node]
+        context = MCTSQuestionContext(db_id=self.task.db_id,
+                                      db_root_dir=self.db_root_dir,
+                                      original_question=self.task.question,
+                                      hint=self.task.evidence,
+                                    #   schema_context=self.task.schema_context,
+                                      schema_context=schema_context,
+                                      table_schema_dict=self.task.table_schema_dict)
         
-        for _ in range(self.max_rollout_steps):
-            print(f"Question ID: {self.task.question_id}, Rollout step {_ + 1} / {self.max_rollout_steps}")
-            leaf_node = self.select(root_node)
-            if leaf_node.is_terminal():
-                self.backpropagate(leaf_node)
-                continue
-            self.expand(leaf_node)
-            leaf_node = random.choice(leaf_node.children)
-            end_node = self.simulate(leaf_node)
-            self.backpropagate(end_node)
+        # the tree is logged as it grows, so a killed worker resumes the question from its last rollout
+        self.checkpoint = MCTSTreeCheckpoint(get_tree_checkpoint_path(self.save_root_dir, self.task.question_id))
+        first_rollout_step = 0
+        tree = self.checkpoint.resume(context) if self.checkpoint.path.exists() else None
+        if tree is not None and tree.root_node is not None:
+            root_node = tree.root_node
+            first_rollout_step = tree.n_rollouts
+            if self.use_transposition_table:
+                for node in tree.nodes:
+                    if not node.is_terminal():
+                        self.transposition_table.setdefault(self.get_state_key(node), node)
+            print(f"Question ID: {self.task.question_id}, Resuming from rollout step {first_rollout_step} with {len(tree.nodes)} nodes")
+        else:
+            self.checkpoint.close()
+            root_node = MCTSNode(MCTSNodeType.ROOT,
+                                 parent_node=None,
+                                 parent_action=None,
+                                 depth=0,
+                                 context=context)
+            self.checkpoint.start(root_node, self.task.question_id)
         
+        try:
+            if self.deterministic_rollouts:
+                self.solve_deterministic(root_node, first_rollout_step)
+            elif self.n_parallel_rollouts > 1:
+                self.solve_parallel(root_node, first_rollout_step)
+            else:
+                for _ in range(first_rollout_step, self.max_rollout_steps):
+                    print(f"Question ID: {self.task.question_id}, Rollout step {_ + 1} / {self.max_rollout_steps}")
+                    path = self.select_path(root_node)
+                    leaf_node = path[-1]
+                    if leaf_node.is_terminal():
+                        self.backpropagate(leaf_node, path)
+                        continue
+                    self.expand(leaf_node, path[-2] if len(path) > 1 else None)
+                    leaf_node = random.choice(leaf_node.children)
+                    self.visit_child(path[-1], leaf_node)
+                    path.append(leaf_node)
+                    end_node = self.simulate(leaf_node, path)
+                    self.backpropagate(end_node, path)
+            self.checkpoint.record_done()
+        finally:
+            self.checkpoint.close()
         all_valid_reasoning_paths = self.find_all_valid_reasoning_paths(root_node)
-        save_path = Path(self.save_root_dir) / f"{self.task.question_id}.pkl"
         print(f"Question ID: {self.task.question_id} done, Number of valid reasoning paths: {len(all_valid_reasoning_paths)}")
-        with open(save_path, "wb") as f:
-            pickle.dump(all_valid_reasoning_paths, f)
+        if self.use_transposition_table:
+            print(f"Question ID: {self.task.question_id}, Transposition table: {len(self.transposition_table)} states, {self.n_merged_nodes} merged nodes, at least {self.llm_calls_avoided} LLM calls avoided")
+        if self.save_pickled_paths:
+            save_path = Path(self.save_root_dir) / f"{self.task.question_id}.pkl"
+            with open(save_path, "wb") as f:
+                pickle.dump(all_valid_reasoning_paths, f)
 
         
\ No newline at end of file
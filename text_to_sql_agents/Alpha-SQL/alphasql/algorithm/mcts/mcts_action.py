@@ -17,6 +17,7 @@ import copy
 import json
 import re
 import random
+import threading
 
 SQL_GENERATION_LLM_KWARGS_TEMPERATURE = 0.8
 SQL_REVISION_LLM_KWARGS_TEMPERATURE = 0.8
@@ -25,6 +26,21 @@ SQL_REVISION_LLM_KWARGS_N = 5
 
 SQL_VALIDATION_MAX_TRIES = 15
 
+_rollout_rng = threading.local()
+
+def get_rng() -> Any:
+    """
+    Returns the random generator of the rollout running in the current thread,
+    or the global random module outside of parallel rollouts.
+    """
+    return getattr(_rollout_rng, "rng", None) or random
+
+def set_rollout_rng(rng: Optional[random.Random]):
+    """
+    Sets the random generator used by the current thread, so that concurrent rollouts draw reproducible samples.
+    """
+    _rollout_rng.rng = rng
+
 class MCTSAction:
     def create_children_nodes(self, node: "MCTSNode", llm_kwargs: Dict[str, Any]) -> List["MCTSNode"]:
         raise NotImplementedError()
@@ -47,13 +63,7 @@ class RaphraseQuestionAction(MCTSAction):
         responses = list(set(responses))
         nodes = []
         for response in responses:
-            child_node = copy.deepcopy(node)
-            child_node.node_type = MCTSNodeType.REPHRASE_QUESTION
-            child_node.parent_node = node
-            child_node.parent_action = self
-            child_node.depth = node.depth + 1
-            child_node.children = []
-            child_node.path_nodes = node.path_nodes + [child_node]
+            child_node = node.create_child(MCTSNodeType.REPHRASE_QUESTION, self)
             child_node.rephrased_question = response
             nodes.append(child_node)
         return nodes
@@ -90,13 +100,7 @@ class SchemaSelectionAction(MCTSAction):
             new_llm_kwargs["n"] = llm_kwargs["n"] - len(nodes)
             responses = call_openai(prompt, **new_llm_kwargs)
             for response in responses:
-                child_node = copy.deepcopy(node)
-                child_node.node_type = MCTSNodeType.SCHEMA_SELECTION
-                child_node.parent_node = node
-                child_node.parent_action = self
-                child_node.depth = node.depth + 1
-                child_node.children = []
-                child_node.path_nodes = node.path_nodes + [child_node]
+                child_node = node.create_child(MCTSNodeType.SCHEMA_SELECTION, self)
                 new_table_schema_dict, schema_selection_dict = self.select_schema(child_node.table_schema_dict, response)
                 if new_table_schema_dict:
                     child_node.selected_schema_dict = new_table_schema_dict
@@ -107,7 +111,7 @@ class SchemaSelectionAction(MCTSAction):
                         add_value_examples=True,
                         add_expanded_column_name=True
                     ) for table_name in child_node.selected_schema_dict]
-                    random.shuffle(schema_context_ddl_list) # new feature
+                    get_rng().shuffle(schema_context_ddl_list) # new feature
                     child_node.selected_schema_context = "\n".join(schema_context_ddl_list)
                     nodes.append(child_node)
                     all_schema_selection_dicts.append(schema_selection_dict)
@@ -201,13 +205,7 @@ class IdentifyColumnValuesAction(MCTSAction):
         responses = list(set(responses))
         nodes = []
         for response in responses:
-            child_node = copy.deepcopy(node)
-            child_node.node_type = MCTSNodeType.IDENTIFY_COLUMN_VALUES
-            child_node.parent_node = node
-            child_node.parent_action = self
-            child_node.depth = node.depth + 1
-            child_node.children = []
-            child_node.path_nodes = node.path_nodes + [child_node]
+            child_node = node.create_child(MCTSNodeType.IDENTIFY_COLUMN_VALUES, self)
             child_node.identified_column_values = response
             nodes.append(child_node)
         return nodes
@@ -240,13 +238,7 @@ class IdentifyColumnFunctionsAction(MCTSAction):
         responses = list(set(responses))
         nodes = []
         for response in responses:
-            child_node = copy.deepcopy(node)
-            child_node.node_type = MCTSNodeType.IDENTIFY_COLUMN_FUNCTIONS
-            child_node.parent_node = node
-            child_node.parent_action = self
-            child_node.depth = node.depth + 1
-            child_node.children = []
-            child_node.path_nodes = node.path_nodes + [child_node]
+            child_node = node.create_child(MCTSNodeType.IDENTIFY_COLUMN_FUNCTIONS, self)
             child_node.identified_column_functions = response
             nodes.append(child_node)
         return nodes
@@ -284,13 +276,7 @@ class SQLGenerationAction(MCTSAction):
             new_llm_kwargs["n"] = llm_kwargs["n"] - len(nodes)
             responses = call_openai(prompt, **new_llm_kwargs)
             for response in responses:
-                child_node = copy.deepcopy(node)
-                child_node.node_type = MCTSNodeType.SQL_GENERATION
-                child_node.parent_node = node
-                child_node.parent_action = self
-                child_node.depth = node.depth + 1
-                child_node.children = []
-                child_node.path_nodes = node.path_nodes + [child_node]
+                child_node = node.create_child(MCTSNodeType.SQL_GENERATION, self)
                 sql_query = self.extract_sql_query_answer(response)
                 
                 if sql_query:
@@ -319,13 +305,7 @@ class SQLGenerationAction(MCTSAction):
             template_args={"QUESTION": question, "HINT": hint, "SCHEMA_CONTEXT": schema_context}
         )
         
-        child_node = copy.deepcopy(node)
-        child_node.node_type = MCTSNodeType.SQL_GENERATION
-        child_node.parent_node = node
-        child_node.parent_action = self
-        child_node.depth = node.depth + 1
-        child_node.children = []
-        child_node.path_nodes = node.path_nodes + [child_node]
+        child_node = node.create_child(MCTSNodeType.SQL_GENERATION, self)
         sql_query = None
         db_path = Path(node.db_root_dir) / node.db_id / f"{node.db_id}.sqlite"
         while not sql_query:
@@ -358,12 +338,12 @@ class SQLGenerationAction(MCTSAction):
                 if is_valid_execution_result(sql_query_execution_result) or valid_sql_query_tries >= SQL_VALIDATION_MAX_TRIES:
                     all_sql_queries.append(sql_query)
                     if is_valid_execution_result(sql_query_execution_result):
-                        result_groups[frozenset(sql_query_execution_result.result)].append(sql_query)
+                        result_groups[sql_query_execution_result.result_fingerprint].append(sql_query)
                 else:
                     valid_sql_query_tries += 1
         
         if len(result_groups) == 0 and len(all_sql_queries) > 0:
-            return random.choice(all_sql_queries), 0, False
+            return get_rng().choice(all_sql_queries), 0, False
         else:
             most_consistent_sql_query = None
             max_group_size = 0
@@ -371,7 +351,7 @@ class SQLGenerationAction(MCTSAction):
             for result, sql_queries in result_groups.items():
                 all_sql_queries_size += len(sql_queries)
                 if len(sql_queries) > max_group_size:
-                    most_consistent_sql_query = random.choice(sql_queries)
+                    most_consistent_sql_query = get_rng().choice(sql_queries)
                     max_group_size = len(sql_queries)
             return most_consistent_sql_query, max_group_size / all_sql_queries_size, True
 
@@ -427,13 +407,7 @@ class SQLRevisionAction(MCTSAction):
             new_llm_kwargs["n"] = llm_kwargs["n"] - len(nodes)
             responses = call_openai(prompt, **new_llm_kwargs)
             for response in responses:
-                child_node = copy.deepcopy(node)
-                child_node.node_type = MCTSNodeType.SQL_REVISION
-                child_node.parent_node = node
-                child_node.parent_action = self
-                child_node.depth = node.depth + 1
-                child_node.children = []
-                child_node.path_nodes = node.path_nodes + [child_node]
+                child_node = node.create_child(MCTSNodeType.SQL_REVISION, self)
                 revised_sql_query = self.extract_sql_query_answer(response)
                 if revised_sql_query:
                     db_path = Path(node.db_root_dir) / node.db_id / f"{node.db_id}.sqlite"
@@ -468,13 +442,7 @@ class SQLRevisionAction(MCTSAction):
             template_args={"QUESTION": question, "HINT": hint, "SCHEMA_CONTEXT": schema_context}
         )
         
-        child_node = copy.deepcopy(node)
-        child_node.node_type = MCTSNodeType.SQL_REVISION
-        child_node.parent_node = node
-        child_node.parent_action = self
-        child_node.depth = node.depth + 1
-        child_node.children = []
-        child_node.path_nodes = node.path_nodes + [child_node]
+        child_node = node.create_child(MCTSNodeType.SQL_REVISION, self)
         sql_query = None
         db_path = Path(node.db_root_dir) / node.db_id / f"{node.db_id}.sqlite"
         while not sql_query:
@@ -507,12 +475,12 @@ class SQLRevisionAction(MCTSAction):
                 if is_valid_execution_result(sql_query_execution_result) or valid_sql_query_tries >= SQL_VALIDATION_MAX_TRIES:
                     all_sql_queries.append(sql_query)
                     if is_valid_execution_result(sql_query_execution_result):
-                        result_groups[frozenset(sql_query_execution_result.result)].append(sql_query)
+                        result_groups[sql_query_execution_result.result_fingerprint].append(sql_query)
                 else:
                     valid_sql_query_tries += 1
         
         if len(result_groups) == 0 and len(all_sql_queries) > 0:
-            return random.choice(all_sql_queries), 0, False
+            return get_rng().choice(all_sql_queries), 0, False
         else:
             most_consistent_sql_query = None
             max_group_size = 0
@@ -520,7 +488,7 @@ class SQLRevisionAction(MCTSAction):
             for result, sql_queries in result_groups.items():
                 all_sql_queries_size += len(sql_queries)
                 if len(sql_queries) > max_group_size:
-                    most_consistent_sql_query = random.choice(sql_queries)
+                    most_consistent_sql_query = get_rng().choice(sql_queries)
                     max_group_size = len(sql_queries)
             return most_consistent_sql_query, max_group_size / all_sql_queries_size, True
     
@@ -544,13 +512,7 @@ class EndAction(MCTSAction):
     """
     def create_children_nodes(self, node: "MCTSNode", llm_kwargs: Dict[str, Any]) -> List["MCTSNode"]:
         assert node.node_type == MCTSNodeType.SQL_REVISION or node.node_type == MCTSNodeType.SQL_GENERATION
-        child_node = copy.deepcopy(node)
-        child_node.node_type = MCTSNodeType.END
-        child_node.parent_node = node
-        child_node.parent_action = self
-        child_node.depth = node.depth + 1
-        child_node.children = []
-        child_node.path_nodes = node.path_nodes + [child_node]
+        child_node = node.create_child(MCTSNodeType.END, self)
         child_node.final_sql_query = node.sql_query if node.node_type == MCTSNodeType.SQL_GENERATION else node.revised_sql_query
         return [child_node]
 
@@ -0,0 +1,220 @@
+from alphasql.algorithm.mcts.mcts_node import *
+from alphasql.algorithm.selection.utils import get_subset_schema_dict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import threading
+import json
+import os
+
+TREE_CHECKPOINT_VERSION = 1
+TREE_CHECKPOINT_SUFFIX = ".tree.jsonl"
+
+ACTION_CLASSES = {action_class.__name__: action_class for action_class in MCTSAction.__subclasses__()}
+
+def get_tree_checkpoint_path(save_root_dir: str, question_id: int) -> Path:
+    return Path(save_root_dir) / f"{question_id}{TREE_CHECKPOINT_SUFFIX}"
+
+def encode_state_value(name: str, value: Any) -> Any:
+    if name == "selected_schema_dict" and value is not None:
+        # the selected columns are enough to rebuild the schema subset from the question's schema
+        return {table_name: list(table_schema.columns) for table_name, table_schema in value.items()}
+    return value
+
+def decode_state_value(name: str, value: Any, context: MCTSQuestionContext) -> Any:
+    if name == "selected_schema_dict" and value is not None:
+        if context.table_schema_dict is None:
+            return None
+        return get_subset_schema_dict(context.table_schema_dict, value)
+    return value
+
+@dataclass
+class LoadedTree:
+    """
+    A search tree read back from a checkpoint.
+
+    Attributes:
+        root_node: The root node, with the N/Q statistics of all logged rollouts; None if the log holds no node.
+        nodes: The nodes in the order they were created, indexed by node id.
+        n_rollouts: The number of logged rollouts.
+        done: Whether the search finished.
+    """
+    root_node: Optional[MCTSNode]
+    nodes: List[MCTSNode] = field(default_factory=list)
+    n_rollouts: int = 0
+    done: bool = False
+
+class MCTSTreeCheckpoint:
+    """
+    Append-only JSON lines log of a question's search tree.
+
+    Nodes are written once, with the state fields that differ from their parent, so shared path
+    prefixes are stored once. Question state (question, hint, schema) is not written: it belongs to
+    the task. Records:
+        {"type": "header", "version", "question_id", "db_id", "db_root_dir", "question", "hint"}
+        {"type": "node", "id", "parent", "node_type", "action", "state": {field: value}}
+        {"type": "children", "id", "children": [ids]}
+        {"type": "rollout", "path": [ids], "reward"}
+        {"type": "done"}
+    The log is flushed after every rollout, so a killed worker loses at most the rollouts in flight.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.file = None
+        self.next_node_id = 0
+        self.n_rollouts = 0
+        self.lock = threading.Lock()
+
+    def _write(self, record: Dict[str, Any]):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_node(self, node: MCTSNode):
+        node.node_id = self.next_node_id
+        self.next_node_id += 1
+        parent_node = node.parent_node
+        state = {}
+        for name in ACCUMULATED_STATE_FIELDS:
+            value = getattr(node, name)
+            if parent_node is None or (value is not getattr(parent_node, name) and value != getattr(parent_node, name)):
+                state[name] = encode_state_value(name, value)
+        self._write({
+            "type": "node",
+            "id": node.node_id,
+            "parent": parent_node.node_id if parent_node is not None else None,
+            "node_type": node.node_type.value,
+            "action": node.parent_action.__class__.__name__ if node.parent_action is not None else None,
+            "state": state,
+        })
+
+    def start(self, root_node: MCTSNode, question_id: int):
+        self.file = open(self.path, "w", encoding="utf-8")
+        self._write({
+            "type": "header",
+            "version": TREE_CHECKPOINT_VERSION,
+            "question_id": question_id,
+            "db_id": root_node.db_id,
+            "db_root_dir": root_node.db_root_dir,
+            "question": root_node.original_question,
+            "hint": root_node.hint,
+        })
+        self._write_node(root_node)
+        self.file.flush()
+
+    def resume(self, context: Optional[MCTSQuestionContext] = None) -> LoadedTree:
+        tree, valid_size = self.load(self.path, context, return_valid_size=True)
+        # drop a record torn by the crash before appending
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_size)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.next_node_id = len(tree.nodes)
+        self.n_rollouts = tree.n_rollouts
+        return tree
+
+    def record_children(self, node: MCTSNode):
+        with self.lock:
+            for child in node.children:
+                if child.node_id is None:
+                    self._write_node(child)
+            self._write({"type": "children", "id": node.node_id, "children": [child.node_id for child in node.children]})
+
+    def record_rollout(self, path: List[MCTSNode], reward: float):
+        with self.lock:
+            self._write({"type": "rollout", "path": [path_node.node_id for path_node in path], "reward": reward})
+            self.n_rollouts += 1
+            self.file.flush()
+
+    def record_done(self):
+        with self.lock:
+            self._write({"type": "done"})
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def load(path: Path, context: Optional[MCTSQuestionContext] = None, return_valid_size: bool = False):
+        """
+        Rebuilds a search tree from its checkpoint.
+
+        Args:
+            path: The checkpoint path.
+            context: The question state to attach to the nodes; if None, one without the schema is built from the header.
+            return_valid_size: Whether to also return the size of the log up to the last complete record.
+
+        Returns:
+            The loaded tree, and the valid size if return_valid_size is set.
+        """
+        nodes: List[MCTSNode] = []
+        n_rollouts = 0
+        done = False
+        valid_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                valid_size += len(line)
+                record_type = record["type"]
+                if record_type == "header":
+                    if context is None:
+                        context = MCTSQuestionContext(record["db_id"], record["db_root_dir"], record["question"], record["hint"])
+                elif record_type == "node":
+                    parent_node = nodes[record["parent"]] if record["parent"] is not None else None
+                    action_class = ACTION_CLASSES.get(record["action"])
+                    node_type = MCTSNodeType(record["node_type"])
+                    if parent_node is not None:
+                        node = parent_node.create_child(node_type, action_class() if action_class is not None else None)
+                    else:
+                        node = MCTSNode(node_type, context=context)
+                    for name, value in record["state"].items():
+                        setattr(node, name, decode_state_value(name, value, context))
+                    node.node_id = record["id"]
+                    nodes.append(node)
+                elif record_type == "children":
+                    nodes[record["id"]].children = [nodes[child_id] for child_id in record["children"]]
+                elif record_type == "rollout":
+                    for node_id in record["path"]:
+                        nodes[node_id].N += 1
+                        nodes[node_id].Q += record["reward"]
+                    n_rollouts += 1
+                elif record_type == "done":
+                    done = True
+        tree = LoadedTree(root_node=nodes[0] if nodes else None, nodes=nodes, n_rollouts=n_rollouts, done=done)
+        if return_valid_size:
+            return tree, valid_size
+        return tree
+
+def is_tree_checkpoint_done(path: Path) -> bool:
+    """
+    Checks whether the last record of a checkpoint marks a finished search, without reading the whole log.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64))
+        return f.read().rstrip(b"\n").endswith(b'{"type": "done"}')
+
+def load_reasoning_paths(path: Path) -> List[List[MCTSNode]]:
+    """
+    Reads the reasoning paths (root to end node) of a finished search from its checkpoint.
+    """
+    tree = MCTSTreeCheckpoint.load(path)
+    # depth-first, in children order, like MCTSSolver.find_all_valid_reasoning_paths
+    reasoning_paths = []
+    visited_node_ids = set()
+    stack = [tree.root_node]
+    while stack:
+        node = stack.pop()
+        if node.node_id in visited_node_ids:
+            continue
+        visited_node_ids.add(node.node_id)
+        if node.node_type == MCTSNodeType.END:
+            reasoning_paths.append(node.path_nodes)
+        stack.extend(reversed(node.children))
+    return reasoning_paths
@@ -9,7 +9,52 @@ def get_valid_action_space_for_node(node: "MCTSNode") -> List["MCTSAction"]:
     valid_action_space = [action_class() for action_class in action_space_classes if action_class not in history_actions_classes]
     return valid_action_space
 
+# the reasoning state a node inherits from its parent; actions overwrite the fields they produce
+ACCUMULATED_STATE_FIELDS = (
+    "rephrased_question",
+    "selected_schema_dict",
+    "selected_schema_context",
+    "identified_column_values",
+    "identified_column_functions",
+    "sql_query",
+    "revised_sql_query",
+    "final_sql_query",
+    "consistency_score",
+    "is_valid_sql_query",
+)
+
+class MCTSQuestionContext:
+    """
+    The immutable state of a question, shared by reference by all nodes of its search tree.
+    """
+    __slots__ = ("db_id", "db_root_dir", "original_question", "hint", "schema_context", "table_schema_dict", "llm_kwargs")
+
+    def __init__(self,
+                 db_id: str = "",
+                 db_root_dir: str = "",
+                 original_question: str = "",
+                 hint: str = "",
+                 schema_context: str = "",
+                 table_schema_dict: Optional[Dict[str, "TableSchema"]] = None,
+                 llm_kwargs: Optional[Dict[str, Any]] = None):
+        self.db_id = db_id
+        self.db_root_dir = db_root_dir
+        self.original_question = original_question
+        self.hint = hint
+        self.schema_context = schema_context
+        self.table_schema_dict = table_schema_dict
+        self.llm_kwargs = llm_kwargs
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
 class MCTSNode:
+    __slots__ = ("node_type", "parent_node", "parent_action", "depth", "context", "children", "Q", "N", "node_id") + ACCUMULATED_STATE_FIELDS
+
     def __init__(self,
                  node_type: "MCTSNodeType",
                  parent_node: Optional["MCTSNode"] = None,
@@ -21,7 +66,6 @@ class MCTSNode:
                  hint: str = "",
                  schema_context: str = "",
                  table_schema_dict: Optional[Dict[str, "TableSchema"]] = None,
-                 path_nodes: List["MCTSNode"] = [],
                  rephrased_question: Optional[str] = None,
                  selected_schema_dict: Optional[Dict[str, "TableSchema"]] = None,
                  selected_schema_context: Optional[str] = None,
@@ -32,21 +76,18 @@ class MCTSNode:
                  final_sql_query: Optional[str] = None,
                  consistency_score: Optional[float] = None,
                  is_valid_sql_query: Optional[bool] = None,
-                 llm_kwargs: Optional[Dict[str, Any]] = None
+                 llm_kwargs: Optional[Dict[str, Any]] = None,
+                 context: Optional[MCTSQuestionContext] = None
                  ):
         self.node_type = node_type
         self.parent_node = parent_node
         self.parent_action = parent_action
         self.depth = depth
-        self.db_id = db_id
-        self.db_root_dir = db_root_dir
-        self.original_question = original_question
-        self.hint = hint
-        self.schema_context = schema_context
-        self.table_schema_dict = table_schema_dict
+        if context is None:
+            context = MCTSQuestionContext(db_id, db_root_dir, original_question, hint, schema_context, table_schema_dict, llm_kwargs)
+        self.context = context
         self.children : List[MCTSNode] = []
-        self.path_nodes = path_nodes
-        
+
         self.rephrased_question = rephrased_question
         self.selected_schema_dict = selected_schema_dict
         self.selected_schema_context = selected_schema_context
@@ -57,20 +98,75 @@ class MCTSNode:
         self.final_sql_query = final_sql_query
         self.consistency_score = consistency_score
         self.is_valid_sql_query = is_valid_sql_query
-        self.llm_kwargs = llm_kwargs
 
         self.Q = 0
         self.N = 0
-    
+        # assigned when the node is written to a tree checkpoint
+        self.node_id = None
+
+    @property
+    def db_id(self) -> str:
+        return self.context.db_id
+
+    @property
+    def db_root_dir(self) -> str:
+        return self.context.db_root_dir
+
+    @property
+    def original_question(self) -> str:
+        return self.context.original_question
+
+    @property
+    def hint(self) -> str:
+        return self.context.hint
+
+    @property
+    def schema_context(self) -> str:
+        return self.context.schema_context
+
+    @property
+    def table_schema_dict(self) -> Optional[Dict[str, "TableSchema"]]:
+        return self.context.table_schema_dict
+
+    @property
+    def llm_kwargs(self) -> Optional[Dict[str, Any]]:
+        return self.context.llm_kwargs
+
+    @property
+    def path_nodes(self) -> List["MCTSNode"]:
+        path_nodes = []
+        current = self
+        while current is not None:
+            path_nodes.append(current)
+            current = current.parent_node
+        path_nodes.reverse()
+        return path_nodes
+
+    def create_child(self, node_type: "MCTSNodeType", parent_action: "MCTSAction") -> "MCTSNode":
+        child_node = MCTSNode(node_type, parent_node=self, parent_action=parent_action, depth=self.depth + 1, context=self.context)
+        for name in ACCUMULATED_STATE_FIELDS:
+            setattr(child_node, name, getattr(self, name))
+        return child_node
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        if "context" not in state:
+            # nodes pickled before the question state moved to a shared context
+            state = dict(state)
+            state["context"] = MCTSQuestionContext(*(state.pop(name, None) for name in MCTSQuestionContext.__slots__))
+            state.pop("path_nodes", None)
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
     def create_children(self):
         if self.children:
             return
-        
+
         valid_action_space = get_valid_action_space_for_node(self)
         for action in valid_action_space:
             self.children.extend(action.create_children_nodes(self, self.llm_kwargs))
-            
+
     def is_terminal(self):
         return self.node_type == MCTSNodeType.END
-
-
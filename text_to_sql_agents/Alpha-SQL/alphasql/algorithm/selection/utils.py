@@ -1,8 +1,8 @@
 from sqlglot import parse_one, exp
 from collections import defaultdict
-from typing import Dict, List, Set
+from typing import Dict, List, Set, Tuple
 from alphasql.database.schema import TableSchema
-from alphasql.database.sql_execution import execute_sql_with_timeout, SQLExecutionResultType
+from alphasql.database.sql_execution import execute_sql_with_timeout, cached_execute_sql_with_timeout, SQLExecutionResultType
 import copy
 import time
 import numpy as np
@@ -45,7 +45,27 @@ def measure_sql_execution_time(db_path: str, sql_query: str, repeat: int = 10) -
     execution_time_mean = np.mean(execution_times)
     execution_times = [execution_time for execution_time in execution_times if execution_time > execution_time_mean - 3 * execution_time_std and execution_time < execution_time_mean + 3 * execution_time_std]
     return np.mean(execution_times)
-    
+
+def measure_sql_execution_cost(db_path: str, sql_query: str) -> Tuple[float, float, float]:
+    """
+    Estimates the cost of a SQL query from a single execution, as a cheaper and deterministic stand-in for measure_sql_execution_time.
+
+    Args:
+        db_path: The path to the database.
+        sql_query: The SQL query.
+    Returns:
+        The SQLite VM steps of the execution, then the full table scans and temporary b-trees of its query plan,
+        which order the queries that finish within the resolution of the VM step count; inf for queries that fail.
+    """
+    # results executed during the search already carry their cost
+    execution_result = cached_execute_sql_with_timeout(db_path, sql_query)
+    if execution_result.result_type == SQLExecutionResultType.SUCCESS and execution_result.vm_steps is None:
+        execution_result = execute_sql_with_timeout(db_path, sql_query)
+    if execution_result.result_type != SQLExecutionResultType.SUCCESS:
+        return (float("inf"), float("inf"), float("inf"))
+    query_plan_features = execution_result.query_plan_features or {}
+    return (execution_result.vm_steps, query_plan_features.get("full_scans", 0), query_plan_features.get("temp_b_trees", 0))
+
 def get_subset_schema_dict(table_schema_dict: Dict[str, "TableSchema"], schema_selection_dict: Dict[str, List[str]]):
     selected_table_names_lower = [selected_table_name.lower() for selected_table_name in schema_selection_dict.keys()]
     new_table_schema_dict = {}
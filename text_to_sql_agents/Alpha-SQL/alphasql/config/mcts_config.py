@@ -15,4 +15,9 @@ class MCTSConfig(BaseModel):
     save_root_dir: str
     mcts_model_kwargs: Dict[str, Any]
     reward_model_kwargs: Optional[Dict[str, Any]] = None
-    random_seed: Optional[int] = 42
\ No newline at end of file
+    random_seed: Optional[int] = 42
+    n_parallel_rollouts: int = 1
+    virtual_loss: float = 1.0
+    deterministic_rollouts: bool = False
+    use_transposition_table: bool = False
+    save_pickled_paths: bool = False
@@ -1,10 +1,18 @@
 import sqlite3
+import hashlib
 import threading
 from enum import Enum
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Any, Dict
 from functools import lru_cache
 from prettytable import PrettyTable
 import sqlglot
+from alphasql.database.sql_execution_cache import get_sql_execution_cache
+
+# rows kept by compact results, enough for format_execution_result
+RESULT_SAMPLE_ROWS = 10
+RESULT_SAMPLE_VALUE_LENGTH = 1000
+# the progress handler runs every PROGRESS_HANDLER_STEPS SQLite VM steps, which is also the resolution of vm_steps
+PROGRESS_HANDLER_STEPS = 1000
 
 class SQLExecutionResultType(Enum):
     """
@@ -19,17 +27,54 @@ class SQLExecutionResultType(Enum):
     TIMEOUT = "timeout"
     ERROR = "error"
     
+def _canonical_value(value: Any) -> Any:
+    # 1 and 1.0 are the same answer, as in a frozenset of rows
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def get_result_fingerprint(result: List[Tuple]) -> str:
+    """
+    Fingerprint of the set of rows of a result: equal for results with the same distinct rows, in any order.
+    
+    Args:
+        result: The result rows.
+    Returns:
+        The hex digest of the sorted distinct rows.
+    """
+    rows = sorted({repr(tuple(_canonical_value(value) for value in row)) for row in result})
+    sha256 = hashlib.sha256()
+    for row in rows:
+        sha256.update(row.encode("utf-8", errors="replace"))
+        sha256.update(b"\n")
+    return sha256.hexdigest()
+
 class SQLExecutionResult:
     """
     Result of a SQL query execution.
+    
+    Compact results (see to_compact) only keep a sample of the rows in result; n_rows, result_fingerprint
+    and has_non_null_value always describe the full result. vm_steps and query_plan_features measure the
+    cost of the execution (see get_query_plan_features), when it was run with a timeout.
     """
-    def __init__(self, db_path: str, sql: str, result_type: SQLExecutionResultType, result_cols: Optional[List[str]], result: Optional[List[Tuple]], error_message: Optional[str]) -> None:
+    def __init__(self, db_path: str, sql: str, result_type: SQLExecutionResultType, result_cols: Optional[List[str]], result: Optional[List[Tuple]], error_message: Optional[str],
+                 n_rows: Optional[int] = None, result_fingerprint: Optional[str] = None, has_non_null_value: Optional[bool] = None,
+                 vm_steps: Optional[int] = None, query_plan_features: Optional[Dict[str, int]] = None) -> None:
         self.db_path = db_path
         self.sql = sql
         self.result_type = result_type
         self.result_cols = result_cols
         self.result = result
         self.error_message = error_message
+        if result is not None and n_rows is None:
+            n_rows = len(result)
+            result_fingerprint = get_result_fingerprint(result)
+            has_non_null_value = any(any(col is not None for col in row) for row in result)
+        self.n_rows = n_rows
+        self.result_fingerprint = result_fingerprint
+        self.has_non_null_value = has_non_null_value
+        self.vm_steps = vm_steps
+        self.query_plan_features = query_plan_features
         
     def to_dict(self) -> dict:
         return {
@@ -38,8 +83,53 @@ class SQLExecutionResult:
             "result_type": self.result_type.value,
             "result_cols": self.result_cols,
             "result": self.result,
-            "error_message": self.error_message
+            "error_message": self.error_message,
+            "n_rows": self.n_rows,
+            "result_fingerprint": self.result_fingerprint,
+            "has_non_null_value": self.has_non_null_value,
+            "vm_steps": self.vm_steps,
+            "query_plan_features": self.query_plan_features
         }
+    
+    @classmethod
+    def from_dict(cls, result_dict: dict) -> "SQLExecutionResult":
+        result_dict = dict(result_dict)
+        result_dict["result_type"] = SQLExecutionResultType(result_dict["result_type"])
+        return cls(**result_dict)
+    
+    def to_compact(self, sample_rows: int = RESULT_SAMPLE_ROWS, value_length: int = RESULT_SAMPLE_VALUE_LENGTH) -> "SQLExecutionResult":
+        """
+        Returns a copy that keeps the first sample_rows rows, with long text values cut to value_length.
+        """
+        if self.result is None:
+            return self
+        sample = [
+            tuple(value[:value_length] if isinstance(value, (str, bytes)) else value for value in row)
+            for row in self.result[:sample_rows]
+        ]
+        return SQLExecutionResult(self.db_path, self.sql, self.result_type, self.result_cols, sample, self.error_message,
+                                  self.n_rows, self.result_fingerprint, self.has_non_null_value, self.vm_steps, self.query_plan_features)
+
+def get_query_plan_features(conn: sqlite3.Connection, query: str) -> Optional[Dict[str, int]]:
+    """
+    Counts the costly steps of the query plan of a SQL query, without executing it.
+    
+    Args:
+        conn: The connection to the database.
+        query: The SQL query.
+    Returns:
+        The number of full table scans, temporary b-trees (sorts, DISTINCT, GROUP BY without an index) and plan steps,
+        or None if the query cannot be explained.
+    """
+    try:
+        details = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+    except Exception:
+        return None
+    return {
+        "full_scans": sum(1 for detail in details if detail.startswith("SCAN") and "INDEX" not in detail),
+        "temp_b_trees": sum(1 for detail in details if "TEMP B-TREE" in detail),
+        "plan_steps": len(details)
+    }
 
 class ExecuteSQLThread(threading.Thread):
     """
@@ -53,11 +143,14 @@ class ExecuteSQLThread(threading.Thread):
         self.result_cols = None
         self.result = None
         self.exception = None
+        self.progress_handler_calls = 0
+        self.query_plan_features = None
         
         self.stop_event = threading.Event()
         
     def run(self) -> None:
         def check_stop():
+            self.progress_handler_calls += 1
             if self.stop_event.is_set():
                 raise Exception("Query execution cancelled")
         
@@ -65,11 +158,13 @@ class ExecuteSQLThread(threading.Thread):
             # Enforce to read-only mode, to prevent accidental modification of the database
             with sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True) as conn:
                 conn.text_factory = lambda x: str(x, 'utf-8', errors='replace')  # Add error handling for UTF-8 decoding
-                conn.set_progress_handler(check_stop, 1000)
+                conn.set_progress_handler(check_stop, PROGRESS_HANDLER_STEPS)
                 cursor = conn.cursor()
                 cursor.execute(self.query)
                 self.result_cols = [col[0] for col in cursor.description]
                 self.result = cursor.fetchall()
+                conn.set_progress_handler(None, 0)
+                self.query_plan_features = get_query_plan_features(conn, self.query)
         except Exception as e:
             self.exception = e
 
@@ -96,7 +191,8 @@ def execute_sql_with_timeout(db_path: str, query: str, timeout: int = 60) -> SQL
     if thread.exception:
         error_message = str(thread.exception)
         return SQLExecutionResult(db_path, query, SQLExecutionResultType.ERROR, None, None, error_message)
-    return SQLExecutionResult(db_path, query, SQLExecutionResultType.SUCCESS, thread.result_cols, thread.result, None)
+    return SQLExecutionResult(db_path, query, SQLExecutionResultType.SUCCESS, thread.result_cols, thread.result, None,
+                              vm_steps=thread.progress_handler_calls * PROGRESS_HANDLER_STEPS, query_plan_features=thread.query_plan_features)
 
 def execute_sql_without_timeout(db_path: str, query: str) -> SQLExecutionResult:
     """
@@ -153,20 +249,102 @@ def normalize_sql(sql: str) -> str:
     except Exception as e:
         return sql
 
+# errors that fail the same way on every run; anything else (locked or unreadable database, out of memory) may not
+DETERMINISTIC_ERROR_MARKERS = (
+    "no such table",
+    "no such column",
+    "no such function",
+    "syntax error",
+    "incomplete input",
+    "unrecognized token",
+    "ambiguous column name",
+    "misuse of aggregate",
+    "misuse of window function",
+    "wrong number of arguments",
+    "selects to the left and right of",
+    "one statement at a time",
+)
+
+def is_cacheable_execution_result(result: SQLExecutionResult) -> bool:
+    """
+    Whether a result may be shared through the on-disk cache: successes and deterministic SQL errors.
+    """
+    if result.result_type is SQLExecutionResultType.SUCCESS:
+        return True
+    if result.result_type is SQLExecutionResultType.ERROR:
+        error_message = (result.error_message or "").lower()
+        return any(marker in error_message for marker in DETERMINISTIC_ERROR_MARKERS)
+    return False
+
+def get_result_columns(db_path: str, query: str) -> Optional[List[str]]:
+    """
+    Get the column names of a SQL query without running it.
+    
+    Args:
+        db_path: The path to the database.
+        query: The SQL query.
+    Returns:
+        The column names, or None if they cannot be read this way.
+    """
+    query = query.strip().rstrip(";")
+    try:
+        with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as conn:
+            # LIMIT 0 on the outer query stops before the inner query produces a row
+            cursor = conn.execute(f"SELECT * FROM (\n{query}\n) LIMIT 0")
+            columns = [col[0] for col in cursor.description]
+    except Exception:
+        return None
+    # the wrapping query renames duplicate (case-insensitive) columns to "<name>:<n>", the query itself does not
+    seen_columns = set()
+    for i, column in enumerate(columns):
+        name, _, suffix = column.rpartition(":")
+        if name.lower() in seen_columns and suffix.isdigit():
+            columns[i] = name
+        seen_columns.add(columns[i].lower())
+    return columns
+
 @lru_cache(maxsize=10000)
 def _cached_execute_sql_with_timeout(db_path: str, sql_query: str) -> SQLExecutionResult:
-    result = execute_sql_with_timeout(db_path, sql_query)
+    cache = get_sql_execution_cache()
+    normalized_sql = normalize_sql(sql_query)
+    if cache is not None:
+        cached_result = cache.get(str(db_path), normalized_sql)
+        if cached_result is not None and cached_result["sql"] != sql_query:
+            # another query with the same normalized form was stored: its column names (aliases, expression text)
+            # and error message may differ from this query's
+            if cached_result["result_type"] == SQLExecutionResultType.SUCCESS.value:
+                result_cols = get_result_columns(db_path, sql_query)
+                cached_result = dict(cached_result, result_cols=result_cols) if result_cols is not None else None
+            else:
+                cached_result = None
+        if cached_result is not None:
+            cached_result.update(db_path=db_path, sql=sql_query)
+            return SQLExecutionResult.from_dict(cached_result)
+    result = execute_sql_with_timeout(db_path, sql_query).to_compact()
+    # timeouts and transient errors depend on the state of the machine, keep them out of the shared cache
+    if cache is not None and is_cacheable_execution_result(result):
+        cache.put(str(db_path), normalized_sql, result.to_dict())
     return result
 
 def cached_execute_sql_with_timeout(db_path: str, sql_query: str) -> SQLExecutionResult:
-    # sql_query = normalize_sql(sql_query)
+    """
+    Execute a SQL query with a timeout, reusing the results of earlier executions of the same normalized query
+    on the same database, in this process or any other process sharing the execution cache.
+    
+    Args:
+        db_path: The path to the database.
+        sql_query: The SQL query to execute.
+    Returns:
+        The compact result of the SQL query: result only holds the first RESULT_SAMPLE_ROWS rows, compare
+        results by result_fingerprint.
+    """
     result = _cached_execute_sql_with_timeout(db_path, sql_query)
     return result
 
 def is_valid_execution_result(result: SQLExecutionResult) -> bool:
     if result.result_type is not SQLExecutionResultType.SUCCESS:
         return False
-    return any(any(col is not None for col in row) for row in result.result)
+    return result.has_non_null_value
     # return True
 
 def format_execution_result(result: SQLExecutionResult, row_limit: int = 3, val_length_limit: int = 100) -> str:
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_SQL_EXECUTION_CACHE_PATH = "data/cache/sql_execution.sqlite"
+DEFAULT_SQL_EXECUTION_CACHE_MAX_BYTES = 1 << 30
+TRIM_INTERVAL = 256
+
+def _file_hash(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class SQLExecutionCache:
+    """
+    Execution results shared by all processes of a run (MCTS workers and SQL selection) in a SQLite file.
+
+    Results are keyed by the sha256 of the database file and the normalized SQL query, so the cache stays valid
+    when databases move and is dropped implicitly when a database changes. Only compact results are stored:
+    columns, row count, result fingerprint and a bounded row sample (see SQLExecutionResult.to_compact).
+    The database hash is stored next to the results and only recomputed when the size or modification time of
+    the database file changed. Least recently used results are evicted once the stored bytes pass max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_SQL_EXECUTION_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._db_hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._writes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_connection"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection inherited from the parent of a forked pool worker must not be shared
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS databases ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, db_hash TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS executions ("
+                "key TEXT PRIMARY KEY, db_hash TEXT NOT NULL, sql TEXT NOT NULL, result BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS executions_accessed_at ON executions (accessed_at)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _get_db_hash(self, connection: sqlite3.Connection, db_path: str) -> str:
+        db_path = os.path.realpath(db_path)
+        stat = os.stat(db_path)
+        cached = self._db_hashes.get(db_path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        row = connection.execute("SELECT size, mtime_ns, db_hash FROM databases WHERE path = ?", (db_path,)).fetchone()
+        if row is not None and tuple(row[:2]) == (stat.st_size, stat.st_mtime_ns):
+            db_hash = row[2]
+        else:
+            db_hash = _file_hash(db_path)
+            connection.execute(
+                "INSERT OR REPLACE INTO databases (path, size, mtime_ns, db_hash) VALUES (?, ?, ?, ?)",
+                (db_path, stat.st_size, stat.st_mtime_ns, db_hash),
+            )
+        self._db_hashes[db_path] = (stat.st_size, stat.st_mtime_ns, db_hash)
+        return db_hash
+
+    @staticmethod
+    def make_key(db_hash: str, normalized_sql: str) -> str:
+        return hashlib.sha256(json.dumps([db_hash, normalized_sql]).encode("utf8")).hexdigest()
+
+    def get(self, db_path: str, normalized_sql: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up the compact execution result of a query.
+
+        Args:
+            db_path: The path to the database.
+            normalized_sql: The normalized SQL query.
+        Returns:
+            The compact result as a dict (see SQLExecutionResult.to_compact), or None on a miss.
+        """
+        with self._lock:
+            connection = self._connect()
+            key = self.make_key(self._get_db_hash(connection, db_path), normalized_sql)
+            row = connection.execute("SELECT result FROM executions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE executions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, db_path: str, normalized_sql: str, compact_result: Dict[str, Any]) -> None:
+        """
+        Stores the compact execution result of a query, evicting the least recently used results if the cache grew past max_bytes.
+
+        Args:
+            db_path: The path to the database.
+            normalized_sql: The normalized SQL query.
+            compact_result: The compact result as a dict.
+        """
+        blob = pickle.dumps(compact_result, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            db_hash = self._get_db_hash(connection, db_path)
+            connection.execute(
+                "INSERT OR REPLACE INTO executions (key, db_hash, sql, result, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.make_key(db_hash, normalized_sql), db_hash, normalized_sql, blob, len(blob) + len(normalized_sql), now, now),
+            )
+            self._writes += 1
+            if self._writes % TRIM_INTERVAL == 1:
+                self._trim(connection)
+
+    def _trim(self, connection: sqlite3.Connection) -> None:
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM executions").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # evict down to 90% of the limit so that trimming does not run on every write
+        to_free = total_size - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in connection.execute("SELECT key, size FROM executions ORDER BY accessed_at"):
+            if freed >= to_free:
+                break
+            keys.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM executions WHERE key = ?", keys)
+
+_sql_execution_cache: Optional[SQLExecutionCache] = None
+_sql_execution_cache_lock = threading.Lock()
+
+def get_sql_execution_cache() -> Optional[SQLExecutionCache]:
+    """
+    Returns the execution cache of this process, configured by the SQL_EXECUTION_CACHE_PATH (empty disables it)
+    and SQL_EXECUTION_CACHE_MAX_BYTES environment variables.
+    """
+    global _sql_execution_cache
+    with _sql_execution_cache_lock:
+        if _sql_execution_cache is None:
+            path = os.getenv("SQL_EXECUTION_CACHE_PATH", DEFAULT_SQL_EXECUTION_CACHE_PATH)
+            if not path:
+                return None
+            max_bytes = int(os.getenv("SQL_EXECUTION_CACHE_MAX_BYTES", DEFAULT_SQL_EXECUTION_CACHE_MAX_BYTES))
+            _sql_execution_cache = SQLExecutionCache(path, max_bytes)
+        return _sql_execution_cache
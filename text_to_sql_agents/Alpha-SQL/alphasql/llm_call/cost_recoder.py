@@ -1,4 +1,5 @@
 from loguru import logger
+import threading
 
 MODEL_PRICE_PER_1M_TOKENS = {
     "gpt-4o": {"prompt": 2.5, "completion": 10.0},
@@ -15,6 +16,7 @@ class CostRecorder:
         self.total_completion_tokens = 0
         self.total_tokens = 0
         self.total_cost = 0
+        self._lock = threading.Lock()
         if self.model in MODEL_PRICE_PER_1M_TOKENS:
             self.total_cost_per_1m_tokens = MODEL_PRICE_PER_1M_TOKENS[self.model]
         else:
@@ -23,10 +25,12 @@ class CostRecorder:
             logger.warning(f"Set the cost per 1M tokens to 0 for model {self.model}.")
     
     def update_cost(self, prompt_tokens: int, completion_tokens: int):
-        self.total_prompt_tokens += prompt_tokens
-        self.total_completion_tokens += completion_tokens
-        self.total_tokens += prompt_tokens + completion_tokens
-        self.total_cost += (prompt_tokens / 1e6 * self.total_cost_per_1m_tokens["prompt"]) + (completion_tokens / 1e6 * self.total_cost_per_1m_tokens["completion"])
+        # parallel rollouts call the LLM from several threads
+        with self._lock:
+            self.total_prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+            self.total_tokens += prompt_tokens + completion_tokens
+            self.total_cost += (prompt_tokens / 1e6 * self.total_cost_per_1m_tokens["prompt"]) + (completion_tokens / 1e6 * self.total_cost_per_1m_tokens["completion"])
 
     def get_total_prompt_tokens(self):
         return self.total_prompt_tokens
@@ -3,6 +3,7 @@ import dotenv
 from typing import List, Optional
 from alphasql.llm_call.cost_recoder import CostRecorder
 import time
+import threading
 
 dotenv.load_dotenv(override=True)
 
@@ -15,6 +16,14 @@ MAX_RETRYING_TIMES = 5
 N_CALLING_STRATEGY_SINGLE = "single"
 N_CALLING_STRATEGY_MULTIPLE = "multiple"
 
+_llm_call_counter = threading.local()
+
+def get_llm_call_count() -> int:
+    """
+    Returns the number of chat completion requests made by the current thread.
+    """
+    return getattr(_llm_call_counter, "count", 0)
+
 def call_openai(prompt: str,
                 model: str,
                 temperature: float = 0.0,
@@ -45,6 +54,7 @@ def call_openai(prompt: str,
                     stop=stop,
                     # timeout=MAX_TIMEOUT,
                 )
+                _llm_call_counter.count = get_llm_call_count() + 1
                 if cost_recorder is not None:
                     cost_recorder.update_cost(response.usage.prompt_tokens, response.usage.completion_tokens)
                 contents = [choice.message.content for choice in response.choices]
@@ -62,6 +72,7 @@ def call_openai(prompt: str,
                         stop=stop,
                         # timeout=MAX_TIMEOUT,
                     )
+                    _llm_call_counter.count = get_llm_call_count() + 1
                     if cost_recorder is not None:
                         cost_recorder.update_cost(response.usage.prompt_tokens, response.usage.completion_tokens)
                     contents.append(response.choices[0].message.content)
@@ -1,4 +1,5 @@
 from alphasql.algorithm.mcts.mcts import MCTSSolver
+from alphasql.algorithm.mcts.mcts_checkpoint import TREE_CHECKPOINT_SUFFIX, is_tree_checkpoint_done
 from alphasql.algorithm.mcts.reward import MajorityVoteRewardModel
 from alphasql.runner.task import Task
 from alphasql.config.mcts_config import MCTSConfig
@@ -54,7 +55,13 @@ class MCTSRunner:
             exploration_constant=self.config.exploration_constant,
             save_root_dir=self.config.save_root_dir,
             llm_kwargs=self.config.mcts_model_kwargs,
-            reward_model=MajorityVoteRewardModel(self.config.reward_model_kwargs)
+            reward_model=MajorityVoteRewardModel(self.config.reward_model_kwargs),
+            n_parallel_rollouts=self.config.n_parallel_rollouts,
+            virtual_loss=self.config.virtual_loss,
+            deterministic_rollouts=self.config.deterministic_rollouts,
+            random_seed=self.config.random_seed,
+            use_transposition_table=self.config.use_transposition_table,
+            save_pickled_paths=self.config.save_pickled_paths
         )
         try:
             mcts_solver.solve()
@@ -81,6 +88,10 @@ class MCTSRunner:
         done_task_ids = []
         for pkl_file in Path(self.config.save_root_dir).glob("*.pkl"):
             done_task_ids.append(int(pkl_file.stem))
+        # unfinished trees are resumed from their checkpoint
+        for tree_file in Path(self.config.save_root_dir).glob(f"*{TREE_CHECKPOINT_SUFFIX}"):
+            if is_tree_checkpoint_done(tree_file):
+                done_task_ids.append(int(tree_file.name[:-len(TREE_CHECKPOINT_SUFFIX)]))
         print(f"Ignore done task ids: {done_task_ids}")
         tasks = [task for task in tasks if task.question_id not in done_task_ids]
         
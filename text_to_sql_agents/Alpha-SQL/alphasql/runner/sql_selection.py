@@ -1,5 +1,6 @@
 from alphasql.database.sql_execution import cached_execute_sql_with_timeout, is_valid_execution_result
-from alphasql.algorithm.selection.utils import measure_sql_execution_time
+from alphasql.algorithm.selection.utils import measure_sql_execution_cost
+from alphasql.algorithm.mcts.mcts_checkpoint import TREE_CHECKPOINT_SUFFIX, is_tree_checkpoint_done, load_reasoning_paths
 import pickle
 import glob
 import json
@@ -8,12 +9,13 @@ from tqdm import tqdm
 from collections import defaultdict
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
-EXECUTION_TIME_REPEAT = 20
-
 def select_final_sql_query(results_file_path: str, db_root_dir: str):
     question_id = int(results_file_path.split("/")[-1].split(".")[0])
-    with open(results_file_path, "rb") as f:
-        results = pickle.load(f)
+    if results_file_path.endswith(TREE_CHECKPOINT_SUFFIX):
+        results = load_reasoning_paths(results_file_path)
+    else:
+        with open(results_file_path, "rb") as f:
+            results = pickle.load(f)
     db_id = results[0][0].db_id
     db_path = f"{db_root_dir}/{db_id}/{db_id}.sqlite"
     result_groups = defaultdict(list)
@@ -24,8 +26,8 @@ def select_final_sql_query(results_file_path: str, db_root_dir: str):
         answer = cached_execute_sql_with_timeout(db_path, sql_query)
         if answer.result_type.value == "success":
             if is_valid_execution_result(answer):
-                result_groups[frozenset(answer.result)].append(idx)
-            result_groups_with_invalid_result[frozenset(answer.result)].append(idx)
+                result_groups[answer.result_fingerprint].append(idx)
+            result_groups_with_invalid_result[answer.result_fingerprint].append(idx)
     
     if len(result_groups) == 0:
         final_selected_sql_query = "ERROR"
@@ -34,11 +36,12 @@ def select_final_sql_query(results_file_path: str, db_root_dir: str):
             path_idx_with_sc_score = []
             for answer, path_indices in result_groups_with_invalid_result.items():
                 sc_score = len(path_indices) / sum([len(v) for v in result_groups_with_invalid_result.values()])
-                execution_time = measure_sql_execution_time(db_path, results[path_indices[0]][-1].final_sql_query, repeat=EXECUTION_TIME_REPEAT)
+                execution_cost = measure_sql_execution_cost(db_path, results[path_indices[0]][-1].final_sql_query)
                 # for path_idx in path_indices:
-                #     consistency_score[path_idx] = (sc_score, execution_time)
-                path_idx_with_sc_score.append((path_indices[0], sc_score, execution_time))
-            path_idx_with_sc_score.sort(key=lambda x: (x[1], -x[2]), reverse=True)
+                #     consistency_score[path_idx] = (sc_score, execution_cost)
+                path_idx_with_sc_score.append((path_indices[0], sc_score, execution_cost))
+            # highest self-consistency first, then cheapest
+            path_idx_with_sc_score.sort(key=lambda x: (-x[1], x[2]))
             # Group paths by their scores
             # score_to_paths = {}
             # for path_idx, score in consistency_score.items():
@@ -74,9 +77,10 @@ def select_final_sql_query(results_file_path: str, db_root_dir: str):
     path_idx_with_sc_score = []
     for answer, path_indices in result_groups.items():
         sc_score = len(path_indices) / sum([len(v) for v in result_groups.values()])
-        execution_time = measure_sql_execution_time(db_path, results[path_indices[0]][-1].final_sql_query, repeat=EXECUTION_TIME_REPEAT)
-        path_idx_with_sc_score.append((path_indices[0], sc_score, execution_time))
-    path_idx_with_sc_score.sort(key=lambda x: (x[1], -x[2]), reverse=True)
+        execution_cost = measure_sql_execution_cost(db_path, results[path_indices[0]][-1].final_sql_query)
+        path_idx_with_sc_score.append((path_indices[0], sc_score, execution_cost))
+    # highest self-consistency first, then cheapest
+    path_idx_with_sc_score.sort(key=lambda x: (-x[1], x[2]))
     path_idx = path_idx_with_sc_score[0][0]
     final_selected_sql_query = results[path_idx][-1].final_sql_query
 
@@ -88,7 +92,10 @@ def select_final_sql_query(results_file_path: str, db_root_dir: str):
 def main(args):
     final_pred_sqls = {}
     with ProcessPoolExecutor(max_workers=args.process_num) as executor:
-        result_paths = glob.glob(args.results_dir + "/*.pkl")
+        # prefer the tree checkpoints, which are read without unpickling whole trees; skip unfinished searches
+        tree_paths = [path for path in glob.glob(args.results_dir + f"/*{TREE_CHECKPOINT_SUFFIX}") if is_tree_checkpoint_done(path)]
+        tree_question_ids = {path.split("/")[-1].split(".")[0] for path in tree_paths}
+        result_paths = tree_paths + [path for path in glob.glob(args.results_dir + "/*.pkl") if path.split("/")[-1].split(".")[0] not in tree_question_ids]
         future_to_path = {executor.submit(select_final_sql_query, path, args.db_root_dir): path for path in result_paths}
         
         for future in tqdm(as_completed(future_to_path), total=len(future_to_path), desc="Processing results"):
@@ -0,0 +1,4 @@
+source .env
+index_server_address=${INDEX_SERVER_ADDRESS:-"unix:/tmp/chess_index.sock"} # Set INDEX_SERVER_ADDRESS in .env so the workers use this server
+
+python3 -u ./src/index_server.py --address "${index_server_address}"
@@ -6,6 +6,8 @@ verbose=true
 signature_size=100
 n_gram=3
 threshold=0.01
+batch=true # Compute the MinHash signatures column by column with NumPy
+num_workers=8 # Processes per database for fetching values and computing signatures
 
 # Run the Python script with the defined variables
 python3 -u ./src/preprocess.py --db_root_directory "${db_root_directory}" \
@@ -13,4 +15,6 @@ python3 -u ./src/preprocess.py --db_root_directory "${db_root_directory}" \
                               --n_gram "${n_gram}" \
                               --threshold "${threshold}" \
                               --db_id "${db_id}" \
-                              --verbose "${verbose}"
+                              --verbose "${verbose}" \
+                              --num_workers "${num_workers}" \
+                              $( [ "${batch}" = true ] && echo "--batch" )
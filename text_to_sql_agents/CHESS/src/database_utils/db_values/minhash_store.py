@@ -0,0 +1,106 @@
+import json
+import numpy as np
+from pathlib import Path
+from datasketch import MinHash
+from typing import Dict, List, Tuple
+
+class MinHashStore:
+    """
+    Columnar, memory-mapped replacement of the pickled minhashes dictionary.
+
+    A store directory holds:
+        signatures.npy: (N, signature_size) uint64 matrix of MinHash hash values.
+        column_ids.npy: (N,) int32 index of each row's (table, column) pair.
+        value_offsets.npy: (N + 1,) int64 offsets of each row's value in values.bin.
+        values.bin: The UTF-8 encoded values, concatenated.
+        meta.json: The signature size, the (table, column) pairs and the first row of each LSH key prefix.
+
+    The arrays are opened with mmap, so loading is constant time and worker processes share the pages.
+    LSH keys keep their "<table>_<column>_<id>" form and map to row key_offsets[prefix] + id.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r") as file:
+            meta = json.load(file)
+        self.signature_size: int = meta["signature_size"]
+        self.columns: List[Tuple[str, str]] = [tuple(column) for column in meta["columns"]]
+        self.key_offsets: Dict[str, int] = meta["key_offsets"]
+        self.signatures = np.load(self.path / "signatures.npy", mmap_mode="r")
+        self.column_ids = np.load(self.path / "column_ids.npy", mmap_mode="r")
+        self.value_offsets = np.load(self.path / "value_offsets.npy", mmap_mode="r")
+        self.values = np.memmap(self.path / "values.bin", dtype=np.uint8, mode="r") if self.value_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.column_ids)
+
+    def rows(self, keys: List[str]) -> np.ndarray:
+        """
+        Maps LSH keys to store rows.
+
+        Args:
+            keys (List[str]): The LSH keys.
+
+        Returns:
+            np.ndarray: The row of each key.
+        """
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            prefix, id = key.rsplit("_", 1)
+            rows[i] = self.key_offsets[prefix] + int(id)
+        return rows
+
+    def entry(self, row: int) -> Tuple[str, str, str]:
+        """
+        Returns the table, column and value of a row.
+
+        Args:
+            row (int): The store row.
+
+        Returns:
+            Tuple[str, str, str]: The table name, column name and value.
+        """
+        table_name, column_name = self.columns[self.column_ids[row]]
+        value = bytes(self.values[self.value_offsets[row]:self.value_offsets[row + 1]]).decode("utf8")
+        return table_name, column_name, value
+
+    def __getitem__(self, key: str) -> Tuple[MinHash, str, str, str]:
+        """Returns the entry of an LSH key in the form of the pickled minhashes dictionary."""
+        row = self.rows([key])[0]
+        return (MinHash(num_perm=self.signature_size, hashvalues=self.signatures[row]), *self.entry(row))
+
+    @staticmethod
+    def write(path: Path, minhashes: Dict[str, Tuple[MinHash, str, str, str]]) -> None:
+        """
+        Writes a minhashes dictionary as a store.
+
+        Args:
+            path (Path): The store directory.
+            minhashes (Dict[str, Tuple[MinHash, str, str, str]]): The dictionary of MinHashes, as built by make_lsh.
+
+        Raises:
+            ValueError: If the keys of a table and column are not consecutive "<table>_<column>_<id>" keys.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        signature_size = next(iter(minhashes.values()))[0].hashvalues.shape[0] if minhashes else 0
+        signatures = np.empty((len(minhashes), signature_size), dtype=np.uint64)
+        column_ids = np.empty(len(minhashes), dtype=np.int32)
+        value_offsets = np.zeros(len(minhashes) + 1, dtype=np.int64)
+        columns: Dict[Tuple[str, str], int] = {}
+        key_offsets: Dict[str, int] = {}
+        with open(path / "values.bin", "wb") as values_file:
+            for row, (key, (minhash, table_name, column_name, value)) in enumerate(minhashes.items()):
+                prefix, id = key.rsplit("_", 1)
+                if key_offsets.setdefault(prefix, row - int(id)) != row - int(id):
+                    raise ValueError(f"Minhash key {key} is not consecutive with the other keys of {prefix}")
+                signatures[row] = minhash.hashvalues
+                column_ids[row] = columns.setdefault((table_name, column_name), len(columns))
+                encoded_value = value.encode("utf8")
+                values_file.write(encoded_value)
+                value_offsets[row + 1] = value_offsets[row] + len(encoded_value)
+        np.save(path / "signatures.npy", signatures)
+        np.save(path / "column_ids.npy", column_ids)
+        np.save(path / "value_offsets.npy", value_offsets)
+        with open(path / "meta.json", "w") as file:
+            json.dump({"signature_size": signature_size, "columns": list(columns), "key_offsets": key_offsets}, file)
@@ -1,18 +1,24 @@
 import pickle
+import numpy as np
 from datasketch import MinHash, MinHashLSH
+from datasketch.hashfunc import sha1_hash32
+from datasketch.minhash import _mersenne_prime, _max_hash
+from multiprocessing import Pool
 from pathlib import Path
 from tqdm import tqdm
 import logging
 from typing import Dict, List, Any, Tuple
 
 from database_utils.execution import execute_sql
+from database_utils.db_values.minhash_store import MinHashStore
 
-def _get_unique_values(db_path: str) -> Dict[str, Dict[str, List[str]]]:
+def _get_unique_values(db_path: str, num_workers: int = 1) -> Dict[str, Dict[str, List[str]]]:
     """
     Retrieves unique text values from the database excluding primary keys.
 
     Args:
         db_path (str): The path to the SQLite database file.
+        num_workers (int): The number of processes fetching the values of different tables in parallel.
 
     Returns:
         Dict[str, Dict[str, List[str]]]: A dictionary containing unique values for each table and column.
@@ -28,49 +34,65 @@ def _get_unique_values(db_path: str) -> Dict[str, Dict[str, List[str]]]:
                 if column_name.lower() not in [c.lower() for c in primary_keys]:
                     primary_keys.append(column_name)
     
-    unique_values: Dict[str, Dict[str, List[str]]] = {}
-    for table_name in table_names:
-        if table_name == "sqlite_sequence":
+    table_names = [table_name for table_name in table_names if table_name != "sqlite_sequence"]
+    tasks = [(db_path, table_name, primary_keys) for table_name in table_names]
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            tables_values = pool.starmap(_get_table_unique_values, tasks)
+    else:
+        tables_values = [_get_table_unique_values(*task) for task in tasks]
+
+    return dict(zip(table_names, tables_values))
+
+def _get_table_unique_values(db_path: str, table_name: str, primary_keys: List[str]) -> Dict[str, List[str]]:
+    """
+    Retrieves unique text values of one table excluding primary keys.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        table_name (str): The name of the table.
+        primary_keys (List[str]): The primary key column names of the database.
+
+    Returns:
+        Dict[str, List[str]]: A dictionary containing unique values for each column of the table.
+    """
+    logging.info(f"Processing {table_name}")
+    columns = [col[1] for col in execute_sql(db_path, f"PRAGMA table_info('{table_name}')", fetch="all") if ("TEXT" in col[2] and col[1].lower() not in [c.lower() for c in primary_keys])]
+    table_values: Dict[str, List[str]] = {}
+    
+    for column in columns:
+        if any(keyword in column.lower() for keyword in ["_id", " id", "url", "email", "web", "time", "phone", "date", "address"]) or column.endswith("Id"):
             continue
-        logging.info(f"Processing {table_name}")
-        columns = [col[1] for col in execute_sql(db_path, f"PRAGMA table_info('{table_name}')", fetch="all") if ("TEXT" in col[2] and col[1].lower() not in [c.lower() for c in primary_keys])]
-        table_values: Dict[str, List[str]] = {}
-        
-        for column in columns:
-            if any(keyword in column.lower() for keyword in ["_id", " id", "url", "email", "web", "time", "phone", "date", "address"]) or column.endswith("Id"):
-                continue
 
+        try:
+            result = execute_sql(db_path, f"""
+                SELECT SUM(LENGTH(unique_values)), COUNT(unique_values)
+                FROM (
+                    SELECT DISTINCT `{column}` AS unique_values
+                    FROM `{table_name}`
+                    WHERE `{column}` IS NOT NULL
+                ) AS subquery
+            """, fetch="one", timeout = 480)
+        except:
+            result = 0, 0
+
+        sum_of_lengths, count_distinct = result
+        if sum_of_lengths is None or count_distinct == 0:
+            continue
+
+        average_length = sum_of_lengths / count_distinct
+        logging.info(f"Column: {column}, sum_of_lengths: {sum_of_lengths}, count_distinct: {count_distinct}, average_length: {average_length}")
+        
+        if ("name" in column.lower() and sum_of_lengths < 5000000) or (sum_of_lengths < 2000000 and average_length < 25) or count_distinct < 100:
+            logging.info(f"Fetching distinct values for {column}")
             try:
-                result = execute_sql(db_path, f"""
-                    SELECT SUM(LENGTH(unique_values)), COUNT(unique_values)
-                    FROM (
-                        SELECT DISTINCT `{column}` AS unique_values
-                        FROM `{table_name}`
-                        WHERE `{column}` IS NOT NULL
-                    ) AS subquery
-                """, fetch="one", timeout = 480)
+                values = [str(value[0]) for value in execute_sql(db_path, f"SELECT DISTINCT `{column}` FROM `{table_name}` WHERE `{column}` IS NOT NULL", fetch="all", timeout = 480)]
             except:
-                result = 0, 0
-
-            sum_of_lengths, count_distinct = result
-            if sum_of_lengths is None or count_distinct == 0:
-                continue
-
-            average_length = sum_of_lengths / count_distinct
-            logging.info(f"Column: {column}, sum_of_lengths: {sum_of_lengths}, count_distinct: {count_distinct}, average_length: {average_length}")
-            
-            if ("name" in column.lower() and sum_of_lengths < 5000000) or (sum_of_lengths < 2000000 and average_length < 25) or count_distinct < 100:
-                logging.info(f"Fetching distinct values for {column}")
-                try:
-                    values = [str(value[0]) for value in execute_sql(db_path, f"SELECT DISTINCT `{column}` FROM `{table_name}` WHERE `{column}` IS NOT NULL", fetch="all", timeout = 480)]
-                except:
-                    values = []
-                logging.info(f"Number of different values: {len(values)}")
-                table_values[column] = values
-        
-        unique_values[table_name] = table_values
+                values = []
+            logging.info(f"Number of different values: {len(values)}")
+            table_values[column] = values
 
-    return unique_values
+    return table_values
 
 def _create_minhash(signature_size: int, string: str, n_gram: int) -> MinHash:
     """
@@ -89,6 +111,62 @@ def _create_minhash(signature_size: int, string: str, n_gram: int) -> MinHash:
         m.update(d.encode('utf8'))
     return m
 
+def _create_minhashes(signature_size: int, strings: List[str], n_gram: int) -> List[MinHash]:
+    """
+    Creates MinHash objects for a list of strings, sharing one set of permutations.
+
+    Args:
+        signature_size (int): The size of the MinHash signature.
+        strings (List[str]): The input strings to create the MinHashes for.
+        n_gram (int): The n-gram size for the MinHash.
+
+    Returns:
+        List[MinHash]: The MinHash objects, equal to _create_minhash for each input string.
+    """
+    permutations = MinHash(num_perm=signature_size).permutations
+    return [MinHash(num_perm=signature_size, hashvalues=signature, permutations=permutations)
+            for signature in _minhash_signatures(strings, signature_size, n_gram)]
+
+def _minhash_signatures(values: List[str], signature_size: int, n_gram: int, chunk_size: int = 5000) -> np.ndarray:
+    """
+    Computes the MinHash signatures of a whole column of values with NumPy.
+
+    Each distinct n-gram of a chunk of values is hashed once, all its permutations are applied in one
+    array operation, and the signature of each value is the row-wise minimum over its n-grams.
+
+    Args:
+        values (List[str]): The values of the column.
+        signature_size (int): The size of the MinHash signature.
+        n_gram (int): The n-gram size for the MinHash.
+        chunk_size (int): The number of values processed at once, bounding the memory use.
+
+    Returns:
+        np.ndarray: A (len(values), signature_size) uint64 matrix, row i equal to the hashvalues of _create_minhash for values[i].
+    """
+    a, b = MinHash(num_perm=signature_size).permutations
+    signatures = np.full((len(values), signature_size), _max_hash, dtype=np.uint64)
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        gram_ids: Dict[str, int] = {}
+        value_gram_ids: List[int] = []
+        lengths = np.zeros(len(chunk), dtype=np.int64)
+        for i, value in enumerate(chunk):
+            for j in range(len(value) - n_gram + 1):
+                value_gram_ids.append(gram_ids.setdefault(value[j:j + n_gram], len(gram_ids)))
+            lengths[i] = max(len(value) - n_gram + 1, 0)
+        if not gram_ids:
+            continue
+        hashes = np.fromiter((sha1_hash32(gram.encode('utf8')) for gram in gram_ids), dtype=np.uint64, count=len(gram_ids))
+        permuted = (hashes[:, np.newaxis] * a + b) % _mersenne_prime & _max_hash
+        non_empty = np.flatnonzero(lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths[non_empty])[:-1]))
+        signatures[start + non_empty] = np.minimum.reduceat(permuted[np.array(value_gram_ids)], offsets, axis=0)
+    return signatures
+
+def _column_minhash_signatures(task: Tuple[List[str], int, int]) -> np.ndarray:
+    values, signature_size, n_gram = task
+    return _minhash_signatures(values, signature_size, n_gram)
+
 def skip_column(column_name: str, column_values: List[str]) -> bool:
     """
     Determines whether to skip processing a column based on its values.
@@ -106,7 +184,8 @@ def skip_column(column_name: str, column_values: List[str]) -> bool:
     average_length = sum_of_lengths / len(column_values)
     return (sum_of_lengths > 50000) and (average_length > 20)
 
-def make_lsh(unique_values: Dict[str, Dict[str, List[str]]], signature_size: int, n_gram: int, threshold: float, verbose: bool = True) -> Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]:
+def make_lsh(unique_values: Dict[str, Dict[str, List[str]]], signature_size: int, n_gram: int, threshold: float, verbose: bool = True,
+             batch: bool = False, num_workers: int = 1) -> Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]:
     """
     Creates a MinHash LSH from unique values.
 
@@ -116,10 +195,14 @@ def make_lsh(unique_values: Dict[str, Dict[str, List[str]]], signature_size: int
         n_gram (int): The n-gram size for the MinHash.
         threshold (float): The threshold for the MinHash LSH.
         verbose (bool): Whether to display progress information.
+        batch (bool): Whether to compute the signatures column by column with NumPy, see make_lsh_batch.
+        num_workers (int): The number of processes computing column signatures in batch mode.
 
     Returns:
         Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]: The MinHash LSH object and the dictionary of MinHashes.
     """
+    if batch:
+        return make_lsh_batch(unique_values, signature_size, n_gram, threshold, verbose, num_workers)
     lsh = MinHashLSH(threshold=threshold, num_perm=signature_size)
     minhashes: Dict[str, Tuple[MinHash, str, str, str]] = {}
     try:
@@ -152,6 +235,65 @@ def make_lsh(unique_values: Dict[str, Dict[str, List[str]]], signature_size: int
     
     return lsh, minhashes
 
+def make_lsh_batch(unique_values: Dict[str, Dict[str, List[str]]], signature_size: int, n_gram: int, threshold: float,
+                   verbose: bool = True, num_workers: int = 1) -> Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]:
+    """
+    Creates the same MinHash LSH and MinHashes as make_lsh, computing the signatures of whole columns with NumPy,
+    spread over a process pool, and inserting the LSH bands of each column in bulk.
+
+    Args:
+        unique_values (Dict[str, Dict[str, List[str]]]): The dictionary of unique values.
+        signature_size (int): The size of the MinHash signature.
+        n_gram (int): The n-gram size for the MinHash.
+        threshold (float): The threshold for the MinHash LSH.
+        verbose (bool): Whether to display progress information.
+        num_workers (int): The number of processes computing column signatures.
+
+    Returns:
+        Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]: The MinHash LSH object and the dictionary of MinHashes.
+    """
+    lsh = MinHashLSH(threshold=threshold, num_perm=signature_size)
+    minhashes: Dict[str, Tuple[MinHash, str, str, str]] = {}
+    # All MinHashes share one permutations array, which pickle then stores once
+    permutations = MinHash(num_perm=signature_size).permutations
+    columns = [(table_name, column_name, column_values)
+               for table_name, table_values in unique_values.items()
+               for column_name, column_values in table_values.items()]
+    tasks = [(column_values, signature_size, n_gram) for _, _, column_values in columns]
+    total_unique_values = sum(len(column_values) for _, _, column_values in columns)
+    logging.info(f"Total unique values: {total_unique_values}")
+    progress_bar = tqdm(total=total_unique_values, desc="Creating LSH") if verbose else None
+
+    pool = Pool(num_workers) if num_workers > 1 else None
+    try:
+        columns_signatures = pool.imap(_column_minhash_signatures, tasks) if pool else map(_column_minhash_signatures, tasks)
+        for (table_name, column_name, column_values), signatures in zip(columns, columns_signatures):
+            logging.info(f"Processing {table_name} - {column_name} - {len(column_values)}")
+            keys = [f"{table_name}_{column_name}_{id}" for id in range(len(column_values))]
+            # Band keys as MinHashLSH computes them: the byteswapped bytes of each band of the signature
+            swapped = signatures.byteswap()
+            bands = []
+            for start, end in lsh.hashranges:
+                band_bytes = np.ascontiguousarray(swapped[:, start:end]).tobytes()
+                width = (end - start) * swapped.itemsize
+                bands.append([band_bytes[i * width:(i + 1) * width] for i in range(len(keys))])
+            for id, (key, value) in enumerate(zip(keys, column_values)):
+                minhashes[key] = (MinHash(num_perm=signature_size, hashvalues=signatures[id], permutations=permutations), table_name, column_name, value)
+                Hs = [band[id] for band in bands]
+                lsh.keys.insert(key, *Hs)
+                for H, hashtable in zip(Hs, lsh.hashtables):
+                    hashtable.insert(H, key)
+            if verbose:
+                progress_bar.update(len(column_values))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if verbose:
+        progress_bar.close()
+
+    return lsh, minhashes
+
 def make_db_lsh(db_directory_path: str, **kwargs: Any) -> None:
     """
     Creates a MinHash LSH for the database and saves the results.
@@ -164,7 +306,7 @@ def make_db_lsh(db_directory_path: str, **kwargs: Any) -> None:
     preprocessed_path = Path(db_directory_path) / "preprocessed"
     preprocessed_path.mkdir(exist_ok=True)
     
-    unique_values = _get_unique_values(str(Path(db_directory_path) / f"{db_id}.sqlite"))
+    unique_values = _get_unique_values(str(Path(db_directory_path) / f"{db_id}.sqlite"), num_workers=kwargs.get("num_workers", 1))
     logging.info("Unique values obtained")
     
     with open(preprocessed_path / f"{db_id}_unique_values.pkl", "wb") as file:
@@ -175,5 +317,22 @@ def make_db_lsh(db_directory_path: str, **kwargs: Any) -> None:
     
     with open(preprocessed_path / f"{db_id}_lsh.pkl", "wb") as file:
         pickle.dump(lsh, file)
-    with open(preprocessed_path / f"{db_id}_minhashes.pkl", "wb") as file:
-        pickle.dump(minhashes, file)
+    MinHashStore.write(preprocessed_path / f"{db_id}_minhashes", minhashes)
+
+def convert_db_minhashes(db_directory_path: str) -> None:
+    """
+    Converts the pickled MinHashes of a preprocessed database to a MinHashStore and removes the pickle file.
+
+    Args:
+        db_directory_path (str): The path to the database directory.
+    """
+    db_id = Path(db_directory_path).name
+    preprocessed_path = Path(db_directory_path) / "preprocessed"
+    minhashes_path = preprocessed_path / f"{db_id}_minhashes.pkl"
+    if not minhashes_path.exists():
+        logging.info(f"No pickled minhashes for {db_id}")
+        return
+    with open(minhashes_path, "rb") as file:
+        minhashes = pickle.load(file)
+    MinHashStore.write(preprocessed_path / f"{db_id}_minhashes", minhashes)
+    minhashes_path.unlink()
@@ -1,10 +1,12 @@
 import pickle
+import numpy as np
 from datasketch import MinHash, MinHashLSH
 from pathlib import Path
 import logging
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Union
 
-from database_utils.db_values.preprocess import _create_minhash
+from database_utils.db_values.preprocess import _create_minhashes
+from database_utils.db_values.minhash_store import MinHashStore
 
 ### Database value similarity ###
 
@@ -21,7 +23,24 @@ def _jaccard_similarity(m1: MinHash, m2: MinHash) -> float:
     """
     return m1.jaccard(m2)
 
-def load_db_lsh(db_directory_path: str) -> Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]:
+def load_db_minhashes(db_directory_path: str) -> Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]:
+    """
+    Loads the MinHashes of a database, from the memory-mapped store if it exists, otherwise from the pickle file.
+
+    Args:
+        db_directory_path (str): The path to the database directory.
+
+    Returns:
+        Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]: The MinHashes.
+    """
+    db_id = Path(db_directory_path).name
+    store_path = Path(db_directory_path) / "preprocessed" / f"{db_id}_minhashes"
+    if (store_path / "meta.json").exists():
+        return MinHashStore(store_path)
+    with open(Path(db_directory_path) / "preprocessed" / f"{db_id}_minhashes.pkl", "rb") as file:
+        return pickle.load(file)
+
+def load_db_lsh(db_directory_path: str) -> Tuple[MinHashLSH, Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]]:
     """
     Loads the LSH and MinHashes from the preprocessed files in the specified directory.
 
@@ -29,7 +48,7 @@ def load_db_lsh(db_directory_path: str) -> Tuple[MinHashLSH, Dict[str, Tuple[Min
         db_directory_path (str): The path to the database directory.
 
     Returns:
-        Tuple[MinHashLSH, Dict[str, Tuple[MinHash, str, str, str]]]: The LSH object and the dictionary of MinHashes.
+        Tuple[MinHashLSH, Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]]: The LSH object and the MinHashes.
 
     Raises:
         Exception: If there is an error loading the LSH or MinHashes.
@@ -38,21 +57,20 @@ def load_db_lsh(db_directory_path: str) -> Tuple[MinHashLSH, Dict[str, Tuple[Min
     try:
         with open(Path(db_directory_path) / "preprocessed" / f"{db_id}_lsh.pkl", "rb") as file:
             lsh = pickle.load(file)
-        with open(Path(db_directory_path) / "preprocessed" / f"{db_id}_minhashes.pkl", "rb") as file:
-            minhashes = pickle.load(file)
+        minhashes = load_db_minhashes(db_directory_path)
         return lsh, minhashes
     except Exception as e:
         logging.error(f"Error loading LSH for {db_id}: {e}")
         raise e
 
-def query_lsh(lsh: MinHashLSH, minhashes: Dict[str, Tuple[MinHash, str, str, str]], keyword: str, 
+def query_lsh(lsh: MinHashLSH, minhashes: Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]], keyword: str, 
               signature_size: int = 100, n_gram: int = 3, top_n: int = 10) -> Dict[str, Dict[str, List[str]]]:
     """
     Queries the LSH for similar values to the given keyword and returns the top results.
 
     Args:
         lsh (MinHashLSH): The LSH object.
-        minhashes (Dict[str, Tuple[MinHash, str, str, str]]): The dictionary of MinHashes.
+        minhashes (Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]): The MinHashes.
         keyword (str): The keyword to search for.
         signature_size (int, optional): The size of the MinHash signature.
         n_gram (int, optional): The n-gram size for the MinHash.
@@ -61,14 +79,72 @@ def query_lsh(lsh: MinHashLSH, minhashes: Dict[str, Tuple[MinHash, str, str, str
     Returns:
         Dict[str, Dict[str, List[str]]]: A dictionary containing the top similar values.
     """
-    query_minhash = _create_minhash(signature_size, keyword, n_gram)
+    return query_lsh_batch(lsh, minhashes, [keyword], signature_size, n_gram, top_n)[0]
+
+def query_lsh_batch(lsh: MinHashLSH, minhashes: Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]], keywords: List[str],
+                    signature_size: int = 100, n_gram: int = 3, top_n: int = 10) -> List[Dict[str, Dict[str, List[str]]]]:
+    """
+    Queries the LSH for similar values to each of the given keywords and returns the top results.
+
+    The query MinHashes of all unique keywords are built in one pass, and the LSH is probed once per
+    unique signature, so duplicate keywords and keywords sharing the same n-grams cost a single lookup.
+
+    Args:
+        lsh (MinHashLSH): The LSH object.
+        minhashes (Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]): The MinHashes.
+        keywords (List[str]): The keywords to search for.
+        signature_size (int, optional): The size of the MinHash signature.
+        n_gram (int, optional): The n-gram size for the MinHash.
+        top_n (int, optional): The number of top results to return per keyword.
+
+    Returns:
+        List[Dict[str, Dict[str, List[str]]]]: The top similar values for each keyword, in input order.
+    """
+    unique_keywords = list(dict.fromkeys(keywords))
+    query_minhashes = _create_minhashes(signature_size, unique_keywords, n_gram)
+
+    results_by_signature: Dict[bytes, Dict[str, Dict[str, List[str]]]] = {}
+    results_by_keyword: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+    for keyword, query_minhash in zip(unique_keywords, query_minhashes):
+        signature = query_minhash.hashvalues.tobytes()
+        if signature not in results_by_signature:
+            results_by_signature[signature] = _top_similar_values(lsh, minhashes, query_minhash, top_n)
+        results_by_keyword[keyword] = results_by_signature[signature]
+    return [results_by_keyword[keyword] for keyword in keywords]
+
+def _top_similar_values(lsh: MinHashLSH, minhashes: Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]], query_minhash: MinHash,
+                        top_n: int) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Probes the LSH with a query MinHash and groups the top results by table and column.
+
+    Args:
+        lsh (MinHashLSH): The LSH object.
+        minhashes (Union[MinHashStore, Dict[str, Tuple[MinHash, str, str, str]]]): The MinHashes.
+        query_minhash (MinHash): The query MinHash.
+        top_n (int): The number of top results to return.
+
+    Returns:
+        Dict[str, Dict[str, List[str]]]: A dictionary containing the top similar values.
+    """
     results = lsh.query(query_minhash)
-    similarities = [(result, _jaccard_similarity(query_minhash, minhashes[result][0])) for result in results]
+    is_store = isinstance(minhashes, MinHashStore)
+    if results:
+        # Jaccard estimates of all candidates at once, equal to MinHash.jaccard
+        if is_store:
+            results = minhashes.rows(results)
+            candidate_hashvalues = minhashes.signatures[results]
+            results = results.tolist()
+        else:
+            candidate_hashvalues = np.stack([minhashes[result][0].hashvalues for result in results])
+        scores = np.count_nonzero(candidate_hashvalues == query_minhash.hashvalues, axis=1) / len(query_minhash.hashvalues)
+        similarities = list(zip(results, scores.tolist()))
+    else:
+        similarities = []
     similarities = sorted(similarities, key=lambda x: x[1], reverse=True)[:top_n]
 
     similar_values_trimmed: Dict[str, Dict[str, List[str]]] = {}
     for result, similarity in similarities:
-        table_name, column_name, value = minhashes[result][1:]
+        table_name, column_name, value = minhashes.entry(result) if is_store else minhashes[result][1:]
         if table_name not in similar_values_trimmed:
             similar_values_trimmed[table_name] = {}
         if column_name not in similar_values_trimmed[table_name]:
@@ -1,11 +1,16 @@
 import sqlite3
 import random
 import logging
-from typing import Any, Union, List, Dict
+import hashlib
+import time
+import re
+from urllib.parse import quote
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Union, List, Dict, Tuple, Optional
 from func_timeout import func_timeout, FunctionTimedOut
-from multiprocessing import Process, Queue
 import threading
-from queue import Empty
 from enum import Enum
 
 import os
@@ -15,42 +20,355 @@ from sqlglot import parse_one, exp
 class TimeoutException(Exception):
     pass
 
+class ResultLimitExceeded(Exception):
+    pass
 
 
-def execute_sql(db_path: str, sql: str, fetch: Union[str, int] = "all", timeout: int = 60) -> Any:
-    class QueryThread(threading.Thread):
-        def __init__(self):
-            threading.Thread.__init__(self)
-            self.result = None
-            self.exception = None
 
-        def run(self):
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", 8))
+PROGRESS_HANDLER_STEPS = 1000
+
+@dataclass
+class QueryMetrics:
+    """
+    Execution metrics of one query.
+
+    Attributes:
+        db_path (str): The path to the database file.
+        sql (str): The SQL query.
+        execution_time (float): Wall time spent executing and fetching, in seconds.
+        rows_fetched (int): The number of rows fetched.
+        status (str): "ok", "timeout" or "error".
+    """
+    db_path: str
+    sql: str
+    execution_time: float = 0.0
+    rows_fetched: int = 0
+    status: str = "ok"
+
+class ConnectionPool:
+    """
+    Read-only (mode=ro, immutable=1) sqlite connections kept per database file and reused across queries.
+    A connection is used by one thread at a time; at most max_idle idle connections are kept per database.
+    Connections inherited by a forked process are dropped rather than reused.
+    """
+
+    def __init__(self, max_idle: int = SQL_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle: Dict[str, List[sqlite3.Connection]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def acquire(self, db_path: str) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = defaultdict(list)
+                self._pid = os.getpid()
+            if self._idle[db_path]:
+                return self._idle[db_path].pop()
+        uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro&immutable=1"
+        return sqlite3.connect(uri, uri=True, timeout=60, check_same_thread=False)
+
+    def release(self, db_path: str, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle[db_path]) < self.max_idle:
+                self._idle[db_path].append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for connections in self._idle.values():
+                for conn in connections:
+                    conn.close()
+            self._idle.clear()
+
+_connection_pool = ConnectionPool()
+
+class ExecutionStats:
+    """Per-process counters of the queries run by execute_sql."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows_fetched = 0
+
+    def record(self, metrics: QueryMetrics) -> None:
+        with self._lock:
+            self.queries += 1
+            self.timeouts += metrics.status == "timeout"
+            self.errors += metrics.status == "error"
+            self.total_time += metrics.execution_time
+            self.max_time = max(self.max_time, metrics.execution_time)
+            self.rows_fetched += metrics.rows_fetched
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "total_time": self.total_time,
+                "mean_time": self.total_time / self.queries if self.queries else 0.0,
+                "max_time": self.max_time,
+                "rows_fetched": self.rows_fetched,
+            }
+
+_execution_stats = ExecutionStats()
+
+def get_execution_stats() -> Dict[str, Any]:
+    """Returns the query count, timeouts, errors, execution times and rows fetched of this process."""
+    return _execution_stats.as_dict()
+
+def execute_sql_with_metrics(db_path: str, sql: str, fetch: Union[str, int] = "all", timeout: int = 60) -> Tuple[Any, QueryMetrics]:
+    """
+    Executes an SQL query on a pooled read-only connection and fetches results.
+    The query is interrupted by a sqlite progress handler once the timeout has passed,
+    so a timed out query stops running and its connection is returned to the pool.
+
+    Args:
+        db_path (str): The path to the database file.
+        sql (str): The SQL query to execute.
+        fetch (Union[str, int]): How to fetch the results. Options are "all", "one", "random", or an integer.
+        timeout (int): The timeout in seconds.
+
+    Returns:
+        Tuple[Any, QueryMetrics]: The fetched results based on the fetch argument, and the execution metrics.
+
+    Raises:
+        TimeoutError: If the query runs longer than the timeout.
+        Exception: If an error occurs during SQL execution.
+    """
+    metrics = QueryMetrics(db_path=db_path, sql=sql)
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    conn = _connection_pool.acquire(db_path)
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        if fetch == "all":
+            result = cursor.fetchall()
+            metrics.rows_fetched = len(result)
+        elif fetch == "one":
+            result = cursor.fetchone()
+            metrics.rows_fetched = int(result is not None)
+        elif fetch == "random":
+            samples = cursor.fetchmany(10)
+            metrics.rows_fetched = len(samples)
+            result = random.choice(samples) if samples else []
+        elif isinstance(fetch, int):
+            result = cursor.fetchmany(fetch)
+            metrics.rows_fetched = len(result)
+        else:
+            raise ValueError("Invalid fetch argument. Must be 'all', 'one', 'random', or an integer.")
+        return result, metrics
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            metrics.status = "timeout"
+            raise TimeoutError(f"SQL query execution exceeded the timeout of {timeout} seconds.") from e
+        metrics.status = "error"
+        raise
+    except Exception:
+        metrics.status = "error"
+        raise
+    finally:
+        metrics.execution_time = time.monotonic() - start_time
+        _execution_stats.record(metrics)
+        cursor.close()
+        conn.set_progress_handler(None, 0)
+        _connection_pool.release(db_path, conn)
+
+EXECUTION_CACHE_MAX_ROWS = int(os.getenv("EXECUTION_CACHE_MAX_ROWS", 50000))
+_SQL_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|\s+")
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalizes an SQL query for cache lookups: whitespace runs outside quoted literals and identifiers
+    collapse to one space, and surrounding whitespace and trailing semicolons are removed.
+
+    Args:
+        sql (str): The SQL query.
+
+    Returns:
+        str: The normalized SQL query.
+    """
+    sql = _SQL_TOKEN_PATTERN.sub(lambda match: " " if match.group(0).isspace() else match.group(0), sql)
+    return sql.strip().rstrip(";").strip()
+
+@dataclass
+class CachedExecution:
+    """
+    The outcome of one query in an ExecutionCache.
+
+    Attributes:
+        rows (Optional[List[Any]]): The fetched rows, None if the query failed.
+        limit (Optional[int]): The number of rows requested when rows is only a prefix of the result, None if rows is complete.
+        error (Optional[Exception]): The error raised by the query.
+        timeout (float): The timeout the query ran with.
+        execution_time (float): The execution time in seconds.
+    """
+    rows: Optional[List[Any]] = None
+    limit: Optional[int] = None
+    error: Optional[Exception] = None
+    timeout: float = 0.0
+    execution_time: float = 0.0
+
+class ExecutionCache:
+    """
+    Results, errors and timings of the queries run during one task, keyed by (db_path, normalized SQL).
+
+    A query runs at most once per cache: fetching fewer rows, one row or a random row is served from
+    a previous fetch of more rows, errors are raised again, and a timeout is reused for requests with
+    the same or a shorter timeout. Results with more than max_rows rows are not kept.
+    """
+
+    def __init__(self, max_rows: int = EXECUTION_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self._entries: Dict[Tuple[str, str], CachedExecution] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_time = 0.0
+
+    @staticmethod
+    def _rows_needed(fetch: Union[str, int]) -> Optional[int]:
+        if fetch == "all":
+            return None
+        if fetch == "one":
+            return 1
+        if fetch == "random":
+            return 10
+        if isinstance(fetch, int):
+            return fetch
+        raise ValueError("Invalid fetch argument. Must be 'all', 'one', 'random', or an integer.")
+
+    @staticmethod
+    def _can_serve(entry: CachedExecution, rows_needed: Optional[int], timeout: float) -> bool:
+        if entry.error is not None:
+            return not isinstance(entry.error, TimeoutError) or timeout <= entry.timeout
+        return entry.limit is None or (rows_needed is not None and rows_needed <= entry.limit)
+
+    @staticmethod
+    def _serve(entry: CachedExecution, fetch: Union[str, int]) -> Any:
+        if entry.error is not None:
+            raise entry.error
+        if fetch == "all":
+            return list(entry.rows)
+        if fetch == "one":
+            return entry.rows[0] if entry.rows else None
+        if fetch == "random":
+            samples = entry.rows[:10]
+            return random.choice(samples) if samples else []
+        return entry.rows[:fetch]
+
+    def execute(self, db_path: str, sql: str, fetch: Union[str, int] = "all", timeout: int = 60) -> Any:
+        """
+        Executes an SQL query through the cache.
+
+        Args:
+            db_path (str): The path to the database file.
+            sql (str): The SQL query to execute.
+            fetch (Union[str, int]): How to fetch the results. Options are "all", "one", "random", or an integer.
+            timeout (int): The timeout in seconds.
+
+        Returns:
+            Any: The fetched results based on the fetch argument.
+        """
+        rows_needed = self._rows_needed(fetch)
+        key = (db_path, normalize_sql(sql))
+        with self._lock:
+            key_lock = self._key_locks[key]
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._can_serve(entry, rows_needed, timeout):
+                with self._lock:
+                    self.hits += 1
+                    self.saved_time += entry.execution_time
+                return self._serve(entry, fetch)
+            with self._lock:
+                self.misses += 1
+            entry = CachedExecution(limit=rows_needed, timeout=timeout)
+            start_time = time.monotonic()
             try:
-                with sqlite3.connect(db_path, timeout=60) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(sql)
-                    if fetch == "all":
-                        self.result = cursor.fetchall()
-                    elif fetch == "one":
-                        self.result = cursor.fetchone()
-                    elif fetch == "random":
-                        samples = cursor.fetchmany(10)
-                        self.result = random.choice(samples) if samples else []
-                    elif isinstance(fetch, int):
-                        self.result = cursor.fetchmany(fetch)
-                    else:
-                        raise ValueError("Invalid fetch argument. Must be 'all', 'one', 'random', or an integer.")
+                entry.rows = execute_sql_with_metrics(db_path, sql, "all" if rows_needed is None else rows_needed, timeout)[0]
+                if rows_needed is not None and len(entry.rows) < rows_needed:
+                    entry.limit = None
             except Exception as e:
-                self.exception = e
-    query_thread = QueryThread()
-    query_thread.start()
-    query_thread.join(timeout)
-    if query_thread.is_alive():
-        raise TimeoutError(f"SQL query execution exceeded the timeout of {timeout} seconds.")
-    if query_thread.exception:
-        # logging.error(f"Error in execute_sql: {query_thread.exception}\nSQL: {sql}")
-        raise query_thread.exception
-    return query_thread.result
+                entry.error = e
+            entry.execution_time = time.monotonic() - start_time
+            if entry.rows is not None and len(entry.rows) > self.max_rows:
+                with self._lock:
+                    self.evictions += 1
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = entry
+            return self._serve(entry, fetch)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, Any]: Hits, misses, evictions of too large results, cached queries and execution time saved in seconds.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "cached_queries": len(self._entries),
+                "saved_time": self.saved_time,
+            }
+
+_active_execution_cache: Optional[ExecutionCache] = None
+
+@contextmanager
+def execution_cache_scope(max_rows: int = EXECUTION_CACHE_MAX_ROWS):
+    """
+    Routes every execute_sql call of this process through a fresh ExecutionCache until the scope exits.
+
+    Args:
+        max_rows (int): Results with more rows are not cached.
+
+    Yields:
+        ExecutionCache: The cache of the scope.
+    """
+    global _active_execution_cache
+    previous_cache = _active_execution_cache
+    _active_execution_cache = ExecutionCache(max_rows)
+    try:
+        yield _active_execution_cache
+    finally:
+        _active_execution_cache = previous_cache
+
+def execute_sql(db_path: str, sql: str, fetch: Union[str, int] = "all", timeout: int = 60) -> Any:
+    """
+    Executes an SQL query on a pooled read-only connection and fetches results, see execute_sql_with_metrics.
+    Inside an execution_cache_scope the query is served from the scope's ExecutionCache.
+
+    Args:
+        db_path (str): The path to the database file.
+        sql (str): The SQL query to execute.
+        fetch (Union[str, int]): How to fetch the results. Options are "all", "one", "random", or an integer.
+        timeout (int): The timeout in seconds.
+
+    Returns:
+        Any: The fetched results based on the fetch argument.
+
+    Raises:
+        TimeoutError: If the query runs longer than the timeout.
+        Exception: If an error occurs during SQL execution.
+    """
+    if _active_execution_cache is not None:
+        return _active_execution_cache.execute(db_path, sql, fetch, timeout)
+    return execute_sql_with_metrics(db_path, sql, fetch, timeout)[0]
 
 
 def _clean_sql(sql: str) -> str:
@@ -94,32 +412,13 @@ def create_smaller_db(original_db_path, max_rows=100000):
     conn_new.close()
     return new_db_path
 
-def task(queue, db_path, sql, fetch):
-    try:
-        result = execute_sql(db_path, sql, fetch)
-        queue.put(result)
-    except Exception as e:
-        queue.put(e)
-
 def subprocess_sql_executor(db_path: str, sql: str, timeout: int = 60):
-    queue = Queue()
-    process = Process(target=task, args=(queue, db_path, sql, "all"))
-    process.start()
-    process.join(timeout)
-    if process.is_alive():
-        process.terminate()
-        process.join()
+    # execute_sql cancels timed out queries itself, so no separate process is needed
+    try:
+        return execute_sql(db_path, sql, "all", timeout)
+    except TimeoutError:
         print("Time out in subprocess_sql_executor")
         raise TimeoutError("Execution timed out.")
-    else:
-        try:
-            result = queue.get_nowait()
-        except Empty:
-            raise Exception("No data returned from the process.")
-        
-        if isinstance(result, Exception):
-            raise result
-        return result
 
 # def execute_sql(db_path: str, sql: str, fetch: Union[str, int] = "all") -> Any:
 #     """
@@ -163,28 +462,91 @@ def subprocess_sql_executor(db_path: str, sql: str, timeout: int = 60):
 #         logging.error(f"Error in execute_sql: {e}\nSQL: {sql}, fetch: {fetch}")
 #         raise e
 
-def _compare_sqls_outcomes(db_path: str, predicted_sql: str, ground_truth_sql: str) -> int:
+def _row_digest(row: tuple) -> tuple:
+    """
+    Hashes a result row so that rows equal as Python tuples (e.g. 1 and 1.0) share a digest.
+    
+    Args:
+        row (tuple): A row returned by the cursor.
+        
+    Returns:
+        tuple: The 16-byte digest and the size of the hashed representation in bytes.
+    """
+    row = tuple(int(v) if isinstance(v, float) and v.is_integer() else v for v in row)
+    data = repr(row).encode()
+    return hashlib.blake2b(data, digest_size=16).digest(), len(data)
+
+def _iter_digests(cursor: sqlite3.Cursor, max_rows: int, max_bytes: int, batch_size: int = 1000):
+    """
+    Streams a cursor with fetchmany and yields one digest per row.
+    
+    Raises:
+        ResultLimitExceeded: If the result passes the row or byte cap.
+    """
+    n_rows, n_bytes = 0, 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            n_rows += 1
+            if n_rows > max_rows:
+                raise ResultLimitExceeded(f"Result has more than {max_rows} rows.")
+            digest, size = _row_digest(row)
+            n_bytes += size
+            if n_bytes > max_bytes:
+                raise ResultLimitExceeded(f"Result is larger than {max_bytes} bytes.")
+            yield digest
+
+def _compare_sqls_outcomes(db_path: str, predicted_sql: str, ground_truth_sql: str, timeout: float = 60,
+                           max_rows: int = 1000000, max_bytes: int = 1 << 30) -> int:
     """
     Compares the outcomes of two SQL queries to check for equivalence.
+    Both queries run on a pooled read-only connection under one deadline enforced by the progress handler.
+    Both results are streamed and reduced to sets of row digests, and the comparison
+    stops at the first predicted row that is not in the ground truth result.
     
     Args:
         db_path (str): The path to the database file.
         predicted_sql (str): The predicted SQL query.
         ground_truth_sql (str): The ground truth SQL query.
+        timeout (float): The timeout for both queries together, in seconds.
+        max_rows (int): The maximum number of rows read from either query.
+        max_bytes (int): The maximum number of bytes read from either query.
         
     Returns:
         int: 1 if the outcomes are equivalent, 0 otherwise.
     
     Raises:
-        Exception: If an error occurs during SQL execution.
+        TimeoutError: If the queries run longer than the timeout.
+        Exception: If an error occurs during SQL execution or a result passes the caps.
     """
+    deadline = time.monotonic() + timeout
+    conn = _connection_pool.acquire(db_path)
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+    cursor = conn.cursor()
     try:
-        predicted_res = execute_sql(db_path, predicted_sql)
-        ground_truth_res = execute_sql(db_path, ground_truth_sql)
-        return int(set(predicted_res) == set(ground_truth_res))
+        cursor.execute(ground_truth_sql)
+        ground_truth_digests = set(_iter_digests(cursor, max_rows, max_bytes))
+        cursor.execute(predicted_sql)
+        seen = set()
+        for digest in _iter_digests(cursor, max_rows, max_bytes):
+            if digest not in ground_truth_digests:
+                return 0
+            seen.add(digest)
+        return int(len(seen) == len(ground_truth_digests))
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"SQL comparison exceeded the timeout of {timeout} seconds.") from e
+        logging.critical(f"Error comparing SQL outcomes: {e}")
+        raise e
     except Exception as e:
         logging.critical(f"Error comparing SQL outcomes: {e}")
         raise e
+    finally:
+        cursor.close()
+        conn.set_progress_handler(None, 0)
+        _connection_pool.release(db_path, conn)
 
 def compare_sqls(db_path: str, predicted_sql: str, ground_truth_sql: str, meta_time_out: int = 30) -> Dict[str, Union[int, str]]:
     """
@@ -201,9 +563,9 @@ def compare_sqls(db_path: str, predicted_sql: str, ground_truth_sql: str, meta_t
     """
     predicted_sql = _clean_sql(predicted_sql)
     try:
-        res = func_timeout(meta_time_out, _compare_sqls_outcomes, args=(db_path, predicted_sql, ground_truth_sql))
+        res = _compare_sqls_outcomes(db_path, predicted_sql, ground_truth_sql, timeout=meta_time_out)
         error = "incorrect answer" if res == 0 else "--"
-    except FunctionTimedOut:
+    except TimeoutError:
         logging.warning("Comparison timed out.")
         error = "timeout"
         res = 0
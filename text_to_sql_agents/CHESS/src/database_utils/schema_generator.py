@@ -1,12 +1,27 @@
+import os
 import re
+import pickle
+import hashlib
 import logging
 import random
-from typing import Dict, List, Optional
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
 from database_utils.execution import execute_sql
 from database_utils.db_info import get_db_schema
 from database_utils.schema import DatabaseSchema, get_primary_keys
 
+SCHEMA_PROFILE_VERSION = 1
+SCHEMA_PROFILE_WORKERS = int(os.getenv("SCHEMA_PROFILE_WORKERS", 8))
+
+def _file_hash(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
 class DatabaseSchemaGenerator:
     """
     Generates database schema with optional examples and descriptions.
@@ -80,49 +95,144 @@ class DatabaseSchemaGenerator:
 
         database_schema.set_columns_info(schema_with_references)
 
+    @staticmethod
+    def _profile_table(db_path: str, table_name: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Profiles the columns of a table: type, categorical values and value statistics.
+        
+        Args:
+            db_path (str): The path to the database file.
+            table_name (str): The name of the table.
+        
+        Returns:
+            Dict[str, Dict[str, Any]]: The profile of each column of the table.
+        """
+        table_profile = {}
+        columns = execute_sql(db_path, f"PRAGMA table_info(`{table_name}`)", fetch="all")
+        for col in columns:
+            table_profile[col[1]] = {"type": col[2]}
+            unique_values = execute_sql(db_path, f"SELECT COUNT(*) FROM (SELECT DISTINCT `{col[1]}` FROM `{table_name}` LIMIT 21) AS subquery;", "all", 480)
+            is_categorical = int(unique_values[0][0]) < 20
+            unique_values = None
+            if is_categorical:
+                unique_values = execute_sql(db_path, f"SELECT DISTINCT `{col[1]}` FROM `{table_name}` WHERE `{col[1]}` IS NOT NULL")
+            table_profile[col[1]].update({"unique_values": unique_values})
+            try:
+                value_statics_query = f"""
+                SELECT 'Total count ' || COUNT(`{col[1]}`) || ' - Distinct count ' || COUNT(DISTINCT `{col[1]}`) || 
+                    ' - Null count ' || SUM(CASE WHEN `{col[1]}` IS NULL THEN 1 ELSE 0 END) AS counts  
+                FROM (SELECT `{col[1]}` FROM `{table_name}` LIMIT 100000) AS limited_dataset;
+                """
+                value_statics = execute_sql(db_path, value_statics_query, "all", 480)
+                table_profile[col[1]].update({
+                    "value_statics": str(value_statics[0][0]) if value_statics else None
+                })
+            except Exception as e:
+                print(f"An error occurred while fetching statistics for {col[1]} in {table_name}: {e}")
+                table_profile[col[1]].update({"value_statics": None})
+        return table_profile
+
     @classmethod
-    def _load_schema_into_cache(cls, db_id: str, db_path: str) -> None:
+    def _profile_schema(cls, db_path: str) -> DatabaseSchema:
         """
-        Loads database schema into cache.
+        Profiles the database schema, one table per thread, and sets its primary and foreign keys.
         
         Args:
-            db_id (str): The database identifier.
             db_path (str): The path to the database file.
+        
+        Returns:
+            DatabaseSchema: The profiled database schema.
         """
         db_schema = DatabaseSchema.from_schema_dict(get_db_schema(db_path))
-        # schema_with_type = {
-        #     table_name: {col[1]: {"type": col[2]} for col in execute_sql(db_path, f"PRAGMA table_info(`{table_name}`)", fetch="all")}
-        #     for table_name in db_schema.tables.keys()
-        # }
-        schema_with_type = {}
-        for table_name in db_schema.tables.keys():
-            columns = execute_sql(db_path, f"PRAGMA table_info(`{table_name}`)", fetch="all")
-            schema_with_type[table_name] = {}
-            for col in columns:
-                schema_with_type[table_name][col[1]] = {"type": col[2]}
-                unique_values = execute_sql(db_path, f"SELECT COUNT(*) FROM (SELECT DISTINCT `{col[1]}` FROM `{table_name}` LIMIT 21) AS subquery;", "all", 480)
-                is_categorical = int(unique_values[0][0]) < 20
-                unique_values = None
-                if is_categorical:
-                    unique_values = execute_sql(db_path, f"SELECT DISTINCT `{col[1]}` FROM `{table_name}` WHERE `{col[1]}` IS NOT NULL")
-                schema_with_type[table_name][col[1]].update({"unique_values": unique_values})
-                try:
-                    value_statics_query = f"""
-                    SELECT 'Total count ' || COUNT(`{col[1]}`) || ' - Distinct count ' || COUNT(DISTINCT `{col[1]}`) || 
-                        ' - Null count ' || SUM(CASE WHEN `{col[1]}` IS NULL THEN 1 ELSE 0 END) AS counts  
-                    FROM (SELECT `{col[1]}` FROM `{table_name}` LIMIT 100000) AS limited_dataset;
-                    """
-                    value_statics = execute_sql(db_path, value_statics_query, "all", 480)
-                    schema_with_type[table_name][col[1]].update({
-                        "value_statics": str(value_statics[0][0]) if value_statics else None
-                    })
-                except Exception as e:
-                    print(f"An error occurred while fetching statistics for {col[1]} in {table_name}: {e}")
-                    schema_with_type[table_name][col[1]].update({"value_statics": None})
+        table_names = list(db_schema.tables.keys())
+        with ThreadPoolExecutor(max_workers=max(1, min(SCHEMA_PROFILE_WORKERS, len(table_names)))) as executor:
+            table_profiles = executor.map(lambda table_name: cls._profile_table(db_path, table_name), table_names)
+            schema_with_type = dict(zip(table_names, table_profiles))
         db_schema.set_columns_info(schema_with_type)
+        cls._set_primary_keys(db_path, db_schema)
+        cls._set_foreign_keys(db_path, db_schema)
+        return db_schema
+
+    @staticmethod
+    def _schema_profile_path(db_id: str, db_path: str) -> Path:
+        return Path(db_path).parent / "preprocessed" / f"{db_id}_schema_profile.pkl"
+
+    @classmethod
+    def _read_schema_profile(cls, db_id: str, db_path: str) -> Optional[DatabaseSchema]:
+        """
+        Reads the persisted schema profile of a database if it matches the current profile version and database file.
+        The file hash is only recomputed when the size or modification time of the database file changed.
+        
+        Args:
+            db_id (str): The database identifier.
+            db_path (str): The path to the database file.
+        
+        Returns:
+            Optional[DatabaseSchema]: The profiled database schema, or None if there is no valid profile.
+        """
+        profile_path = cls._schema_profile_path(db_id, db_path)
+        if not profile_path.exists():
+            return None
+        try:
+            with profile_path.open("rb") as file:
+                profile = pickle.load(file)
+        except Exception as e:
+            logging.warning(f"Error reading schema profile for {db_id}: {e}")
+            return None
+        if profile.get("version") != SCHEMA_PROFILE_VERSION:
+            return None
+        stat = os.stat(db_path)
+        if (profile["size"], profile["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            db_hash = _file_hash(db_path)
+            if profile["db_hash"] != db_hash:
+                return None
+            # same content under a new size or mtime (e.g. a copied file): record the new stat so later loads skip the hash
+            cls._write_schema_profile(db_id, db_path, profile["schema"], db_hash=db_hash)
+        return profile["schema"]
+
+    @classmethod
+    def _write_schema_profile(cls, db_id: str, db_path: str, db_schema: DatabaseSchema, db_hash: Optional[str] = None) -> None:
+        """
+        Persists the schema profile of a database, keyed by the hash of the database file.
+        
+        Args:
+            db_id (str): The database identifier.
+            db_path (str): The path to the database file.
+            db_schema (DatabaseSchema): The profiled database schema.
+            db_hash (Optional[str]): The hash of the database file, if already computed.
+        """
+        profile_path = cls._schema_profile_path(db_id, db_path)
+        stat = os.stat(db_path)
+        profile = {
+            "version": SCHEMA_PROFILE_VERSION,
+            "db_hash": db_hash or _file_hash(db_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "schema": db_schema,
+        }
+        temp_path = profile_path.with_name(f"{profile_path.name}.{os.getpid()}.tmp")
+        try:
+            profile_path.parent.mkdir(exist_ok=True)
+            with temp_path.open("wb") as file:
+                pickle.dump(profile, file)
+            os.replace(temp_path, profile_path)
+        except OSError as e:
+            logging.warning(f"Error writing schema profile for {db_id}: {e}")
+
+    @classmethod
+    def _load_schema_into_cache(cls, db_id: str, db_path: str) -> None:
+        """
+        Loads database schema into cache, from the persisted schema profile when it is up to date.
+        
+        Args:
+            db_id (str): The database identifier.
+            db_path (str): The path to the database file.
+        """
+        db_schema = cls._read_schema_profile(db_id, db_path)
+        if db_schema is None:
+            db_schema = cls._profile_schema(db_path)
+            cls._write_schema_profile(db_id, db_path, db_schema)
         cls.CACHED_DB_SCHEMA[db_id] = db_schema
-        cls._set_primary_keys(db_path, cls.CACHED_DB_SCHEMA[db_id])
-        cls._set_foreign_keys(db_path, cls.CACHED_DB_SCHEMA[db_id])
    
     def _initialize_schema_structure(self) -> None:
         """
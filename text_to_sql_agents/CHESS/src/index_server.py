@@ -0,0 +1,18 @@
+import os
+import argparse
+import logging
+from dotenv import load_dotenv
+
+from runner.index_service import IndexServer
+
+load_dotenv(override=True)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+if __name__ == '__main__':
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--address', type=str, default=os.getenv("INDEX_SERVER_ADDRESS", "unix:/tmp/chess_index.sock"),
+                             help="Address to listen on: unix:<socket path> or <loopback host>:<port>")
+    args = args_parser.parse_args()
+
+    IndexServer(args.address).serve_forever()
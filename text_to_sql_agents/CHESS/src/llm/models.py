@@ -1,3 +1,4 @@
+import time
 from typing import Any, Dict, List
 
 from langchain_core.exceptions import OutputParserException
@@ -5,6 +6,8 @@ from langchain.output_parsers import OutputFixingParser
 
 from llm.engine_configs import ENGINE_CONFIGS
 from runner.logger import Logger
+from llm.scheduler import get_llm_scheduler, backoff_delay, is_transient_error
+from llm.response_cache import LLMCacheMiss, LLMResponseCache, get_llm_response_cache
 from threading_utils import ordered_concurrent_function_calls
 
 def get_llm_chain(engine_name: str, temperature: float = 0, base_uri: str = None) -> Any:
@@ -42,9 +45,9 @@ def get_llm_chain(engine_name: str, temperature: float = 0, base_uri: str = None
         llm_chain = model
     return llm_chain
 
-def call_llm_chain(prompt: Any, engine: Any, parser: Any, request_kwargs: Dict[str, Any], step: int, max_attempts: int = 12, backoff_base: int = 2, jitter_max: int = 60) -> Any:
+def call_llm_chain(prompt: Any, engine: Any, parser: Any, request_kwargs: Dict[str, Any], step: int, max_attempts: int = 12, backoff_base: int = 2, jitter_max: int = 60, sample_index: int = 0) -> Any:
     """
-    Calls the LLM chain with exponential backoff and jitter on failure.
+    Calls the LLM chain with exponential backoff and jitter on rate limit and transient failures.
 
     Args:
         prompt (Any): The prompt to be passed to the chain.
@@ -55,20 +58,32 @@ def call_llm_chain(prompt: Any, engine: Any, parser: Any, request_kwargs: Dict[s
         max_attempts (int, optional): The maximum number of attempts. Defaults to 12.
         backoff_base (int, optional): The base for exponential backoff. Defaults to 2.
         jitter_max (int, optional): The maximum jitter in seconds. Defaults to 60.
+        sample_index (int, optional): The index of the sample among repeated calls with the same request. Defaults to 0.
 
     Returns:
         Any: The output from the chain.
 
     Raises:
-        Exception: If all attempts fail.
+        LLMCacheMiss: If the response cache is in replay mode and the response is not cached.
+        Exception: If all attempts fail, or at once if the error is not transient.
     """
     logger = Logger()
+    response_cache = get_llm_response_cache()
     for attempt in range(max_attempts):
         try:
             # chain = prompt | engine | parser
             chain = prompt | engine
-            prompt_text = prompt.invoke(request_kwargs).messages[0].content
-            output = chain.invoke(request_kwargs)
+            prompt_value = prompt.invoke(request_kwargs)
+            prompt_text = prompt_value.messages[0].content
+            cache_key = None
+            output = None
+            if response_cache is not None:
+                cache_key = LLMResponseCache.make_key(engine, prompt_value.to_string(), sample_index)
+                output = response_cache.get(cache_key, step)
+            cached = output is not None
+            if not cached:
+                with get_llm_scheduler().request(step):
+                    output = chain.invoke(request_kwargs)
             if isinstance(output, str):
                 if output.strip() == "":
                     engine = get_llm_chain("gemini-1.5-flash")
@@ -77,7 +92,11 @@ def call_llm_chain(prompt: Any, engine: Any, parser: Any, request_kwargs: Dict[s
                 if output.content.strip() == "":    
                     engine = get_llm_chain("gemini-1.5-flash")
                     raise OutputParserException("Empty output")
+            raw_output = output if isinstance(output, str) else output.content
             output = parser.invoke(output)
+            # only responses that parse are cached, so a cached response never fails the parser
+            if cache_key is not None and not cached:
+                response_cache.put(cache_key, raw_output, step)
             logger.log_conversation(
                 [
                     {
@@ -100,14 +119,16 @@ def call_llm_chain(prompt: Any, engine: Any, parser: Any, request_kwargs: Dict[s
             if attempt == max_attempts - 1:
                 logger.log(f"call_chain: {e}", "error")
                 raise e
+        except LLMCacheMiss:
+            raise
         except Exception as e:
-            # if attempt < max_attempts - 1:
-            #     logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)}\n{e}", "warning")
-            #     sleep_time = (backoff_base ** attempt) + random.uniform(0, jitter_max)
-            #     time.sleep(sleep_time)
-            # else:
-            logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)} <{e}>\n", "error")
-            raise e
+            # deterministic failures (auth, bad request, context length, prompt errors) are raised at once
+            if attempt < max_attempts - 1 and is_transient_error(e):
+                logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)}\n{e}", "warning")
+                time.sleep(backoff_delay(attempt, backoff_base, jitter_max))
+            else:
+                logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)} <{e}>\n", "error")
+                raise e
 
 def async_llm_chain_call(
     prompt: Any, 
@@ -135,7 +156,7 @@ def async_llm_chain_call(
     call_list = []
     engine_id = 0
     for request_id, request_kwargs in enumerate(request_list):
-        for _ in range(sampling_count):
+        for sample_index in range(sampling_count):
             call_list.append({
                 'function': call_llm_chain,
                 'kwargs': {
@@ -143,7 +164,8 @@ def async_llm_chain_call(
                     'engine': engine[engine_id % len(engine)] if isinstance(engine,list) else engine,
                     'parser': parser,
                     'request_kwargs': request_kwargs,
-                    'step': step
+                    'step': step,
+                    'sample_index': sample_index
                 }
             })
             engine_id += 1
@@ -161,7 +183,7 @@ def async_llm_chain_call(
 
 def call_engine(message: str, engine: Any, max_attempts: int = 12, backoff_base: int = 2, jitter_max: int = 60) -> Any:
     """
-    Calls the LLM chain with exponential backoff and jitter on failure.
+    Calls the LLM chain with exponential backoff and jitter on rate limit and transient failures.
 
     Args:
         message (str): The message to be passed to the chain.
@@ -174,18 +196,30 @@ def call_engine(message: str, engine: Any, max_attempts: int = 12, backoff_base:
         Any: The output from the chain.
 
     Raises:
-        Exception: If all attempts fail.
+        LLMCacheMiss: If the response cache is in replay mode and the response is not cached.
+        Exception: If all attempts fail, or at once if the error is not transient.
     """
     logger = Logger()
+    response_cache = get_llm_response_cache()
+    cache_key = LLMResponseCache.make_key(engine, message) if response_cache is not None else None
     for attempt in range(max_attempts):
         try:
-            output = engine.invoke(message)
+            if cache_key is not None:
+                output = response_cache.get(cache_key, "call_engine")
+                if output is not None:
+                    return output
+            with get_llm_scheduler().request("call_engine"):
+                output = engine.invoke(message)
+            if cache_key is not None:
+                response_cache.put(cache_key, output.content, "call_engine")
             return output.content
+        except LLMCacheMiss:
+            raise
         except Exception as e:
-            # if attempt < max_attempts - 1:
-            #     logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)}\n{e}", "warning")
-            #     sleep_time = (backoff_base ** attempt) + random.uniform(0, jitter_max)
-            #     time.sleep(sleep_time)
-            # else:
-            logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)} <{e}>\n", "error")
-            raise e
\ No newline at end of file
+            # deterministic failures (auth, bad request, context length, prompt errors) are raised at once
+            if attempt < max_attempts - 1 and is_transient_error(e):
+                logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)}\n{e}", "warning")
+                time.sleep(backoff_delay(attempt, backoff_base, jitter_max))
+            else:
+                logger.log(f"Failed to invoke the chain {attempt + 1} times.\n{type(e)} <{e}>\n", "error")
+                raise e
\ No newline at end of file
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 1 << 30))
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite")
+LLM_CACHE_REFRESH_STEPS = os.getenv("LLM_CACHE_REFRESH_STEPS", "")
+TRIM_INTERVAL = 64
+
+class LLMCacheMiss(Exception):
+    """Raised in replay mode when a response is not in the cache."""
+
+def engine_cache_key(engine: Any) -> str:
+    """
+    Returns a stable description of an LLM chain's model configuration.
+
+    Args:
+        engine (Any): The LLM chain, as returned by get_llm_chain.
+
+    Returns:
+        str: The model class and its identifying parameters (model name, temperature, ...) as JSON.
+    """
+    # chains with a preprocess step end with the model
+    model = getattr(engine, "last", engine)
+    params = getattr(model, "_identifying_params", None) or {}
+    return json.dumps({"class": type(model).__name__, "params": params}, sort_keys=True, default=str)
+
+class LLMResponseCache:
+    """
+    Persistent, content-addressed cache of LLM responses in a SQLite file shared by all worker processes.
+
+    Responses are keyed by the sha256 of (engine config, temperature, rendered prompt, sample index), so
+    repeated samples of the same prompt stay distinct and a rerun replays each sample in order. Only
+    responses that parsed successfully are stored. Least recently used responses are evicted once the
+    stored text passes max_bytes.
+
+    Modes:
+        readwrite: Serve hits, call the LLM on misses and store the responses.
+        replay: Serve hits and raise LLMCacheMiss on misses, for offline reruns.
+        write: Always call the LLM and overwrite the stored responses.
+
+    Steps starting with one of refresh_steps always call the LLM, so a stage that changed can be rerun
+    while the stages before it are replayed; the stages after it miss naturally as their prompts change.
+    """
+
+    def __init__(self, path: str, max_bytes: int = LLM_CACHE_MAX_BYTES, mode: str = LLM_CACHE_MODE,
+                 refresh_steps: Optional[List[str]] = None):
+        if mode not in ("readwrite", "replay", "write"):
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.refresh_steps = tuple(refresh_steps or [])
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_connection"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection inherited from the parent of a forked pool worker must not be shared
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, step TEXT, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def make_key(engine: Any, prompt: str, sample_index: int = 0) -> str:
+        """
+        Returns the cache key of a request.
+
+        Args:
+            engine (Any): The LLM chain.
+            prompt (str): The fully rendered prompt.
+            sample_index (int): The index of the sample among repeated calls with the same prompt.
+
+        Returns:
+            str: The hex digest of the key.
+        """
+        model = getattr(engine, "last", engine)
+        key = json.dumps([engine_cache_key(engine), getattr(model, "temperature", None), prompt, sample_index], default=str)
+        return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+    def reads_step(self, step: Any) -> bool:
+        """Returns whether responses of the step are served from the cache."""
+        return self.mode != "write" and not (self.refresh_steps and str(step).startswith(self.refresh_steps))
+
+    def get(self, key: str, step: Any = None) -> Optional[str]:
+        """
+        Looks up a response.
+
+        Args:
+            key (str): The cache key.
+            step (Any): The workflow step of the request.
+
+        Returns:
+            Optional[str]: The cached response, or None if the LLM has to be called.
+
+        Raises:
+            LLMCacheMiss: If the response is missing in replay mode.
+        """
+        if not self.reads_step(step):
+            return None
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No cached response for step {step} (key {key})")
+        return None
+
+    def put(self, key: str, response: str, step: Any = None) -> None:
+        """
+        Stores a response, evicting the least recently used responses if the cache grew past max_bytes.
+
+        Args:
+            key (str): The cache key.
+            response (str): The raw response text.
+            step (Any): The workflow step of the request.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, step, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, str(step), response, len(response.encode("utf8")), now, now),
+            )
+            self.writes += 1
+            if self.writes % TRIM_INTERVAL == 1:
+                self._trim(connection)
+
+    def _trim(self, connection: sqlite3.Connection) -> None:
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # evict down to 90% of the limit so that trimming does not run on every write
+        to_free = total_size - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if freed >= to_free:
+                break
+            keys.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+    def stats(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Returns the counters of this process.
+
+        Args:
+            reset (bool): Whether to clear the counters afterwards.
+
+        Returns:
+            Dict[str, Any]: Mode, hits, misses, writes and evictions.
+        """
+        with self._lock:
+            stats = {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
+            if reset:
+                self._reset_stats()
+        return stats
+
+_response_cache: Optional[LLMResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """Returns the response cache of this process, or None if LLM_CACHE_PATH is not set."""
+    global _response_cache
+    if not LLM_CACHE_PATH:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            refresh_steps = [step.strip() for step in LLM_CACHE_REFRESH_STEPS.split(",") if step.strip()]
+            _response_cache = LLMResponseCache(LLM_CACHE_PATH, refresh_steps=refresh_steps)
+        return _response_cache
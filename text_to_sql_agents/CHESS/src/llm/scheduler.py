@@ -0,0 +1,204 @@
+import os
+import time
+import random
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))
+LLM_BURST = int(os.getenv("LLM_BURST", 10))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Checks whether an exception raised by a provider client signals rate limiting or overload.
+
+    Args:
+        error (Exception): The exception.
+
+    Returns:
+        bool: True for 429/529 responses and rate limit or overload errors.
+    """
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status_code in (429, 529):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("ratelimit", "rate limit", "rate_limit", "429", "resource_exhausted", "resourceexhausted", "overloaded"))
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Checks whether a failed LLM request is worth retrying: rate limiting, server errors, timeouts and
+    connection errors. Authentication, bad requests, context length and prompt errors fail again on retry.
+
+    Args:
+        error (Exception): The exception.
+
+    Returns:
+        bool: True for rate limit errors, 5xx responses, timeouts and connection errors.
+    """
+    if is_rate_limit_error(error):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500 or status_code == 408
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__.lower()
+    return any(marker in name for marker in ("timeout", "connection", "serviceunavailable", "internalserver", "deadlineexceeded", "unavailable"))
+
+def backoff_delay(attempt: int, backoff_base: float = 2, jitter_max: float = 60, backoff_max: float = 300) -> float:
+    """
+    Returns the delay before retrying a failed request: exponential in the attempt number, capped, plus uniform jitter.
+
+    Args:
+        attempt (int): The zero-based number of the failed attempt.
+        backoff_base (float): The base of the exponential backoff.
+        jitter_max (float): The maximum jitter in seconds.
+        backoff_max (float): The maximum exponential delay in seconds.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return min(backoff_base ** attempt, backoff_max) + random.uniform(0, jitter_max)
+
+class LLMScheduler:
+    """
+    Admission control for LLM requests, shared by all worker processes of a run.
+
+    A token bucket limits the request rate and a concurrency cap limits in-flight requests. The cap adapts
+    additively-increase/multiplicatively-decrease: it grows by one request per cap's worth of successes whose
+    latency stays near the observed average, and halves on rate limit errors. The state lives in
+    multiprocessing primitives, so the scheduler has to reach worker processes at creation time, e.g. as a
+    Pool initializer argument (see set_llm_scheduler).
+
+    Per-step queue wait and service time are kept per process.
+    """
+
+    def __init__(self, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE, burst: int = LLM_BURST,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, min_concurrency: int = LLM_MIN_CONCURRENCY):
+        self.rate = requests_per_minute / 60
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self._condition = multiprocessing.Condition()
+        self._tokens = multiprocessing.RawValue("d", self.burst)
+        self._last_refill = multiprocessing.RawValue("d", time.monotonic())
+        self._limit = multiprocessing.RawValue("d", self.max_concurrency)
+        self._in_flight = multiprocessing.RawValue("i", 0)
+        self._mean_latency = multiprocessing.RawValue("d", 0.0)
+        self._stats_lock = threading.Lock()
+        self._step_stats: Dict[Any, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_stats_lock"], state["_step_stats"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+        self._step_stats = defaultdict(lambda: defaultdict(float))
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self._tokens.value = min(self.burst, self._tokens.value + (now - self._last_refill.value) * self.rate)
+        self._last_refill.value = now
+
+    def _acquire(self) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                has_token = self.rate <= 0 or self._tokens.value >= 1
+                if has_token and self._in_flight.value < int(self._limit.value):
+                    if self.rate > 0:
+                        self._tokens.value -= 1
+                    self._in_flight.value += 1
+                    return
+                # wake up when the next token is due; releases notify earlier
+                wait = (1 - self._tokens.value) / self.rate if not has_token else None
+                self._condition.wait(timeout=wait if wait is None else max(wait, 0.001))
+
+    def _release(self, latency: Optional[float], rate_limited: bool) -> None:
+        with self._condition:
+            self._in_flight.value -= 1
+            limit = self._limit.value
+            if rate_limited:
+                limit = max(self.min_concurrency, limit / 2)
+            elif latency is not None:
+                mean_latency = self._mean_latency.value
+                if mean_latency == 0 or latency <= 2 * mean_latency:
+                    limit = min(self.max_concurrency, limit + 1 / limit)
+                else:
+                    limit = max(self.min_concurrency, limit * 0.9)
+                self._mean_latency.value = latency if mean_latency == 0 else 0.9 * mean_latency + 0.1 * latency
+            self._limit.value = limit
+            self._condition.notify_all()
+
+    @contextmanager
+    def request(self, step: Any = None):
+        """
+        Waits for admission, then runs the body as one LLM request and records its timings under step.
+
+        Args:
+            step (Any): The workflow step the request belongs to.
+        """
+        queued_at = time.monotonic()
+        self._acquire()
+        started_at = time.monotonic()
+        latency, rate_limited = None, False
+        try:
+            yield
+            latency = time.monotonic() - started_at
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            finished_at = time.monotonic()
+            self._release(latency, rate_limited)
+            with self._stats_lock:
+                stats = self._step_stats[step]
+                stats["requests"] += 1
+                stats["errors"] += latency is None
+                stats["rate_limited"] += rate_limited
+                stats["queue_wait"] += started_at - queued_at
+                stats["service_time"] += finished_at - started_at
+
+    def concurrency_limit(self) -> int:
+        """Returns the current adaptive concurrency cap."""
+        return int(self._limit.value)
+
+    def stats(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Returns the per-step request counts and total queue wait and service time of this process.
+
+        Args:
+            reset (bool): Whether to clear the counters afterwards.
+
+        Returns:
+            Dict[str, Any]: The current concurrency cap and the counters of each step.
+        """
+        with self._stats_lock:
+            steps = {str(step): dict(stats) for step, stats in self._step_stats.items()}
+            if reset:
+                self._step_stats.clear()
+        return {"concurrency_limit": self.concurrency_limit(), "steps": steps}
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Returns the scheduler of this process, creating one from the LLM_* environment variables if needed."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+def set_llm_scheduler(scheduler: LLMScheduler) -> None:
+    """Installs a scheduler shared with the parent process; used as a Pool initializer."""
+    global _scheduler
+    _scheduler = scheduler
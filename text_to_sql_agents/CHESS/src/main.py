@@ -21,9 +21,11 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument('--num_workers', type=int, default=1, help="Number of workers to use.")
     parser.add_argument('--log_level', type=str, default='warning', help="Logging level.")
     parser.add_argument('--pick_final_sql', type=bool, default=False, help="Pick the final SQL from the generated SQLs.")
+    parser.add_argument('--group_by_db', action='store_true', help="Hand tasks of the same database to the same worker in chunks.")
+    parser.add_argument('--resume_run', type=str, default=None, help="Start time of an interrupted run to resume in its result directory.")
     args = parser.parse_args()
 
-    args.run_start_time = datetime.now().isoformat()
+    args.run_start_time = args.resume_run or datetime.now().isoformat()
     with open(args.config, 'r') as file:
         args.config=yaml.safe_load(file)
     
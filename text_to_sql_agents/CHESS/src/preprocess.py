@@ -4,7 +4,7 @@ import multiprocessing
 from dotenv import load_dotenv
 import logging
 
-from database_utils.db_values.preprocess import make_db_lsh
+from database_utils.db_values.preprocess import make_db_lsh, convert_db_minhashes
 from database_utils.db_catalog.preprocess import make_db_context_vec_db
 
 load_dotenv(override=True)
@@ -22,12 +22,18 @@ def worker_initializer(db_id: str, args: argparse.Namespace):
         args (argparse.Namespace): The command line arguments.
     """
     db_directory_path = f"{args.db_root_directory}/{db_id}"
+    if args.convert_minhashes:
+        logging.info(f"Converting minhashes of {db_id}")
+        convert_db_minhashes(db_directory_path)
+        return
     logging.info(f"Creating LSH for {db_id}")
     make_db_lsh(db_directory_path, 
                 signature_size=args.signature_size, 
                 n_gram=args.n_gram, 
                 threshold=args.threshold,
-                verbose=args.verbose)
+                verbose=args.verbose,
+                batch=args.batch,
+                num_workers=args.num_workers)
     logging.info(f"LSH for {db_id} created.")
     logging.info(f"Creating context vectors for {db_id}")
     make_db_context_vec_db(db_directory_path,
@@ -44,10 +50,18 @@ if __name__ == '__main__':
     args_parser.add_argument('--db_id', type=str, default='all', help="Database ID or 'all' to process all databases")
     args_parser.add_argument('--verbose', type=bool, default=True, help="Enable verbose logging")
     args_parser.add_argument('--use_value_description', type=bool, default=True, help="Include value descriptions")
+    args_parser.add_argument('--batch', action='store_true', help="Compute the MinHash signatures column by column with NumPy")
+    args_parser.add_argument('--convert_minhashes', action='store_true', help="Only convert existing pickled minhashes to the memory-mapped store")
+    args_parser.add_argument('--num_workers', type=int, default=1, help="Number of processes per database fetching table values and computing column signatures")
 
     args = args_parser.parse_args()
 
-    if args.db_id == 'all':
+    if args.db_id == 'all' and args.num_workers > 1:
+        # pool workers cannot start their own pools, so databases are processed one after another
+        for db_id in os.listdir(args.db_root_directory):
+            if os.path.isdir(f"{args.db_root_directory}/{db_id}"):
+                worker_initializer(db_id, args)
+    elif args.db_id == 'all':
         with multiprocessing.Pool(NUM_WORKERS) as pool:
             for db_id in os.listdir(args.db_root_directory):
                 # check if the db_id is a directory
@@ -1,5 +1,4 @@
 import os
-import socket
 import pickle
 from threading import Lock
 from pathlib import Path
@@ -13,16 +12,19 @@ from database_utils.schema_generator import DatabaseSchemaGenerator
 from database_utils.execution import execute_sql, compare_sqls, validate_sql_query, aggregate_sqls, get_execution_status, subprocess_sql_executor
 from database_utils.db_info import get_db_all_tables, get_table_all_columns, get_db_schema
 from database_utils.sql_parser import get_sql_tables, get_sql_columns_dict, get_sql_condition_literals
-from database_utils.db_values.search import query_lsh
+from database_utils.db_values.search import query_lsh_batch, load_db_minhashes
 from database_utils.db_catalog.search import query_vector_db
 from database_utils.db_catalog.preprocess import EMBEDDING_FUNCTION
 from database_utils.db_catalog.csv_utils import load_tables_description
+from runner.index_cache import IndexCache, path_size
+from runner.index_service import IndexClient
 
 load_dotenv(override=True)
 DB_ROOT_PATH = Path(os.getenv("DB_ROOT_PATH"))
 
-# INDEX_SERVER_HOST = os.getenv("INDEX_SERVER_HOST")
-# INDEX_SERVER_PORT = int(os.getenv("INDEX_SERVER_PORT"))
+INDEX_SERVER_ADDRESS = os.getenv("INDEX_SERVER_ADDRESS")
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", 8 * 1024 ** 3))
+INDEX_CACHE_MAX_DATABASES = int(os.getenv("INDEX_CACHE_MAX_DATABASES", 8))
 
 class DatabaseManager:
     """
@@ -31,6 +33,8 @@ class DatabaseManager:
     """
     _instance = None
     _lock = Lock()
+    _index_cache = IndexCache(max_bytes=INDEX_CACHE_MAX_BYTES, max_databases=INDEX_CACHE_MAX_DATABASES)
+    _index_client = IndexClient(INDEX_SERVER_ADDRESS) if INDEX_SERVER_ADDRESS else None
 
     def __new__(cls, db_mode=None, db_id=None):
         if (db_mode is not None) and (db_id is not None):
@@ -57,52 +61,86 @@ class DatabaseManager:
         self.db_mode = db_mode
         self.db_id = db_id
         self._set_paths()
-        self.lsh = None
-        self.minhashes = None
-        self.vector_db = None
+        self.indexes = self._index_cache.get(db_id)
 
     def _set_paths(self):
         """Sets the paths for the database files and directories."""
         self.db_path = DB_ROOT_PATH / f"{self.db_mode}_databases" / self.db_id / f"{self.db_id}.sqlite"
         self.db_directory_path = DB_ROOT_PATH / f"{self.db_mode}_databases" / self.db_id
 
+    @property
+    def lsh(self):
+        return self.indexes.lsh
+
+    @property
+    def minhashes(self):
+        return self.indexes.minhashes
+
+    @property
+    def vector_db(self):
+        return self.indexes.vector_db
+
+    @classmethod
+    def index_cache_stats(cls) -> Dict[str, Any]:
+        """Returns the hit/miss/eviction/load-time counters of the per-process index cache."""
+        return cls._index_cache.stats()
+
+    @classmethod
+    def index_server_stats(cls) -> Dict[str, Any]:
+        """Returns the per-request latency statistics of the index server client, if one is configured."""
+        return cls._index_client.stats() if cls._index_client else {}
+
     def set_lsh(self) -> str:
-        """Sets the LSH and minhashes attributes by loading from pickle files."""
-        with self._lock:
-            if self.lsh is None:
-                try:
-                    start_time = time.time()
-                    with (self.db_directory_path / "preprocessed" / f"{self.db_id}_lsh.pkl").open("rb") as file:
-                        self.lsh = pickle.load(file)
-                    after_lsh_time = time.time()
-                    with (self.db_directory_path / "preprocessed" / f"{self.db_id}_minhashes.pkl").open("rb") as file:
-                        self.minhashes = pickle.load(file)
-                    return "success"
-                except Exception as e:
-                    self.lsh = "error"
-                    self.minhashes = "error"
-                    print(f"Error loading LSH for {self.db_id}: {e}")
-                    return "error"
-            elif self.lsh == "error":
+        """Sets the LSH and minhashes attributes by loading from the preprocessed files, or from the index cache."""
+        lsh_path = self.db_directory_path / "preprocessed" / f"{self.db_id}_lsh.pkl"
+        minhashes_path = self.db_directory_path / "preprocessed" / f"{self.db_id}_minhashes"
+        if not minhashes_path.exists():
+            minhashes_path = self.db_directory_path / "preprocessed" / f"{self.db_id}_minhashes.pkl"
+
+        def load_lsh():
+            try:
+                with lsh_path.open("rb") as file:
+                    lsh = pickle.load(file)
+                self.indexes.minhashes = load_db_minhashes(str(self.db_directory_path))
+                return lsh
+            except Exception as e:
+                self.indexes.minhashes = "error"
+                print(f"Error loading LSH for {self.db_id}: {e}")
                 return "error"
-            else:
-                return "success"
+
+        with self._lock:
+            size_bytes = path_size(lsh_path) + path_size(minhashes_path) if self.indexes.lsh is None else 0
+            lsh = self._index_cache.load(self.db_id, "lsh", load_lsh, size_bytes)
+        return "error" if lsh == "error" else "success"
 
     def set_vector_db(self) -> str:
-        """Sets the vector_db attribute by loading from the context vector database."""
-        if self.vector_db is None:
+        """Sets the vector_db attribute by loading from the context vector database, or from the index cache."""
+        vector_db_path = self.db_directory_path / "context_vector_db"
+
+        def load_vector_db():
             try:
-                vector_db_path = self.db_directory_path / "context_vector_db"
-                self.vector_db = Chroma(persist_directory=str(vector_db_path), embedding_function=EMBEDDING_FUNCTION)
-                return "success"
+                return Chroma(persist_directory=str(vector_db_path), embedding_function=EMBEDDING_FUNCTION)
             except Exception as e:
-                self.vector_db = "error"
                 print(f"Error loading Vector DB for {self.db_id}: {e}")
                 return "error"
-        elif self.vector_db == "error":
-            return "error"
-        else:
-            return "success"
+
+        size_bytes = path_size(vector_db_path) if self.indexes.vector_db is None else 0
+        vector_db = self._index_cache.load(self.db_id, "vector_db", load_vector_db, size_bytes)
+        return "error" if vector_db == "error" else "success"
+
+    def _query_index_server(self, request: Dict[str, Any]) -> Any:
+        """
+        Sends a batched request to the shared index server.
+
+        Args:
+            request (Dict[str, Any]): The request, without the database fields.
+
+        Returns:
+            Any: One result per keyword, or None if no index server is reachable.
+        """
+        if self._index_client is None:
+            return None
+        return self._index_client.request({"db_directory_path": str(self.db_directory_path), "db_id": self.db_id, **request})
 
     def query_lsh(self, keyword: str, signature_size: int = 100, n_gram: int = 3, top_n: int = 10) -> Dict[str, List[str]]:
         """
@@ -117,27 +155,30 @@ class DatabaseManager:
         Returns:
             Dict[str, List[str]]: The dictionary of similar values.
         """
-        
-        # try:
-        #     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        #         s.connect((INDEX_SERVER_HOST, INDEX_SERVER_PORT))
-        #         s.sendall(pickle.dumps({
-        #             "db_directory_path": str(self.db_directory_path),
-        #             "db_id": self.db_id,
-        #             "type": "query_lsh",
-        #             "keyword": keyword
-        #         }))
-        #         return receive_data_in_chunks(s)
-        # except ConnectionRefusedError:
-        #     print(f"Connection refused for {self.db_id}")
+        return self.query_lsh_batch([keyword], signature_size, n_gram, top_n)[0]
+
+    def query_lsh_batch(self, keywords: List[str], signature_size: int = 100, n_gram: int = 3, top_n: int = 10) -> List[Dict[str, List[str]]]:
+        """
+        Queries the LSH for similar values to each of the given keywords, through the index server when available.
+
+        Args:
+            keywords (List[str]): The keywords to search for.
+            signature_size (int, optional): The size of the MinHash signature. Defaults to 100.
+            n_gram (int, optional): The n-gram size for the MinHash. Defaults to 3.
+            top_n (int, optional): The number of top results to return per keyword. Defaults to 10.
+
+        Returns:
+            List[Dict[str, List[str]]]: The dictionary of similar values for each keyword.
+        """
+        results = self._query_index_server({"type": "query_lsh", "keywords": keywords, "signature_size": signature_size,
+                                            "n_gram": n_gram, "top_n": top_n})
+        if results is not None:
+            return results
         lsh_status = self.set_lsh()
         if lsh_status == "success":
-            return query_lsh(self.lsh, self.minhashes, keyword, signature_size, n_gram, top_n)
+            return query_lsh_batch(self.lsh, self.minhashes, keywords, signature_size, n_gram, top_n)
         else:
             raise Exception(f"Error loading LSH for {self.db_id}")
-        # except Exception as e:
-        #     print(f"Error querying LSH for {self.db_id}: {e}")
-        #     raise Exception(f"Error querying LSH for {self.db_id}: {e}")
 
     def query_vector_db(self, keyword: str, top_k: int) -> Dict[str, Any]:
         """
@@ -150,26 +191,27 @@ class DatabaseManager:
         Returns:
             Dict[str, Any]: The dictionary of similar values.
         """
-        
-        # try:
-        #     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        #         s.connect((INDEX_SERVER_HOST, INDEX_SERVER_PORT))
-        #         s.sendall(pickle.dumps({
-        #             "db_directory_path": str(self.db_directory_path),
-        #             "db_id": self.db_id,
-        #             "type": "query_vector_db",
-        #             "keyword": keyword,
-        #             "top_k": top_k
-        #         }))
-        #         return receive_data_in_chunks(s)
-        # except ConnectionRefusedError:
+        return self.query_vector_db_batch([keyword], top_k)[0]
+
+    def query_vector_db_batch(self, keywords: List[str], top_k: int) -> List[Dict[str, Any]]:
+        """
+        Queries the vector database for each of the given keywords, through the index server when available.
+
+        Args:
+            keywords (List[str]): The keywords to search for.
+            top_k (int): The number of top results to return per keyword.
+
+        Returns:
+            List[Dict[str, Any]]: The dictionary of similar values for each keyword.
+        """
+        results = self._query_index_server({"type": "query_vector_db", "keywords": keywords, "top_k": top_k})
+        if results is not None:
+            return results
         vector_db_status = self.set_vector_db()
         if vector_db_status == "success":
-            return query_vector_db(self.vector_db, keyword, top_k)
+            return [query_vector_db(self.vector_db, keyword, top_k) for keyword in keywords]
         else:
             raise Exception(f"Error loading Vector DB for {self.db_id}")
-        # except Exception as e:
-        #     raise Exception(f"Error querying Vector DB for {self.db_id}: {e}")
 
     def get_column_profiles(self, schema_with_examples: Dict[str, Dict[str, List[str]]],
                             use_value_description: bool, with_keys: bool, 
@@ -308,19 +350,3 @@ functions_to_add = [
 
 # Adding methods to the class
 DatabaseManager.add_methods_to_class(functions_to_add)
-
-# Auxiliary function for interacting with the index server
-def receive_data_in_chunks(conn, chunk_size=1024):
-            length_bytes = conn.recv(4)
-            if not length_bytes:
-                return None
-            data_length = int.from_bytes(length_bytes, byteorder='big')
-            chunks = []
-            bytes_received = 0
-            while bytes_received < data_length:
-                chunk = conn.recv(min(data_length - bytes_received, chunk_size))
-                if not chunk:
-                    raise ConnectionError("Connection lost")
-                chunks.append(chunk)
-                bytes_received += len(chunk)
-            return pickle.loads(b''.join(chunks))
\ No newline at end of file
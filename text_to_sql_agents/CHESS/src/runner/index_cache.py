@@ -0,0 +1,135 @@
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from database_utils.schema_generator import DatabaseSchemaGenerator
+
+@dataclass
+class DatabaseIndexes:
+    """
+    The indexes loaded for one database.
+
+    Attributes:
+        lsh (Any): The LSH index, or "error" if it failed to load.
+        minhashes (Any): The minhashes of the LSH values, or "error" if they failed to load.
+        vector_db (Any): The Chroma vector store, or "error" if it failed to load.
+        size_bytes (int): The estimated memory footprint, taken from the on-disk index sizes.
+    """
+    lsh: Any = None
+    minhashes: Any = None
+    vector_db: Any = None
+    size_bytes: int = 0
+
+class IndexCache:
+    """
+    A per-process LRU cache of database indexes keyed by db_id.
+
+    Entries are evicted least recently used first once the total estimated size passes
+    max_bytes or more than max_databases are cached. The most recently used database is never
+    evicted. Evicting a database also drops its entry in DatabaseSchemaGenerator.CACHED_DB_SCHEMA.
+    """
+
+    def __init__(self, max_bytes: int, max_databases: int):
+        self.max_bytes = max_bytes
+        self.max_databases = max_databases
+        self._entries: "OrderedDict[str, DatabaseIndexes]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    def get(self, db_id: str) -> DatabaseIndexes:
+        """
+        Returns the indexes entry of a database, creating an empty one if needed, and marks it as most recently used.
+
+        Args:
+            db_id (str): The database identifier.
+
+        Returns:
+            DatabaseIndexes: The cached indexes of the database.
+        """
+        with self._lock:
+            entry = self._entries.get(db_id)
+            if entry is None:
+                entry = self._entries[db_id] = DatabaseIndexes()
+            self._entries.move_to_end(db_id)
+            return entry
+
+    def load(self, db_id: str, attribute: str, loader: Callable[[], Any], size_bytes: int = 0) -> Any:
+        """
+        Returns a cached index of a database, calling loader to load it on a miss.
+
+        Args:
+            db_id (str): The database identifier.
+            attribute (str): The DatabaseIndexes attribute to load.
+            loader (Callable[[], Any]): Loads the index; may raise.
+            size_bytes (int): The estimated memory footprint of the loaded index.
+
+        Returns:
+            Any: The loaded index.
+        """
+        entry = self.get(db_id)
+        value = getattr(entry, attribute)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        start_time = time.time()
+        try:
+            value = loader()
+        finally:
+            self.load_time += time.time() - start_time
+        setattr(entry, attribute, value)
+        with self._lock:
+            entry.size_bytes += size_bytes
+            self._evict()
+        return value
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_databases
+            or sum(entry.size_bytes for entry in self._entries.values()) > self.max_bytes
+        ):
+            db_id, _ = self._entries.popitem(last=False)
+            DatabaseSchemaGenerator.CACHED_DB_SCHEMA.pop(db_id, None)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, Any]: Hits, misses, evictions, total load time in seconds, cached databases and their total size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_time": self.load_time,
+                "cached_databases": list(self._entries.keys()),
+                "size_bytes": sum(entry.size_bytes for entry in self._entries.values()),
+            }
+
+def path_size(path: Path) -> int:
+    """
+    Returns the size of a file, or the total size of the files under a directory.
+
+    Args:
+        path (Path): The file or directory path.
+
+    Returns:
+        int: The size in bytes, 0 if the path does not exist.
+    """
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
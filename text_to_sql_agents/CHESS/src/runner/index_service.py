@@ -0,0 +1,246 @@
+import os
+import time
+import socket
+import ipaddress
+import pickle
+import struct
+import logging
+import socketserver
+from threading import Lock
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Wire format: every message is a 4-byte big-endian payload length followed by a pickled payload.
+# Requests are dicts with a "type" ("query_lsh" or "query_vector_db"), the database directory and a
+# batch of keywords; responses carry one result per keyword and the server-side time.
+# Unpickling runs arbitrary code, so the server only listens on unix sockets and loopback addresses
+# (see parse_address): only local processes can reach it.
+HEADER = struct.Struct("!I")
+
+def send_message(sock: socket.socket, message: Any) -> None:
+    """
+    Sends a length-prefixed pickled message.
+
+    Args:
+        sock (socket.socket): The connected socket.
+        message (Any): The message to send.
+    """
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+def _receive_exactly(sock: socket.socket, length: int) -> Optional[bytes]:
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(min(length - len(data), 1 << 20))
+        if not chunk:
+            if not data:
+                return None
+            raise ConnectionError("Connection lost")
+        data.extend(chunk)
+    return bytes(data)
+
+def receive_message(sock: socket.socket) -> Any:
+    """
+    Receives a length-prefixed pickled message.
+
+    Args:
+        sock (socket.socket): The connected socket.
+
+    Returns:
+        Any: The message, or None if the peer closed the connection.
+    """
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    payload = _receive_exactly(sock, HEADER.unpack(header)[0])
+    if payload is None:
+        raise ConnectionError("Connection lost")
+    return pickle.loads(payload)
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """
+    Parses an index server address.
+
+    Args:
+        address (str): Either "unix:<socket path>" or "<host>:<port>" with a loopback host (localhost, 127.0.0.1, [::1]).
+
+    Returns:
+        Tuple[int, Any]: The socket family and the address in the form socket.connect expects.
+
+    Raises:
+        ValueError: If the host is not a loopback address.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    host = host.strip("[]")
+    if host == "localhost":
+        host = "127.0.0.1"
+    try:
+        is_loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        is_loopback = False
+    if not is_loopback:
+        raise ValueError(f"Index server address {address} is not a unix socket or a loopback address")
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, (host, int(port))
+
+class IndexClient:
+    """
+    Client of the shared index server, holding one persistent connection per process.
+
+    If the server cannot be reached the client marks itself unavailable and callers fall back
+    to loading the indexes in-process.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.family, self.socket_address = parse_address(address)
+        self.available = True
+        self._sock = None
+        self._pid = None
+        self._lock = Lock()
+        self.requests = 0
+        self.total_latency = 0.0
+        self.total_server_time = 0.0
+        self.max_latency = 0.0
+
+    def _connect(self) -> socket.socket:
+        # a connection inherited from the parent of a forked pool worker must not be shared
+        if self._sock is None or self._pid != os.getpid():
+            self._sock = socket.socket(self.family, socket.SOCK_STREAM)
+            self._sock.connect(self.socket_address)
+            self._pid = os.getpid()
+        return self._sock
+
+    def request(self, request: Dict[str, Any]) -> Optional[List[Any]]:
+        """
+        Sends a batched request to the index server.
+
+        Args:
+            request (Dict[str, Any]): The request.
+
+        Returns:
+            Optional[List[Any]]: One result per keyword, or None if the server is unavailable.
+
+        Raises:
+            Exception: If the server failed to answer the request.
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            start_time = time.perf_counter()
+            try:
+                sock = self._connect()
+                send_message(sock, request)
+                response = receive_message(sock)
+                if response is None:
+                    raise ConnectionError("Index server closed the connection")
+            except OSError as e:
+                logging.warning(f"Index server at {self.address} unavailable, loading indexes in-process: {e}")
+                self.available = False
+                self._sock = None
+                return None
+            latency = time.perf_counter() - start_time
+            self.requests += 1
+            self.total_latency += latency
+            self.total_server_time += response.get("server_time", 0.0)
+            self.max_latency = max(self.max_latency, latency)
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["results"]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the per-request latency statistics of this client.
+
+        Returns:
+            Dict[str, Any]: Request count, mean and max round-trip latency and mean server time in seconds.
+        """
+        return {
+            "available": self.available,
+            "requests": self.requests,
+            "mean_latency": self.total_latency / self.requests if self.requests else 0.0,
+            "max_latency": self.max_latency,
+            "mean_server_time": self.total_server_time / self.requests if self.requests else 0.0,
+        }
+
+class IndexServer:
+    """
+    Serves LSH and vector database queries for all databases from one process,
+    loading the indexes of each database once.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.indexes: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        self.locks: Dict[str, Lock] = defaultdict(Lock)
+
+    def _get_index(self, db_directory_path: str, kind: str) -> Any:
+        with self.locks[db_directory_path]:
+            indexes = self.indexes[db_directory_path]
+            if kind not in indexes:
+                start_time = time.time()
+                if kind == "lsh":
+                    from database_utils.db_values.search import load_db_lsh
+                    indexes[kind] = load_db_lsh(db_directory_path)
+                else:
+                    from langchain_chroma import Chroma
+                    from database_utils.db_catalog.preprocess import EMBEDDING_FUNCTION
+                    indexes[kind] = Chroma(persist_directory=os.path.join(db_directory_path, "context_vector_db"),
+                                           embedding_function=EMBEDDING_FUNCTION)
+                logging.info(f"Loaded {kind} for {db_directory_path} in {time.time() - start_time:.2f}s")
+            return indexes[kind]
+
+    def handle(self, request: Dict[str, Any]) -> List[Any]:
+        """
+        Answers a batched request.
+
+        Args:
+            request (Dict[str, Any]): The request.
+
+        Returns:
+            List[Any]: One result per keyword.
+        """
+        if request["type"] == "query_lsh":
+            from database_utils.db_values.search import query_lsh_batch
+            lsh, minhashes = self._get_index(request["db_directory_path"], "lsh")
+            return query_lsh_batch(lsh, minhashes, request["keywords"], request["signature_size"], request["n_gram"], request["top_n"])
+        if request["type"] == "query_vector_db":
+            from database_utils.db_catalog.search import query_vector_db
+            vector_db = self._get_index(request["db_directory_path"], "vector_db")
+            return [query_vector_db(vector_db, keyword, request["top_k"]) for keyword in request["keywords"]]
+        raise ValueError(f"Unknown request type: {request['type']}")
+
+    def serve_forever(self):
+        """Serves requests until interrupted, one thread per client connection."""
+        index_server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    request = receive_message(self.request)
+                    if request is None:
+                        return
+                    start_time = time.perf_counter()
+                    try:
+                        response = {"results": index_server.handle(request)}
+                    except Exception as e:
+                        response = {"error": f"{type(e).__name__}: {e}"}
+                    response["server_time"] = time.perf_counter() - start_time
+                    send_message(self.request, response)
+
+        family, socket_address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(socket_address):
+                os.remove(socket_address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = type("ThreadingTCPServer", (socketserver.ThreadingTCPServer,), {"address_family": family})
+        server_class.daemon_threads = True
+        with server_class(socket_address, Handler) as server:
+            if family == socket.AF_UNIX:
+                # only the user running the pipeline may connect
+                os.chmod(socket_address, 0o600)
+            logging.info(f"Index server listening on {self.address}")
+            server.serve_forever()
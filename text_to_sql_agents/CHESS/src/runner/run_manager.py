@@ -10,12 +10,15 @@ from runner.task import Task
 from runner.database_manager import DatabaseManager
 from runner.statistics_manager import StatisticsManager
 from workflow.team_builder import build_team
-from database_utils.execution import ExecutionStatus
+from llm.scheduler import get_llm_scheduler, set_llm_scheduler
+from llm.response_cache import get_llm_response_cache
+from database_utils.execution import ExecutionStatus, get_execution_stats, execution_cache_scope
 from workflow.system_state import SystemState
-import fcntl
 
 class RunManager:
     RESULT_ROOT_PATH = "results"
+    PREDICTIONS_FILE = "-predictions.json"
+    PREDICTIONS_LOG_FILE = "-predictions.jsonl"
 
     def __init__(self, args: Any):
         self.args = args
@@ -24,6 +27,7 @@ class RunManager:
         self.tasks: List[Task] = []
         self.total_number_of_tasks = 0
         self.processed_tasks = 0
+        self.final_predictions: Dict[str, Any] = {}
 
     def get_result_directory(self) -> str:
         """
@@ -44,9 +48,10 @@ class RunManager:
         with arg_file_path.open('w') as file:
             json.dump(vars(self.args), file, indent=4)
 
-        final_prediction_file = run_folder_path / "-predictions.json"
-        with final_prediction_file.open('w') as file:
-            json.dump({}, file, indent=4)
+        final_prediction_file = run_folder_path / self.PREDICTIONS_FILE
+        if not final_prediction_file.exists():
+            with final_prediction_file.open('w') as file:
+                json.dump({}, file, indent=4)
         
         log_folder_path = run_folder_path / "logs"
         log_folder_path.mkdir(exist_ok=True)
@@ -54,44 +59,82 @@ class RunManager:
         return str(run_folder_path)
     
     def update_final_predictions(self, question_id: int, final_sql: str = None, db_id: int = None):
-        results = {}
+        """
+        Records the final prediction of a finished task by appending one line to the predictions log.
+        
+        Args:
+            question_id (int): The question ID of the task.
+            final_sql (str, optional): The predicted SQL. Defaults to None, which records 0.
+            db_id (int, optional): The database ID of the task.
+        """
         if final_sql:
-            temp_results = {str(question_id): final_sql.strip() + "\t----- bird -----\t" + db_id}
+            prediction = final_sql.strip() + "\t----- bird -----\t" + db_id
         else:
-            temp_results = {str(question_id): 0}
-        file_path = os.path.join(self.result_directory, "-predictions.json")
-        with open(file_path, 'r+') as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            try:
-                results = json.load(f)
-                results.update(temp_results)
-                f.seek(0)
-                json.dump(results, f, indent=4)
-                f.truncate()
-            finally:
-                fcntl.flock(f, fcntl.LOCK_UN)
+            prediction = 0
+        self.final_predictions[str(question_id)] = prediction
+        log_path = os.path.join(self.result_directory, self.PREDICTIONS_LOG_FILE)
+        with open(log_path, 'a') as f:
+            f.write(json.dumps({"question_id": str(question_id), "prediction": prediction}) + "\n")
+
+    def load_prediction_log(self) -> Dict[str, Any]:
+        """
+        Replays the predictions log of this run directory, ignoring a partially written last line.
+        
+        Returns:
+            Dict[str, Any]: The prediction of every task finished so far, keyed by question ID.
+        """
+        predictions = {}
+        log_path = os.path.join(self.result_directory, self.PREDICTIONS_LOG_FILE)
+        if not os.path.exists(log_path):
+            return predictions
+        with open(log_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                predictions[record["question_id"]] = record["prediction"]
+        return predictions
+
+    def compact_predictions(self):
+        """Writes the final predictions JSON from the in-memory predictions in a single atomic write."""
+        file_path = os.path.join(self.result_directory, self.PREDICTIONS_FILE)
+        temp_path = file_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.final_predictions, f, indent=4)
+        os.replace(temp_path, file_path)
 
     def initialize_tasks(self, dataset: List[Dict[str, Any]]):
         """
         Initializes tasks from the provided dataset.
+        Tasks already recorded in the predictions log of a resumed run are skipped.
         
         Args:
             dataset (List[Dict[str, Any]]): The dataset containing task information.
         """
+        finished = self.load_prediction_log()
         for i, data in enumerate(dataset):
             if "question_id" not in data:
                 data = {"question_id": i, **data}
-            self.update_final_predictions(data["question_id"])
+            question_id = str(data["question_id"])
+            self.final_predictions[question_id] = finished.get(question_id, 0)
+            if question_id in finished:
+                continue
             task = Task(**data)
             self.tasks.append(task)
+        self.compact_predictions()
         self.total_number_of_tasks = len(self.tasks)
+        if finished:
+            print(f"Resuming run: {len(finished)} tasks already finished.")
         print(f"Total number of tasks: {self.total_number_of_tasks}")
 
     def run_tasks(self):
         """Runs the tasks using a pool of workers."""
         print(f"Running tasks with {self.args.num_workers} workers.")
-        if self.args.num_workers > 1:
-            with Pool(self.args.num_workers) as pool:
+        if self.args.num_workers > 1 and getattr(self.args, "group_by_db", False):
+            self.run_tasks_grouped_by_db()
+        elif self.args.num_workers > 1:
+            with Pool(self.args.num_workers, initializer=set_llm_scheduler, initargs=(get_llm_scheduler(),)) as pool:
                 for task in self.tasks:
                     pool.apply_async(self.worker, args=(task,), callback=self.task_done)
                 pool.close()
@@ -100,6 +143,34 @@ class RunManager:
             for task in self.tasks:
                 log = self.worker(task)
                 self.task_done(log)
+        self.compact_predictions()
+
+    def run_tasks_grouped_by_db(self):
+        """
+        Runs the tasks with tasks of the same database handed to a worker in consecutive chunks,
+        so that each worker only keeps the indexes of a few databases loaded.
+        """
+        tasks = sorted(self.tasks, key=lambda task: task.db_id)
+        chunk_size = max(1, len(tasks) // (self.args.num_workers * 4))
+        with Pool(self.args.num_workers, initializer=set_llm_scheduler, initargs=(get_llm_scheduler(),)) as pool:
+            for log in pool.imap_unordered(self.safe_worker, tasks, chunksize=chunk_size):
+                self.task_done(log)
+
+    def safe_worker(self, task: Task) -> Tuple[Any, str, int]:
+        """
+        Runs worker and reports a failed task with an empty state instead of raising.
+        
+        Args:
+            task (Task): The task to be processed.
+        
+        Returns:
+            tuple: The state of the task processing (None on failure) and task identifiers.
+        """
+        try:
+            return self.worker(task)
+        except Exception as e:
+            print(f"Error in task {task.db_id} {task.question_id}: {e}")
+            return None, task.db_id, task.question_id
 
     def worker(self, task: Task) -> Tuple[Any, str, int]:
         """
@@ -124,10 +195,18 @@ class RunManager:
                                     tentative_schema=DatabaseManager().get_db_schema(), 
                                     execution_history=[])
         thread_config["recursion_limit"] = 50
-        for state_dict in team.stream(state_values, thread_config, stream_mode="values"):
-            logger.log("________________________________________________________________________________________")
-            continue
-        system_state = SystemState(**state_dict)
+        with execution_cache_scope() as execution_cache:
+            for state_dict in team.stream(state_values, thread_config, stream_mode="values"):
+                logger.log("________________________________________________________________________________________")
+                continue
+            system_state = SystemState(**state_dict)
+        logger.log(f"Execution cache: {execution_cache.stats()}", "info")
+        logger.log(f"LLM scheduler: {get_llm_scheduler().stats(reset=True)}", "info")
+        if get_llm_response_cache() is not None:
+            logger.log(f"LLM response cache: {get_llm_response_cache().stats(reset=True)}", "info")
+        logger.log(f"Index cache: {DatabaseManager.index_cache_stats()}", "info")
+        logger.log(f"Index server: {DatabaseManager.index_server_stats()}", "info")
+        logger.log(f"SQL execution: {get_execution_stats()}", "info")
         return system_state, task.db_id, task.question_id
 
     def pick_final_sql(self, state: SystemState):
@@ -200,6 +279,7 @@ class RunManager:
         state, db_id, question_id = log
         if state is None:
             return
+        final_sql = None
         for step in state.execution_history:
             if "tool_name" in step and step["tool_name"] == "evaluation":
                 validation_result = step
@@ -210,7 +290,8 @@ class RunManager:
                         self.statistics_manager.update_stats(db_id, question_id, validation_for, result)
             if "final_SQL" in step:
                 self.statistics_manager.update_stats(db_id, question_id, "final_SQL", step["final_SQL"])
-                self.update_final_predictions(question_id, step["final_SQL"]["PREDICTED_SQL"], db_id)
+                final_sql = step["final_SQL"]["PREDICTED_SQL"]
+        self.update_final_predictions(question_id, final_sql, db_id)
         self.statistics_manager.dump_statistics_to_file()
         self.processed_tasks += 1
         self.plot_progress()
@@ -1,7 +1,10 @@
+import os
 import queue
 from concurrent.futures import ThreadPoolExecutor
 import logging
 
+MAX_THREADS = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+
 def _threaded(func):
     """
     A function that adds threading capabilities to a function.
@@ -25,7 +28,7 @@ def _threaded(func):
 
 def ordered_concurrent_function_calls(call_list: list) -> list:
     """
-    Executes multiple functions concurrently using a thread pool, and returns the results in the order of the input list.
+    Executes multiple functions concurrently using a thread pool of at most MAX_THREADS threads, and returns the results in the order of the input list.
 
     Args:
         call_list (list): A list of dictionaries, each containing:
@@ -36,7 +39,7 @@ def ordered_concurrent_function_calls(call_list: list) -> list:
         list: A list of results from the functions.
     """
     result_queue = queue.Queue()
-    with ThreadPoolExecutor(max_workers=len(call_list)) as executor:
+    with ThreadPoolExecutor(max_workers=max(1, min(len(call_list), MAX_THREADS))) as executor:
         for idx, call in enumerate(call_list):
             func = _threaded(call['function'])
             kwargs = call['kwargs']
@@ -251,10 +251,11 @@ class RetrieveEntity(Tool):
     
     def _get_similar_entities_via_LSH(self, substring_packets: List[Dict[str, str]]) -> List[Dict[str, Any]]:
         similar_entities_via_LSH = []
-        for packet in substring_packets:
+        substrings = [packet["substring"] for packet in substring_packets]
+        similar_values_per_substring = DatabaseManager().query_lsh_batch(keywords=substrings, signature_size=100, top_n=10)
+        for packet, unique_similar_values in zip(substring_packets, similar_values_per_substring):
             keyword = packet["keyword"]
             substring = packet["substring"]
-            unique_similar_values = DatabaseManager().query_lsh(keyword=substring, signature_size=100, top_n=10)
             for table_name, column_values in unique_similar_values.items():
                 for column_name, values in column_values.items():
                     for value in values:
@@ -27,7 +27,7 @@ class SQLMetaInfo(BaseModel):
         if self._execution_result == []:
             try:    
                 result = DatabaseManager().execute_sql(self.SQL, "all")
-            except FunctionTimedOut:
+            except (FunctionTimedOut, TimeoutError):
                 print("Timeout in execution_result")
                 result = []
             self._execution_result = result
@@ -62,7 +62,7 @@ class SQLMetaInfo(BaseModel):
     def _retrieve_lazy_result(self) -> List[Any]:
         try:    
             result = DatabaseManager().execute_sql(self.SQL, "all")
-        except FunctionTimedOut:
+        except (FunctionTimedOut, TimeoutError):
             print("Timeout in execution_result")
             result = []
         return result
@@ -6,9 +6,19 @@ import os
 from tqdm import tqdm
 import multiprocessing as mp
 import random
+import time
+import re
+import pickle
+import hashlib
+from collections import Counter, defaultdict
 
 random.seed(42)
 
+# each pool worker keeps one read-only connection per database it has seen
+worker_connections = {}
+# and its own handle on the gold-result store, opened on first use
+worker_gold_store = None
+
 execution_results = None
 evaluation_results = None
 
@@ -18,6 +28,13 @@ def parse_option():
     parser.add_argument('--gold', type = str, default = "./bird/dev/dev.json")
     parser.add_argument('--db_path', type = str, default = "./bird/dev/dev_databases")
     parser.add_argument('--mode', type = str, default = "greedy_search")
+    parser.add_argument('--num_cpus', type = int, default = 1)
+    parser.add_argument('--timeout', type = float, default = 100)
+    parser.add_argument('--checkpoint', type = str, default = "results.txt")
+    parser.add_argument('--resume', action = 'store_true')
+    parser.add_argument('--gold_cache', type = str, default = None)
+    parser.add_argument('--max_rows', type = int, default = 1000000)
+    parser.add_argument('--max_bytes', type = int, default = 1 << 30)
 
     opt = parser.parse_args()
 
@@ -39,35 +56,171 @@ def execute_sql(data_idx, db_file, sql):
         conn.close()
         return data_idx, db_file, sql, None, 0
 
-def compare_sql(question_id, db_file, question, ground_truth, pred_sql) :
-    conn = sqlite3.connect(db_file)
+# string literals and quoted identifiers are matched whole, so whitespace inside them is kept
+SQL_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|\s+")
+
+def normalize_sql(sql):
+    '''Collapse whitespace runs outside quoted literals and identifiers, and drop trailing semicolons'''
+    sql = SQL_TOKEN_PATTERN.sub(lambda match: ' ' if match.group(0).isspace() else match.group(0), sql)
+    return sql.strip().rstrip(';').strip()
+
+class GoldResultStore:
+    '''
+    On-disk cache of ground-truth results keyed by (db file content hash, normalized gold SQL).
+    A corrected gold SQL or a modified database file maps to a new key, so stale entries are never read.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS gold_results (db_hash TEXT, sql TEXT, rows BLOB, PRIMARY KEY (db_hash, sql))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS db_hashes (db_file TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, db_hash TEXT)")
+        self.conn.commit()
+        self.db_hashes = {}
+
+    def db_hash(self, db_file):
+        '''Content hash of db_file, rehashed only when its size or mtime changes'''
+        db_file = os.path.abspath(db_file)
+        stat = os.stat(db_file)
+        cached = self.db_hashes.get(db_file)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        row = self.conn.execute("SELECT size, mtime_ns, db_hash FROM db_hashes WHERE db_file = ?", (db_file,)).fetchone()
+        if row and tuple(row[:2]) == (stat.st_size, stat.st_mtime_ns):
+            digest = row[2]
+        else:
+            h = hashlib.sha256()
+            with open(db_file, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            digest = h.hexdigest()
+            self.conn.execute("INSERT OR REPLACE INTO db_hashes VALUES (?, ?, ?, ?)", (db_file, stat.st_size, stat.st_mtime_ns, digest))
+            self.conn.commit()
+        self.db_hashes[db_file] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def get(self, db_file, sql):
+        '''Return the cached result multiset expanded to a list of rows, or None'''
+        row = self.conn.execute("SELECT rows FROM gold_results WHERE db_hash = ? AND sql = ?",
+                                (self.db_hash(db_file), normalize_sql(sql))).fetchone()
+        if row is None:
+            return None
+        return list(Counter(dict(pickle.loads(row[0]))).elements())
+
+    def put(self, db_file, sql, rows):
+        multiset = sorted(Counter(rows).items(), key=repr)
+        self.conn.execute("INSERT OR REPLACE INTO gold_results VALUES (?, ?, ?)",
+                          (self.db_hash(db_file), normalize_sql(sql), pickle.dumps(multiset)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class ResultLimitExceeded(Exception):
+    pass
+
+def row_digest(row):
+    '''Hash a row so that rows equal as Python tuples (e.g. 1 and 1.0) share a digest'''
+    row = tuple(int(v) if isinstance(v, float) and v.is_integer() else v for v in row)
+    data = repr(row).encode()
+    return hashlib.blake2b(data, digest_size=16).digest(), len(data)
+
+def iter_rows(cursor, batch_size=1000):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_digests(rows, max_rows, max_bytes):
+    '''Yield row digests, raising ResultLimitExceeded once the row or byte cap is passed'''
+    n_bytes = 0
+    for n_rows, row in enumerate(rows, 1):
+        if n_rows > max_rows:
+            raise ResultLimitExceeded(f'result has more than {max_rows} rows')
+        digest, size = row_digest(row)
+        n_bytes += size
+        if n_bytes > max_bytes:
+            raise ResultLimitExceeded(f'result is larger than {max_bytes} bytes')
+        yield digest
+
+def stream_matches(pred_rows, gold_digests, max_rows, max_bytes):
+    '''
+    Same verdict as set(pred_rows) == set(gold_rows) without materializing the prediction:
+    stops at the first predicted row that is not in the gold result.
+    '''
+    seen = set()
+    for digest in iter_digests(pred_rows, max_rows, max_bytes):
+        if digest not in gold_digests:
+            return False
+        seen.add(digest)
+    return len(seen) == len(gold_digests)
+
+def connect_read_only(db_file):
+    return sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+
+def set_deadline(conn, timeout):
+    '''Abort the running statement on conn once timeout seconds have passed'''
+    if timeout is None:
+        conn.set_progress_handler(None, 0)
+        return
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+
+def compare_sql(question_id, db_file, question, ground_truth, pred_sql, conn=None, timeout=None, gold_store=None,
+                max_rows=1000000, max_bytes=1 << 30):
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
     correctness = 0
 
     try:
         conn.execute("BEGIN TRANSACTION;")
+        ground_truth_res = gold_store.get(db_file, ground_truth) if gold_store else None
+        if ground_truth_res is None:
+            set_deadline(conn, timeout)
+            cursor.execute(ground_truth)
+            if gold_store:
+                ground_truth_res = []
+                gold_digests = set(iter_digests(
+                    (ground_truth_res.append(row) or row for row in iter_rows(cursor)), max_rows, max_bytes))
+                gold_store.put(db_file, ground_truth, ground_truth_res)
+            else:
+                gold_digests = set(iter_digests(iter_rows(cursor), max_rows, max_bytes))
+        else:
+            gold_digests = set(iter_digests(ground_truth_res, max_rows, max_bytes))
+        set_deadline(conn, timeout)
         cursor.execute(pred_sql)
-        predicted_res = cursor.fetchall()
-        cursor.execute(ground_truth)
-        ground_truth_res = cursor.fetchall()
+        matches = stream_matches(iter_rows(cursor), gold_digests, max_rows, max_bytes)
         print(f'[{question_id}] Successfully executed')
-        if set(predicted_res) == set(ground_truth_res):
+        if matches:
             correctness = 1
         else:
-            print(f'predicted {len(predicted_res)}, ground_truth {len(ground_truth_res)}')
-            print("predicted_res:", predicted_res)
-            print("ground_truth_res:", ground_truth_res)
+            print(f'[{question_id}] predicted result differs from ground truth ({len(gold_digests)} distinct gold rows)')
+        conn.rollback()
+    except ResultLimitExceeded as e:
+        print(f'[{question_id}] Stopped comparison: {e}')
+        conn.rollback()
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            print(f'[{question_id}] Timed out after {timeout}s')
         conn.rollback()
     except:
         conn.rollback()
     finally:
-        conn.close()
+        set_deadline(conn, None)
+        cursor.close()
+        if own_conn:
+            conn.close()
     return question_id, db_file, question, ground_truth, pred_sql, correctness
 
-def run_evaluation(question_id, db_file, question, ground_truth, pred_sql):
+def run_evaluation(question_id, db_file, question, ground_truth, pred_sql, conn=None, timeout=None, gold_store=None,
+                   max_rows=1000000, max_bytes=1 << 30):
     '''Run the evaluation for a single question'''
     try:
-        result = compare_sql(question_id, db_file, question, ground_truth, pred_sql)
+        result = compare_sql(question_id, db_file, question, ground_truth, pred_sql, conn=conn, timeout=timeout,
+                             gold_store=gold_store, max_rows=max_rows, max_bytes=max_bytes)
     except KeyboardInterrupt:
         sys.exit(0)
     except Exception as e:
@@ -75,8 +228,98 @@ def run_evaluation(question_id, db_file, question, ground_truth, pred_sql):
         result = (question_id, db_file, question, ground_truth, pred_sql, 0)
     return result
 
+def evaluate_db_chunk(args):
+    '''Pool worker: evaluate a chunk of questions that all target the same database'''
+    global worker_gold_store
+    db_file, items, timeout, gold_cache, max_rows, max_bytes = args
+    if gold_cache and worker_gold_store is None:
+        worker_gold_store = GoldResultStore(gold_cache)
+    conn = worker_connections.get(db_file)
+    if conn is None:
+        try:
+            conn = worker_connections[db_file] = connect_read_only(db_file)
+        except sqlite3.Error as e:
+            print(db_file, e)
+            return [(question_id, db_file, question, ground_truth, pred_sql, 0)
+                    for question_id, question, ground_truth, pred_sql in items]
+    return [run_evaluation(question_id, db_file, question, ground_truth, pred_sql, conn=conn, timeout=timeout,
+                           gold_store=worker_gold_store, max_rows=max_rows, max_bytes=max_bytes)
+            for question_id, question, ground_truth, pred_sql in items]
+
+CHECKPOINT_HEADER = '# inputs'
+
+def hash_inputs(pred_file, gold_file):
+    '''Content hash of the pred and gold files a checkpoint was written for'''
+    sha256 = hashlib.sha256()
+    for path in (pred_file, gold_file):
+        with open(path, 'rb') as f:
+            sha256.update(hashlib.sha256(f.read()).digest())
+    return sha256.hexdigest()
+
+def start_checkpoint(checkpoint_file, inputs_hash, resume):
+    '''
+    Return finished question_id -> correctness to skip. Without resume the checkpoint is started over;
+    with resume it is only reused if it was written for the same pred and gold files.
+    '''
+    if resume and os.path.exists(checkpoint_file) and os.path.getsize(checkpoint_file) > 0:
+        with open(checkpoint_file) as f:
+            header = f.readline().rstrip('\n').split('\t')
+        if header != [CHECKPOINT_HEADER, inputs_hash]:
+            raise SystemExit(f'{checkpoint_file} was not written for these --pred and --gold files; '
+                             f'remove it or choose another --checkpoint')
+        return load_checkpoint(checkpoint_file)
+    with open(checkpoint_file, 'w') as f:
+        f.write(f'{CHECKPOINT_HEADER}\t{inputs_hash}\n')
+    return {}
+
+def load_checkpoint(checkpoint_file):
+    '''Read finished question_id -> correctness from a results file, ignoring a torn last line'''
+    finished = {}
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return finished
+    with open(checkpoint_file) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) != 2 or parts[1] not in ('0', '1') or not line.endswith('\n'):
+                continue
+            finished[parts[0]] = int(parts[1])
+    return finished
+
+def write_checkpoint(f, results):
+    for result in results:
+        f.write(f'{result[0]}\t{result[5]}\n')
+    f.flush()
+    os.fsync(f.fileno())
 
-def run_eval(gold_file, pred_file, db_path, mode, save_pred_sqls, num_cpus=1, timeout=100):
+def make_db_chunks(pending, timeout, gold_cache, max_rows, max_bytes, chunk_size):
+    '''Group pending questions by db_file and split each group into pool-sized chunks'''
+    groups = defaultdict(list)
+    for question_id, db_file, question, ground_truth, pred_sql in pending:
+        groups[db_file].append((question_id, question, ground_truth, pred_sql))
+    chunks = []
+    for db_file, items in groups.items():
+        for i in range(0, len(items), chunk_size):
+            chunks.append((db_file, items[i:i + chunk_size], timeout, gold_cache, max_rows, max_bytes))
+    # largest databases first so the tail of the run is not one slow group
+    chunks.sort(key=lambda chunk: -len(chunk[1]))
+    return chunks
+
+def run_parallel_eval(pending, num_cpus, timeout, checkpoint_file, gold_cache=None, max_rows=1000000, max_bytes=1 << 30,
+                      chunk_size=16):
+    '''Evaluate pending questions on a process pool, checkpointing each finished chunk'''
+    evaluation_results = []
+    chunks = make_db_chunks(pending, timeout, gold_cache, max_rows, max_bytes, chunk_size)
+    with open(checkpoint_file, 'a') as f, mp.Pool(num_cpus) as pool:
+        with tqdm(total=len(pending)) as pbar:
+            for results in pool.imap_unordered(evaluate_db_chunk, chunks):
+                write_checkpoint(f, results)
+                evaluation_results.extend(results)
+                pbar.update(len(results))
+    return evaluation_results
+
+
+def run_eval(gold_file, pred_file, db_path, mode, save_pred_sqls, num_cpus=1, timeout=100, checkpoint_file='results.txt', gold_cache=None,
+             max_rows=1000000, max_bytes=1 << 30, resume=False):
     evaluation_results = []
     gold = json.load(open(gold_file))
     pred_results = json.load(open(pred_file))
@@ -96,10 +339,26 @@ def run_eval(gold_file, pred_file, db_path, mode, save_pred_sqls, num_cpus=1, ti
         db_files.append(os.path.join(db_path, data["db_id"], data["db_id"] + ".sqlite"))
         questions.append(data["question"])
     print(len(question_ids), len(db_files), len(questions), len(ground_truth_sqls), len(pred_sqls))
-    correctness_count = 0
-    for question_id, db_file, question, ground_truth, pred_sql in tqdm(zip(question_ids, db_files, questions, ground_truth_sqls, pred_sqls), total=len(ground_truth_sqls)):
+
+    finished = start_checkpoint(checkpoint_file, hash_inputs(pred_file, gold_file), resume)
+    pending = [item for item in zip(question_ids, db_files, questions, ground_truth_sqls, pred_sqls)
+               if item[0] not in finished]
+    correctness_count = sum(finished.get(q_id, 0) for q_id in question_ids)
+    if finished:
+        print(f'Resuming from {checkpoint_file}: {len(question_ids) - len(pending)} finished, {len(pending)} pending')
+
+    if num_cpus > 1:
+        for result in run_parallel_eval(pending, num_cpus, timeout, checkpoint_file, gold_cache=gold_cache,
+                                        max_rows=max_rows, max_bytes=max_bytes):
+            correctness_count += result[5]
+        print(correctness_count)
+        return
+
+    gold_store = GoldResultStore(gold_cache) if gold_cache else None
+    for question_id, db_file, question, ground_truth, pred_sql in tqdm(pending, total=len(pending)):
         try:
-            result = run_evaluation(question_id, db_file, question, ground_truth, pred_sql)
+            result = run_evaluation(question_id, db_file, question, ground_truth, pred_sql, timeout=timeout, gold_store=gold_store,
+                                    max_rows=max_rows, max_bytes=max_bytes)
             evaluation_results.append({
                 "question_id": result[0],
                 "db_file": result[1],
@@ -109,7 +368,7 @@ def run_eval(gold_file, pred_file, db_path, mode, save_pred_sqls, num_cpus=1, ti
                 "correctness": result[5]
             })
             correctness_count += result[5]
-            with open('results.txt', 'a') as f:
+            with open(checkpoint_file, 'a') as f:
                 f.write(f'{result[0]}\t{result[5]}\n')
         except KeyboardInterrupt:
             sys.exit(0)
@@ -123,12 +382,15 @@ def run_eval(gold_file, pred_file, db_path, mode, save_pred_sqls, num_cpus=1, ti
                 "pred_sql": pred_sql,
                 "correctness": 0
             })
-            with open('results.txt', 'a') as f:
-                f.write(f'{result[0]}\t0\n')
+            with open(checkpoint_file, 'a') as f:
+                f.write(f'{question_id}\t0\n')
 
+    if gold_store:
+        gold_store.close()
     print(correctness_count)
 
 
 if __name__ == "__main__":
     opt = parse_option()
-    run_eval(opt.gold, opt.pred, opt.db_path, opt.mode, False)
\ No newline at end of file
+    run_eval(opt.gold, opt.pred, opt.db_path, opt.mode, False, num_cpus=opt.num_cpus, timeout=opt.timeout, checkpoint_file=opt.checkpoint, gold_cache=opt.gold_cache,
+             max_rows=opt.max_rows, max_bytes=opt.max_bytes, resume=opt.resume)
\ No newline at end of file